@@ -1,11 +1,16 @@
 """ XnatUtils contains functions to interface with XNAT using Pyxnat."""
 
 
+from collections.abc import Mapping
 import getpass
+import glob
+import hashlib
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 import re
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
 import fnmatch
 import traceback
 import time
@@ -16,9 +21,12 @@ from lxml import etree
 from pyxnat import Interface
 from pyxnat.core.errors import DatabaseError
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import tempfile
+import zipfile
 
+from . import retry
 from . import utilities
 from .utilities import decode_url_json_string
 from .task import (JOB_FAILED, JOB_RUNNING, READY_TO_UPLOAD)
@@ -38,6 +46,9 @@ NS = {'xnat': 'http://nrg.wustl.edu/xnat',
 
 LOGGER = logging.getLogger('dax')
 
+# Bytes read and sent at a time when streaming a zip to XNAT
+ZIP_STREAM_CHUNK = 1024 * 1024
+
 # REST URI for XNAT
 PROJECTS_URI = '/REST/projects'
 PROJECT_URI = '%s/{project}' % PROJECTS_URI
@@ -115,6 +126,9 @@ xnat:imagesessiondata/id,xnat:imagesessiondata/label,{pstype}/procstatus,\
 {pstype}/jobid,{pstype}/jobnode,{pstype}/inputs,{pstype}/out/file/label'''
 EXPERIMENT_POST_URI = '''?columns=ID,URI,subject_label,subject_ID,modality,\
 project,date,xsiType,label,xnat:subjectdata/meta/last_modified'''
+MODIFIED_SESSION_POST_URI = '''?columns=ID,label,subject_ID,xsiType,\
+last_modified&last_modified={since}-'''
+MODIFIED_SINCE_FORMAT = '%m/%d/%Y'
 
 
 SGP_URI = '/REST/subjects?xsiType=xnat:subjectdata\
@@ -194,11 +208,102 @@ SCAN_RENAME = {
     'xsiType': 'XSITYPE'}
 
 
+def record_schema(*fields):
+    """
+    Build the schema shared by all the CompactRecord of one kind
+
+    :param fields: names of the values of a record, in order. A tuple of
+     names gives aliases all reading the same value
+    :return: dictionary of name to value index
+    """
+    schema = dict()
+    for i, names in enumerate(fields):
+        if isinstance(names, str):
+            names = (names,)
+        for name in names:
+            schema[name] = i
+    return schema
+
+
+SCAN_RECORD_SCHEMA = record_schema(
+    ('scan_id', 'scan_label', 'ID', 'label'), ('scan_quality', 'quality'),
+    ('scan_note', 'note'), ('scan_frames', 'frames'),
+    ('scan_description', 'series_description'), ('scan_type', 'type'),
+    'resources')
+
+ASSESSOR_RECORD_FIELDS = (
+    ('ID', 'assessor_id'), ('label', 'assessor_label'),
+    ('uri', 'assessor_uri'), 'procstatus', 'qcstatus', 'proctype', 'version',
+    'xsiType', 'jobid', 'jobstartdate', 'memused', 'walltimeused', 'jobnode',
+    'resources')
+FS_RECORD_SCHEMA = record_schema(*ASSESSOR_RECORD_FIELDS)
+PR_RECORD_SCHEMA = record_schema(
+    *(ASSESSOR_RECORD_FIELDS + ('qcnotes', 'inputs', 'dax_docker_version',
+                                'dax_version', 'dax_version_hash')))
+
+
 ###############################################################################
 #                                    1) CLASS                                 #
 ###############################################################################
 
 
+class CompactRecord(Mapping):
+    """
+    Row of a project listing (scan, assessor) behaving as a dictionary.
+
+    The values of the row are kept in a list indexed by a schema shared by
+    all the records of the same kind, and the session values in a
+    dictionary shared by all the records of the same session, instead of a
+    dictionary with every key for every row.
+    """
+    __slots__ = ('_schema', '_values', '_session', '_extra')
+
+    def __init__(self, schema, values, session):
+        """
+        Entry point for the CompactRecord class
+
+        :param schema: dictionary of key to value index from record_schema
+        :param values: list of the values of the row
+        :param session: dictionary of session values shared with the other
+         rows of the session
+        :return: None
+        """
+        self._schema = schema
+        self._values = values
+        self._session = session
+        self._extra = None
+
+    def __getitem__(self, key):
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        index = self._schema.get(key)
+        if index is not None:
+            return self._values[index]
+        return self._session[key]
+
+    def __setitem__(self, key, value):
+        # Only set on this record: not on the aliases or the session
+        if self._extra is None:
+            self._extra = dict()
+        self._extra[key] = value
+
+    def __iter__(self):
+        for key in self._schema:
+            yield key
+        for key in self._session:
+            if key not in self._schema:
+                yield key
+        for key in self._extra or ():
+            if key not in self._schema and key not in self._session:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class InterfaceTemp(Interface):
     """
     Extends the pyxnat.Interface class to make a temporary directory, write the
@@ -223,13 +328,30 @@ class InterfaceTemp(Interface):
                  timeout_emails=None,
                  xnat_timeout=300,
                  xnat_retries=4,
-                 xnat_wait=600):
+                 xnat_wait=600,
+                 xnat_max_concurrency=8,
+                 xnat_backoff=5,
+                 xnat_breaker_threshold=5,
+                 xnat_breaker_cooldown=300,
+                 xnat_alert_interval=3600):
 
         """Entry point for the InterfaceTemp class.
 
         :param xnat_host: XNAT Host url
         :param xnat_user: XNAT User ID
         :param xnat_pass: XNAT Password
+        :param xnat_timeout: seconds before a request times out
+        :param xnat_retries: number of retries after a timeout
+        :param xnat_wait: maximum seconds to wait between two retries
+        :param xnat_max_concurrency: maximum number of requests run at once
+         by get_many, also the size of the keep-alive connection pool
+        :param xnat_backoff: seconds to wait before the first retry, doubled
+         for each retry (with jitter) up to xnat_wait
+        :param xnat_breaker_threshold: consecutive timeouts before all
+         requests to the host fail fast
+        :param xnat_breaker_cooldown: seconds to fail fast before trying the
+         host again
+        :param xnat_alert_interval: minimum seconds between timeout emails
         :return: None
 
         """
@@ -252,7 +374,15 @@ class InterfaceTemp(Interface):
         self.xnat_timeout = xnat_timeout
         self.xnat_retries = xnat_retries
         self.xnat_wait = xnat_wait
+        self.xnat_max_concurrency = max(1, int(xnat_max_concurrency))
+        self.xnat_backoff = xnat_backoff
         self.timeout_emails = timeout_emails
+        self.demographics = {}
+        self.breaker = retry.get_breaker(
+            self.host,
+            threshold=xnat_breaker_threshold,
+            cooldown=xnat_breaker_cooldown,
+            alert_interval=xnat_alert_interval)
 
         self.authenticate()
 
@@ -269,6 +399,21 @@ class InterfaceTemp(Interface):
         super(InterfaceTemp, self).__init__(server=self.host,
                                             user=self.user,
                                             password=self.pwd)
+        self._mount_pool()
+
+    def _mount_pool(self):
+        """Mount a keep-alive connection pool on the pyxnat http session.
+
+        The pool is sized so that get_many never has to open more
+        connections than xnat_max_concurrency, extra requests wait for a
+        free connection instead.
+        """
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.xnat_max_concurrency,
+            pool_block=True)
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
 
     def disconnect(self):
         super(InterfaceTemp, self).disconnect()
@@ -276,7 +421,9 @@ class InterfaceTemp(Interface):
     def authenticate(self):
         """Authenticate to XNAT.
 
-        Connect to XNAT and try to Disconnect the JSESSION before reconnecting.
+        Connect to XNAT and disconnect the JSESSION. The session cookie is
+        then dropped so that the next request authenticates again, reusing
+        the same connection pool instead of reconnecting.
         Raise XnatAuthentificationError if it failes.
 
         :return: True or False
@@ -284,8 +431,8 @@ class InterfaceTemp(Interface):
         self.connect()
         try:
             self._exec('/data/JSESSION', method='DELETE')
-            # Reconnect the JSession for XNAT
-            self.connect()
+            # Forget the JSession so XNAT gives us a new one
+            self._http.cookies.clear()
             return True
         except DatabaseError as e:
             LOGGER.error(e)
@@ -294,56 +441,120 @@ class InterfaceTemp(Interface):
     def _exec(self, uri, method='GET', body=None, headers=None,
               force_preemptive_auth=False, **kwargs):
 
-        result = None
         LOGGER.debug('_exec:{}:{}'.format(method, uri))
 
-        try:
-            result = super()._exec(
-                    uri, method, body, headers, force_preemptive_auth,
-                timeout=self.xnat_timeout, **kwargs)
-        except (requests.Timeout, requests.ConnectionError):
-            _err = traceback.format_exc()
-            if self.timeout_emails:
-                LOGGER.warn('XNAT timeout, emailing admin')
-
-                # email the exception
-                _msg = '{}\n\n'.format(uri)
-                _msg += 'ERROR:{}'.format(_err)
-                _host = self.smtp_host
-                _to = self.timeout_emails
-                _subj = 'ERROR:XNAT timeout'
-                utilities.send_email_netrc(_host, _to, _subj, _msg)
-            else:
-                LOGGER.warn('XNAT timeout, email disabled:{}'.format(_err))
-
-            # Retries
-            for i in range(self.xnat_retries):
-                # First we sleep
-                LOGGER.debug('retry in {} secs'.format(self.xnat_wait))
-                time.sleep(self.xnat_wait)
+        for i in range(self.xnat_retries + 1):
+            if not self.breaker.allow():
+                # XNAT is down, don't wait on it
+                raise XnatUtilsError('XNAT unavailable:{}'.format(uri))
 
-                # Then we try again
+            if i > 0:
                 LOGGER.debug('retry {} of {}'.format(
-                    str(i + 1), str(self.xnat_retries)))
+                    str(i), str(self.xnat_retries)))
                 LOGGER.debug('_exec:{}:{}'.format(method, uri))
-                try:
-                    result = super()._exec(
-                        uri, method, body, headers, force_preemptive_auth,
-                        timeout=self.xnat_timeout, **kwargs)
-                    break
-                except (requests.Timeout, requests.ConnectionError):
-                    # Do nothing
-                    LOGGER.debug('retry {} timed out'.format(str(i + 1)))
-                    pass
-        except DatabaseError as err:
-            LOGGER.error(err)
-            raise
-
-        if result is None:
-            # None of the retries worked
-            raise XnatUtilsError('XNAT timeout')
-
-        return result
+
+            start_time = time.time()
+            try:
+                result = super()._exec(
+                    uri, method, body, headers, force_preemptive_auth,
+                    timeout=self.xnat_timeout, **kwargs)
+                self.breaker.record_success(time.time() - start_time)
+                return result
+            except (requests.Timeout, requests.ConnectionError):
+                self.breaker.record_failure(time.time() - start_time)
+                if i == 0:
+                    self.alert_timeout(uri, traceback.format_exc())
+                else:
+                    LOGGER.debug('retry {} timed out'.format(str(i)))
+            except DatabaseError as err:
+                # XNAT responded, it is up
+                self.breaker.record_success(time.time() - start_time)
+                LOGGER.error(err)
+                raise
+            except Exception:
+                # Any other error still ends the request, a trial request
+                # must not leave the breaker half open
+                self.breaker.record_failure(time.time() - start_time)
+                raise
+
+            if i < self.xnat_retries and not self.breaker.is_open():
+                delay = retry.backoff_delay(
+                    i, self.xnat_backoff, self.xnat_wait)
+                LOGGER.debug('retry in {:.1f} secs'.format(delay))
+                self.breaker.record_retry()
+                time.sleep(delay)
+
+        # None of the retries worked
+        raise XnatUtilsError('XNAT timeout')
+
+    def alert_timeout(self, uri, err):
+        """Email the admin about a timeout, at most once per alert interval.
+
+        :param uri: uri of the request that timed out
+        :param err: formatted traceback of the timeout
+        :return: None
+        """
+        if not self.timeout_emails:
+            LOGGER.warn('XNAT timeout, email disabled:{}'.format(err))
+            return
+
+        suppressed = self.breaker.should_alert()
+        if suppressed is None:
+            LOGGER.warn('XNAT timeout, email already sent recently')
+            return
+
+        LOGGER.warn('XNAT timeout, emailing admin')
+        _msg = '{}\n\n'.format(uri)
+        if suppressed:
+            _msg += 'timeouts since last email:{}\n\n'.format(suppressed)
+        _msg += 'ERROR:{}'.format(err)
+        try:
+            utilities.send_email_netrc(
+                self.smtp_host, self.timeout_emails, 'ERROR:XNAT timeout', _msg)
+        except Exception as err:
+            LOGGER.error('failed to email admin:{}'.format(err))
+
+    def get_request_stats(self):
+        """Get the retry, circuit breaker and latency counters for the host.
+
+        :return: dictionary of counters
+        """
+        return self.breaker.stats()
+
+    def _map_concurrent(self, func, items):
+        """Apply func to each item using at most xnat_max_concurrency threads.
+
+        :param func: function taking a single item
+        :param items: list of items
+        :return: list of results in the same order as items
+        """
+        items = list(items)
+        if len(items) <= 1 or self.xnat_max_concurrency == 1:
+            return [func(x) for x in items]
+
+        workers = min(self.xnat_max_concurrency, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, items))
+
+    def get_many(self, uris):
+        """
+        Run GET requests for a list of uris concurrently.
+
+        :param uris: list of REST uris
+        :return: list of response contents in the same order as uris
+        """
+        LOGGER.debug('get_many:{} uris'.format(len(uris)))
+        return self._map_concurrent(lambda x: self._exec(x, 'GET'), uris)
+
+    def get_json_many(self, uris):
+        """
+        Run _get_json for a list of uris concurrently.
+
+        :param uris: list of REST uris
+        :return: list of lists of dicts in the same order as uris
+        """
+        LOGGER.debug('get_json_many:{} uris'.format(len(uris)))
+        return self._map_concurrent(self._get_json, uris)
 
     # TODO: string.format wants well-formed strings and will, for example,
     # throw a KeyError if any named variables in the format string are missing.
@@ -500,6 +711,7 @@ class InterfaceTemp(Interface):
         :return: List of all the scans for the project
         """
         scans_dict = dict()
+        sess_dicts = dict()
 
         # Get the sessions list to get the modality:
         session_list = self.get_sessions(project_id)
@@ -509,33 +721,26 @@ class InterfaceTemp(Interface):
              sess['last_modified'], sess['last_updated']])
             for sess in session_list)
 
-        post_uri = SE_ARCHIVE_URI
-        post_uri += SCAN_PROJ_POST_URI.format(project=project_id)
-        scan_list = self._get_json(post_uri)
+        # Get the project scans and the shared scans at the same time
+        post_uris = [SE_ARCHIVE_URI + SCAN_PROJ_POST_URI.format(
+            project=project_id)]
+        if include_shared:
+            post_uris.append(SE_ARCHIVE_URI + SCAN_PROJ_INCLUDED_POST_URI.format(
+                project=project_id))
+        scan_lists = self.get_json_many(post_uris)
 
         pfix = 'xnat:imagescandata'
-        for scan in scan_list:
+        for scan in [x for scan_list in scan_lists for x in scan_list]:
             key = '%s-x-%s' % (scan['ID'], scan['%s/id' % pfix])
             if scans_dict.get(key):
                 res = '%s/file/label' % pfix
                 scans_dict[key]['resources'].append(scan[res])
-            else:
+                continue
+
+            # Values of the session, shared by its scans
+            snew = sess_dicts.get(scan['ID'])
+            if snew is None:
                 snew = {}
-                snew['scan_id'] = scan['%s/id' % pfix]
-                snew['scan_label'] = scan['%s/id' % pfix]
-                snew['scan_quality'] = scan['%s/quality' % pfix]
-                snew['scan_note'] = scan['%s/note' % pfix]
-                snew['scan_frames'] = scan['%s/frames' % pfix]
-                snew['scan_description'] = scan['%s/series_description' % pfix]
-                snew['scan_type'] = scan['%s/type' % pfix]
-                snew['ID'] = scan['%s/id' % pfix]
-                snew['label'] = scan['%s/id' % pfix]
-                snew['quality'] = scan['%s/quality' % pfix]
-                snew['note'] = scan['%s/note' % pfix]
-                snew['frames'] = scan['%s/frames' % pfix]
-                snew['series_description'] =\
-                    scan['%s/series_description' % pfix]
-                snew['type'] = scan['%s/type' % pfix]
                 snew['project_id'] = project_id
                 snew['project_label'] = project_id
                 snew['subject_id'] = scan['xnat:imagesessiondata/subject_id']
@@ -552,58 +757,16 @@ class InterfaceTemp(Interface):
                 snew['age'] = sess_id2mod[scan['ID']][3]
                 snew['last_modified'] = sess_id2mod[scan['ID']][4]
                 snew['last_updated'] = sess_id2mod[scan['ID']][5]
-                snew['resources'] = [scan['%s/file/label' % pfix]]
-                # make a dictionary of dictionaries
-                scans_dict[key] = (snew)
+                sess_dicts[scan['ID']] = snew
 
-        if include_shared:
-            post_uri = SE_ARCHIVE_URI
-            post_uri += SCAN_PROJ_INCLUDED_POST_URI.format(project=project_id)
-            scan_list = self._get_json(post_uri)
-
-            for scan in scan_list:
-                key = '%s-x-%s' % (scan['ID'], scan['%s/id' % pfix])
-                if scans_dict.get(key):
-                    res = '%s/file/label' % pfix
-                    scans_dict[key]['resources'].append(scan[res])
-                else:
-                    snew = {}
-                    snew['scan_id'] = scan['%s/id' % pfix]
-                    snew['scan_label'] = scan['%s/id' % pfix]
-                    snew['scan_quality'] = scan['%s/quality' % pfix]
-                    snew['scan_note'] = scan['%s/note' % pfix]
-                    snew['scan_frames'] = scan['%s/frames' % pfix]
-                    snew['scan_description'] =\
-                        scan['%s/series_description' % pfix]
-                    snew['scan_type'] = scan['%s/type' % pfix]
-                    snew['ID'] = scan['%s/id' % pfix]
-                    snew['label'] = scan['%s/id' % pfix]
-                    snew['quality'] = scan['%s/quality' % pfix]
-                    snew['note'] = scan['%s/note' % pfix]
-                    snew['frames'] = scan['%s/frames' % pfix]
-                    snew['series_description'] = scan['%s/series_description'
-                                                      % pfix]
-                    snew['type'] = scan['%s/type' % pfix]
-                    snew['project_id'] = project_id
-                    snew['project_label'] = project_id
-                    snew['subject_id'] =\
-                        scan['xnat:imagesessiondata/subject_id']
-                    snew['subject_label'] = scan['subject_label']
-                    snew['session_type'] = scan['xsiType'].split('xnat:')[1] \
-                        .split('Session')[0] \
-                        .upper()
-                    snew['session_id'] = scan['ID']
-                    snew['session_label'] = scan['label']
-                    snew['session_uri'] = scan['URI']
-                    snew['handedness'] = sess_id2mod[scan['ID']][0]
-                    snew['gender'] = sess_id2mod[scan['ID']][1]
-                    snew['yob'] = sess_id2mod[scan['ID']][2]
-                    snew['age'] = sess_id2mod[scan['ID']][3]
-                    snew['last_modified'] = sess_id2mod[scan['ID']][4]
-                    snew['last_updated'] = sess_id2mod[scan['ID']][5]
-                    snew['resources'] = [scan['%s/file/label' % pfix]]
-                    # make a dictionary of dictionaries
-                    scans_dict[key] = (snew)
+            scans_dict[key] = CompactRecord(SCAN_RECORD_SCHEMA, [
+                scan['%s/id' % pfix],
+                scan['%s/quality' % pfix],
+                scan['%s/note' % pfix],
+                scan['%s/frames' % pfix],
+                scan['%s/series_description' % pfix],
+                scan['%s/type' % pfix],
+                [scan['%s/file/label' % pfix]]], snew)
 
         return sorted(
             list(scans_dict.values()), key=lambda k: k['session_label'])
@@ -624,12 +787,47 @@ class InterfaceTemp(Interface):
                             sess['yob'], sess['age'], sess['last_modified'],
                             sess['last_updated']]) for sess in session_list)
 
+        # Get the FreeSurfer and genProcData lists at the same time
+        post_uris = dict()
         if has_fs_datatypes(self):
-            # First get FreeSurfer
-            post_uri = SE_ARCHIVE_URI
-            post_uri += ASSESSOR_FS_PROJ_POST_URI.format(
+            post_uris['fs'] = SE_ARCHIVE_URI + ASSESSOR_FS_PROJ_POST_URI.format(
                 project=projectid, fstype=DEFAULT_FS_DATATYPE)
-            assessor_list = self._get_json(post_uri)
+        if has_genproc_datatypes(self):
+            post_uris['pr'] = SE_ARCHIVE_URI + ASSESSOR_PR_PROJ_POST_URI.format(
+                project=projectid, pstype=DEFAULT_DATATYPE)
+        assessor_lists = dict(zip(
+            post_uris.keys(), self.get_json_many(list(post_uris.values()))))
+        fs_list = assessor_lists.get('fs')
+        pr_list = assessor_lists.get('pr')
+
+        sess_dicts = dict()
+
+        def _session_values(asse):
+            # Values of the session, shared by its assessors
+            anew = sess_dicts.get(asse['session_ID'])
+            if anew is None:
+                sess_mod = sess_id2mod[asse['session_ID']]
+                anew = {}
+                anew['project_id'] = projectid
+                anew['project_label'] = projectid
+                sfix = 'xnat:imagesessiondata'
+                anew['subject_id'] = asse['%s/subject_id' % sfix]
+                anew['subject_label'] = sess_mod[0]
+                anew['session_type'] = sess_mod[1]
+                anew['session_id'] = asse['session_ID']
+                anew['session_label'] = asse['session_label']
+                anew['handedness'] = sess_mod[2]
+                anew['gender'] = sess_mod[3]
+                anew['yob'] = sess_mod[4]
+                anew['age'] = sess_mod[5]
+                anew['last_modified'] = sess_mod[6]
+                anew['last_updated'] = sess_mod[7]
+                sess_dicts[asse['session_ID']] = anew
+            return anew
+
+        if fs_list is not None:
+            # First get FreeSurfer
+            assessor_list = fs_list
 
             pfix = DEFAULT_FS_DATATYPE.lower()
             for asse in assessor_list:
@@ -639,57 +837,30 @@ class InterfaceTemp(Interface):
                         res = '%s/out/file/label' % pfix
                         assessors_dict[key]['resources'].append(asse[res])
                     else:
-                        anew = {}
-                        anew['ID'] = asse['ID']
-                        anew['label'] = asse['label']
-                        anew['uri'] = asse['URI']
-                        anew['assessor_id'] = asse['ID']
-                        anew['assessor_label'] = asse['label']
-                        anew['assessor_uri'] = asse['URI']
-                        anew['project_id'] = projectid
-                        anew['project_label'] = projectid
-                        sfix = 'xnat:imagesessiondata'
-                        anew['subject_id'] = asse['%s/subject_id' % sfix]
-                        anew['subject_label'] = asse['subject_label']
-                        anew['session_type'] =\
-                            sess_id2mod[asse['session_ID']][1]
-                        anew['session_id'] = asse['session_ID']
-                        anew['session_label'] = asse['session_label']
-                        anew['procstatus'] = asse['%s/procstatus' % pfix]
-                        anew['qcstatus'] = asse['%s/validation/status' % pfix]
-                        anew['proctype'] = 'FreeSurfer'
-
+                        proctype = 'FreeSurfer'
                         if len(asse['label'].rsplit('-x-FS')) > 1:
-                            anew['proctype'] =\
-                                (anew['proctype'] +
-                                 asse['label'].rsplit('-x-FS')[1])
-
-                        anew['version'] = asse.get('%s/procversion' % pfix)
-                        anew['xsiType'] = asse['xsiType']
-                        anew['jobid'] = asse.get('%s/jobid' % pfix)
-                        anew['jobstartdate'] =\
-                            asse.get('%s/jobstartdate' % pfix)
-                        anew['memused'] = asse.get('%s/memused' % pfix)
-                        anew['walltimeused'] =\
-                            asse.get('%s/walltimeused' % pfix)
-                        anew['jobnode'] = asse.get('%s/jobnode' % pfix)
-                        anew['handedness'] = sess_id2mod[asse['session_ID']][2]
-                        anew['gender'] = sess_id2mod[asse['session_ID']][3]
-                        anew['yob'] = sess_id2mod[asse['session_ID']][4]
-                        anew['age'] = sess_id2mod[asse['session_ID']][5]
-                        anew['last_modified'] =\
-                            sess_id2mod[asse['session_ID']][6]
-                        anew['last_updated'] =\
-                            sess_id2mod[asse['session_ID']][7]
-                        anew['resources'] = [asse['%s/out/file/label' % pfix]]
-                        assessors_dict[key] = anew
-
-        if has_genproc_datatypes(self):
+                            proctype += asse['label'].rsplit('-x-FS')[1]
+
+                        assessors_dict[key] = CompactRecord(FS_RECORD_SCHEMA, [
+                            asse['ID'],
+                            asse['label'],
+                            asse['URI'],
+                            asse['%s/procstatus' % pfix],
+                            asse['%s/validation/status' % pfix],
+                            proctype,
+                            asse.get('%s/procversion' % pfix),
+                            asse['xsiType'],
+                            asse.get('%s/jobid' % pfix),
+                            asse.get('%s/jobstartdate' % pfix),
+                            asse.get('%s/memused' % pfix),
+                            asse.get('%s/walltimeused' % pfix),
+                            asse.get('%s/jobnode' % pfix),
+                            [asse['%s/out/file/label' % pfix]]],
+                            _session_values(asse))
+
+        if pr_list is not None:
             # Then add genProcData
-            post_uri = SE_ARCHIVE_URI
-            post_uri += ASSESSOR_PR_PROJ_POST_URI.format(
-                project=projectid, pstype=DEFAULT_DATATYPE)
-            assessor_list = self._get_json(post_uri)
+            assessor_list = pr_list
 
             pfix = DEFAULT_DATATYPE.lower()
             for asse in assessor_list:
@@ -699,50 +870,27 @@ class InterfaceTemp(Interface):
                         res = '%s/out/file/label' % pfix
                         assessors_dict[key]['resources'].append(asse[res])
                     else:
-                        anew = {}
-                        anew['ID'] = asse['ID']
-                        anew['label'] = asse['label']
-                        anew['uri'] = asse['URI']
-                        anew['assessor_id'] = asse['ID']
-                        anew['assessor_label'] = asse['label']
-                        anew['assessor_uri'] = asse['URI']
-                        anew['project_id'] = projectid
-                        anew['project_label'] = projectid
-                        sfix = 'xnat:imagesessiondata'
-                        anew['subject_id'] = asse['%s/subject_id' % sfix]
-                        anew['subject_label'] =\
-                            sess_id2mod[asse['session_ID']][0]
-                        anew['session_type'] =\
-                            sess_id2mod[asse['session_ID']][1]
-                        anew['session_id'] = asse['session_ID']
-                        anew['session_label'] = asse['session_label']
-                        anew['procstatus'] = asse['%s/procstatus' % pfix]
-                        anew['proctype'] = asse['%s/proctype' % pfix]
-                        anew['qcstatus'] = asse['%s/validation/status' % pfix]
-                        anew['qcnotes'] = asse['%s/validation/notes' % pfix]
-                        anew['version'] = asse['%s/procversion' % pfix]
-                        anew['xsiType'] = asse['xsiType']
-                        anew['jobid'] = asse.get('%s/jobid' % pfix)
-                        anew['jobnode'] = asse.get('%s/jobnode' % pfix)
-                        anew['jobstartdate'] =\
-                            asse.get('%s/jobstartdate' % pfix)
-                        anew['memused'] = asse.get('%s/memused' % pfix)
-                        anew['walltimeused'] =\
-                            asse.get('%s/walltimeused' % pfix)
-                        anew['handedness'] = sess_id2mod[asse['session_ID']][2]
-                        anew['gender'] = sess_id2mod[asse['session_ID']][3]
-                        anew['yob'] = sess_id2mod[asse['session_ID']][4]
-                        anew['age'] = sess_id2mod[asse['session_ID']][5]
-                        anew['last_modified'] =\
-                            sess_id2mod[asse['session_ID']][6]
-                        anew['last_updated'] =\
-                            sess_id2mod[asse['session_ID']][7]
-                        anew['resources'] = [asse['%s/out/file/label' % pfix]]
-                        anew['inputs'] = asse.get('%s/inputs' % pfix)
-                        anew['dax_docker_version'] = asse['%s/dax_docker_version' % pfix]
-                        anew['dax_version'] = asse['%s/dax_version' % pfix]
-                        anew['dax_version_hash'] = asse['%s/dax_version_hash' % pfix]
-                        assessors_dict[key] = anew
+                        assessors_dict[key] = CompactRecord(PR_RECORD_SCHEMA, [
+                            asse['ID'],
+                            asse['label'],
+                            asse['URI'],
+                            asse['%s/procstatus' % pfix],
+                            asse['%s/validation/status' % pfix],
+                            asse['%s/proctype' % pfix],
+                            asse['%s/procversion' % pfix],
+                            asse['xsiType'],
+                            asse.get('%s/jobid' % pfix),
+                            asse.get('%s/jobstartdate' % pfix),
+                            asse.get('%s/memused' % pfix),
+                            asse.get('%s/walltimeused' % pfix),
+                            asse.get('%s/jobnode' % pfix),
+                            [asse['%s/out/file/label' % pfix]],
+                            asse['%s/validation/notes' % pfix],
+                            asse.get('%s/inputs' % pfix),
+                            asse['%s/dax_docker_version' % pfix],
+                            asse['%s/dax_version' % pfix],
+                            asse['%s/dax_version_hash' % pfix]],
+                            _session_values(asse))
 
         return sorted(list(assessors_dict.values()), key=lambda k: k['label'])
 
@@ -781,7 +929,60 @@ class InterfaceTemp(Interface):
         """Given project (string), return list of project's resources"""
         return self._get_json(P_RESOURCES_URI.format(project=project_id))
 
-    def get_sessions(self, projectid=None, subjectid=None):
+    def get_modified_subjects(self, post_uri, modified_since):
+        """
+        Get the subjects with sessions modified since a date, in one query.
+         XNAT filters the sessions by day, the time is checked here.
+
+        :param post_uri: REST uri of the experiments to check
+        :param modified_since: datetime, sessions modified before are ignored
+        :return: set of subject IDs
+        """
+        # A day of slack for the time zone of XNAT
+        since = modified_since - timedelta(days=1)
+        uri = post_uri + MODIFIED_SESSION_POST_URI.format(
+            since=since.strftime(MODIFIED_SINCE_FORMAT))
+
+        subjects = set()
+        for sess in self._get_json(uri):
+            if sess['xsiType'].lower() == 'proc:subjgenprocdata':
+                # Ignore subject assessors
+                continue
+
+            try:
+                last_mod = datetime.strptime(
+                    sess['last_modified'][0:19], '%Y-%m-%d %H:%M:%S')
+            except (KeyError, TypeError, ValueError):
+                # Unknown date, keep the subject to be safe
+                last_mod = modified_since
+
+            if last_mod >= modified_since:
+                subjects.add(sess['subject_ID'])
+
+        LOGGER.debug('{} subjects modified since {}'.format(
+            len(subjects), modified_since))
+        return subjects
+
+    def get_demographics(self, projectid=None, reload=False):
+        """
+        Get the demographics of the subjects of a project, loaded once per
+         interface
+
+        :param projectid: ID of a project on XNAT, None for all the projects
+        :param reload: load them again, e.g. for subjects created since
+        :return: dictionary of subject ID to list of handedness, gender, yob
+         and dob
+        """
+        if reload or projectid not in self.demographics:
+            self.demographics[projectid] = dict(
+                (subj['ID'], [subj['handedness'], subj['gender'],
+                 subj['yob'], subj['dob']])
+                for subj in self.get_subjects(projectid))
+
+        return self.demographics[projectid]
+
+    def get_sessions(self, projectid=None, subjectid=None,
+                     modified_since=None):
         """
         List all the sessions either:
             1) that you have access to
@@ -790,6 +991,8 @@ class InterfaceTemp(Interface):
 
         :param projectid: ID of a project on XNAT
         :param subjectid: ID/label of a subject
+        :param modified_since: datetime, only list the subjects with sessions
+         modified since then, all of their sessions are listed
         :return: List of sessions
         """
         type_list = []
@@ -805,6 +1008,12 @@ class InterfaceTemp(Interface):
         else:
             return None
 
+        subjects = None
+        if modified_since:
+            subjects = self.get_modified_subjects(post_uri, modified_since)
+            if not subjects:
+                return []
+
         # First get a list of all experiment types
         post_uri_types = '%s?columns=xsiType' % post_uri
         sess_list = self._get_json(post_uri_types)
@@ -818,22 +1027,37 @@ class InterfaceTemp(Interface):
             if sess_type not in type_list:
                 type_list.append(sess_type)
 
-        # Get the subjects list to get the subject ID:
-        subj_list = self.get_subjects(projectid)
-        subj_id2lab = dict(
-            (subj['ID'], [subj['handedness'], subj['gender'],
-             subj['yob'], subj['dob']]) for subj in subj_list)
-
         # Get list of sessions for each type since we have to specific
-        # about last_modified field
+        # about last_modified field, the types are queried concurrently
+        post_uri_types = []
         for sess_type in type_list:
             if sess_type.startswith('xnat:') and 'session' in sess_type:
                 add_uri_str = SESSION_POST_URI.format(stype=sess_type)
             else:
                 add_uri_str = NO_MOD_SESSION_POST_URI.format(stype=sess_type)
-            post_uri_type = '%s%s' % (post_uri, add_uri_str)
-            sess_list = self._get_json(post_uri_type)
-
+            post_uri_types.append('%s%s' % (post_uri, add_uri_str))
+
+        type_sess_lists = self.get_json_many(post_uri_types)
+        if subjects is not None:
+            type_sess_lists = [[x for x in sess_list
+                                if x['subject_ID'] in subjects]
+                               for sess_list in type_sess_lists]
+
+        # Get the subjects demographics only if there are sessions
+        if any(type_sess_lists):
+            subj_id2lab = self.get_demographics(projectid)
+            missing = set(x['subject_ID'] for sess_list in type_sess_lists
+                          for x in sess_list).difference(subj_id2lab)
+            if missing:
+                # Subjects created since the demographics were loaded
+                subj_id2lab = self.get_demographics(projectid, reload=True)
+
+                # Subjects still missing, e.g. shared from another project,
+                # are unknown until the next reload
+                for subject_id in missing.difference(subj_id2lab):
+                    subj_id2lab[subject_id] = ['UNK', 'UNK', 'UNK', 'UNK']
+
+        for sess_type, sess_list in zip(type_list, type_sess_lists):
             for sess in sess_list:
                 # Override the project returned to be the one we queried
                 if projectid:
@@ -876,15 +1100,23 @@ class InterfaceTemp(Interface):
         # Return list sorted by label
         return sorted(full_sess_list, key=lambda k: k['session_label'])
 
-    def get_sessions_minimal(self, projectid):
+    def get_sessions_minimal(self, projectid, modified_since=None):
         """
         :param projectid: ID of a project on XNAT
+        :param modified_since: datetime, only list the subjects with sessions
+         modified since then, all of their sessions are listed
         :return: List of sessions
         """
         type_list = []
         full_sess_list = []
         post_uri = ALL_SESS_PROJ_URI.format(project=projectid)
 
+        subjects = None
+        if modified_since:
+            subjects = self.get_modified_subjects(post_uri, modified_since)
+            if not subjects:
+                return []
+
         # First get a list of all experiment types
         post_uri_types = '%s?columns=xsiType' % post_uri
         sess_list = self._get_json(post_uri_types)
@@ -899,11 +1131,15 @@ class InterfaceTemp(Interface):
                 type_list.append(sess_type)
 
         # Get list of sessions for each type since we have to be specific
-        # about last_modified field
-        for sess_type in type_list:
-            post_uri_type = '''{post_uri}?xsiType={stype}&columns=ID,subject_label,subject_ID,xsiType,label,{stype}/meta/last_modified'''.format(
-                post_uri=post_uri, stype=sess_type)
-            sess_list = self._get_json(post_uri_type)
+        # about last_modified field, the types are queried concurrently
+        post_uri_types = ['''{post_uri}?xsiType={stype}&columns=ID,subject_label,subject_ID,xsiType,label,{stype}/meta/last_modified'''.format(
+            post_uri=post_uri, stype=sess_type) for sess_type in type_list]
+        type_sess_lists = self.get_json_many(post_uri_types)
+
+        for sess_type, sess_list in zip(type_list, type_sess_lists):
+            if subjects is not None:
+                sess_list = [x for x in sess_list
+                             if x['subject_ID'] in subjects]
 
             # Sort by label
             sess_list = sorted(sess_list, key=lambda k: k['label'])
@@ -1824,17 +2060,19 @@ def get_proctype(spider, suffix=None):
 ###############################################################################
 #                     2) Query XNAT and Access XNAT obj                       #
 ###############################################################################
-def get_interface(host=None, user=None, pwd=None, smtp_host=None, timeout_emails=None):
+def get_interface(host=None, user=None, pwd=None, smtp_host=None,
+                  timeout_emails=None, **kwargs):
     """
     Opens a connection to XNAT.
 
     :param host: URL to connect to XNAT
     :param user: XNAT username
     :param pwd: XNAT password
+    :param kwargs: other InterfaceTemp arguments (e.g. xnat_max_concurrency)
     :return: InterfaceTemp object which extends functionaly of pyxnat.Interface
 
     """
-    return InterfaceTemp(host, user, pwd, smtp_host, timeout_emails)
+    return InterfaceTemp(host, user, pwd, smtp_host, timeout_emails, **kwargs)
 
 
 def has_dax_datatypes(intf):
@@ -1926,19 +2164,78 @@ def rename_directory_with_assessor_inputs(assessor,directory_path):
         assessor_path = directory_path
     return assessor_path
 
-def upload_file_to_obj(
-        filepath, resource_obj, remove=False, removeall=False, fname=None):
+def get_resource_files(resource_obj):
+    """
+    List the files of a resource on XNAT with a single request
+
+    :param resource_obj: pyxnat EObject of the resource
+    :return: dictionary path in the resource -> dictionary with 'size' and
+     'digest' (md5, empty if XNAT did not compute it). Empty if the resource
+     does not exist.
+
+    """
+    try:
+        rows = resource_obj._intf._get_json('{}/files'.format(
+            resource_obj._uri))
+    except DatabaseError:
+        if not resource_obj.exists():
+            return dict()
+        raise
+
+    files = dict()
+    for row in rows:
+        try:
+            size = int(row.get('Size'))
+        except (TypeError, ValueError):
+            size = None
+        files[row.get('path') or row.get('Name')] = {
+            'size': size, 'digest': row.get('digest', '')}
+    return files
+
+
+def file_md5(filepath):
+    """
+    Compute the md5 of a file like XNAT does for the file digests
+
+    :param filepath: Full path to the file
+    :return: hexadecimal md5 string
+    """
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def is_same_file(filepath, remote_file):
+    """
+    Compare a local file to a file listed by get_resource_files, by size
+     then md5. Files without a digest on XNAT are never the same.
+
+    :param filepath: Full path to the local file
+    :param remote_file: dictionary with 'size' and 'digest' of the XNAT file
+    :return: True if the files are the same, False otherwise
+    """
+    if remote_file['size'] != os.path.getsize(filepath):
+        return False
+    if not remote_file['digest']:
+        return False
+    return remote_file['digest'] == file_md5(filepath)
+
 
+def _upload_file(filepath, resource_obj, remote_files, remove=False,
+                 fname=None):
     """
-    Upload a file to a pyxnat EObject
+    Upload a file to a resource, an existing file is replaced only with
+     remove and unless it has the same md5
 
     :param filepath: Full path to the file to upload
-    :param resource_obj: pyxnat EObject to upload the file to.
-                         Note this should be a resource
-    :param remove: Remove the file if it exists
-    :param removeall: Remove all of the files
+    :param resource_obj: pyxnat EObject of the resource
+    :param remote_files: files of the resource from get_resource_files,
+     updated with the file uploaded
+    :param remove: replace the file if a different one exists
     :param fname: save the file on disk with this value as file name
-    :return: True if upload was OK, False otherwise
+    :return: tuple (True if upload was OK or not needed, file name)
 
     """
     if not os.path.isfile(filepath):  # Check existence of the file
@@ -1947,37 +2244,84 @@ def upload_file_to_obj(
     elif os.path.getsize(filepath) == 0:  # Check for empty file
         err = "%s: empty file, not uploading %s."
         raise XnatUtilsError(err % ('upload_file_to_obj', filepath))
+
+    filepath = utilities.check_image_format(filepath)
+    if fname:
+        filename = fname
+        if filepath.endswith('.gz') and not fname.endswith('.gz'):
+            filename += '.gz'
     else:
-        # Remove previous resource to upload the new one
-        if removeall and resource_obj.exists():
-            resource_obj.delete()
-        filepath = utilities.check_image_format(filepath)
-        if fname:
-            filename = fname
-            if filepath.endswith('.gz') and not fname.endswith('.gz'):
-                filename += '.gz'
-        else:
-            filename = os.path.basename(filepath)
-        if resource_obj.file(str(filename)).exists():
-            if remove:
-                resource_obj.file(str(filename)).delete()
-            else:
-                print(("WARNING: upload_file_to_obj in XnatUtils: resource %s \
+        filename = os.path.basename(filepath)
+
+    if filename in remote_files:
+        if not remove:
+            print(("WARNING: upload_file_to_obj in XnatUtils: resource %s \
 already exists." % filename))
-                return False
-        resource_obj.file(
-            str(filename)).put(
-                str(filepath),
-                overwrite=True,
-                params={"event_reason": "DAX uploading file"})
+            return False, filename
+        elif is_same_file(filepath, remote_files[filename]):
+            LOGGER.debug('file {} unchanged on XNAT, skipping'.format(
+                filename))
+            return True, filename
+
+    resource_obj.file(
+        str(filename)).put(
+            str(filepath),
+            overwrite=True,
+            params={"event_reason": "DAX uploading file"})
+    remote_files[filename] = {'size': os.path.getsize(filepath),
+                              'digest': ''}
+    return True, filename
+
+
+def _delete_other_files(resource_obj, remote_files, keep):
+    """
+    Delete the files of a resource that are not in keep
 
-        return True
+    :param resource_obj: pyxnat EObject of the resource
+    :param remote_files: files of the resource from get_resource_files
+    :param keep: file names to keep
+    :return: None
+    """
+    for filename in sorted(set(remote_files).difference(keep)):
+        LOGGER.debug('deleting file {} from XNAT'.format(filename))
+        resource_obj.file(str(filename)).delete()
+        del remote_files[filename]
+
+
+def upload_file_to_obj(
+        filepath, resource_obj, remove=False, removeall=False, fname=None):
+
+    """
+    Upload a file to a pyxnat EObject. The files of the resource are listed
+     once and, with remove or removeall, the upload is skipped if XNAT
+     already has a file with the same md5.
+
+    :param filepath: Full path to the file to upload
+    :param resource_obj: pyxnat EObject to upload the file to.
+                         Note this should be a resource
+    :param remove: Remove the file if it exists
+    :param removeall: Remove all of the files
+    :param fname: save the file on disk with this value as file name
+    :return: True if upload was OK, False otherwise
+
+    """
+    remote_files = get_resource_files(resource_obj)
+    status, filename = _upload_file(filepath, resource_obj, remote_files,
+                                    remove or removeall, fname)
+    if removeall:
+        # Same result as deleting the resource before the upload
+        _delete_other_files(resource_obj, remote_files, [filename])
+
+    return status
 
 
 def upload_files_to_obj(filepaths, resource_obj, remove=False,
                         removeall=False):
     """
-    Upload a list of files to a resource on XNAT
+    Upload a list of files to a resource on XNAT. The files of the resource
+     are listed once, then with remove or removeall only the files with a
+     different md5 are uploaded.
+
     :param filepaths: list of files to upload
     :param resource_obj: pyxnat EObject to upload all of the files to
     :param remove: remove files that already exist for the resource.
@@ -1985,18 +2329,24 @@ def upload_files_to_obj(filepaths, resource_obj, remove=False,
     :return: True if upload was OK, False otherwise
 
     """
-    # Remove previous resource to upload the new one
-    if removeall and resource_obj.exists():
-        resource_obj.delete()
+    remote_files = get_resource_files(resource_obj)
     status = list()
+    filenames = list()
     for filepath in filepaths:
-        status.append(upload_file_to_obj(filepath, resource_obj, remove=remove,
-                                         removeall=False))
+        file_status, filename = _upload_file(
+            filepath, resource_obj, remote_files, remove or removeall)
+        status.append(file_status)
+        filenames.append(filename)
+
+    if removeall:
+        # Same result as deleting the resource before the upload
+        _delete_other_files(resource_obj, remote_files, filenames)
+
     return status
 
 
 def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
-                         removeall=False, extract=True):
+                         removeall=False, extract=True, stream=False):
     """
     Upload all of the files in a folder based on the pyxnat EObject passed
 
@@ -2008,6 +2358,8 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
     :param remove: Remove the file if it exists if True
     :param removeall: Remove all of the files if they exist if True
     :param extract: extract the files if it's a zip
+    :param stream: zip the files while sending them instead of writing the
+     zip to disk first, falls back to the zip on disk if XNAT refuses it
     :return: True if upload was OK, False otherwise
 
     """
@@ -2027,6 +2379,14 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
                     return False
 
     fzip = '%s.zip' % resource_label
+    if stream:
+        try:
+            put_zip_stream(resource_obj, fzip, directory, extract=extract)
+            return True
+        except (XnatUtilsError, requests.RequestException) as err:
+            LOGGER.warn('streaming upload failed, zipping to disk:{}'.format(
+                err))
+
     try:
         initdir = os.getcwd()
     except FileNotFoundError:
@@ -2048,9 +2408,117 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
     return True
 
 
+class _ZipStream(io.RawIOBase):
+    """ Write-only, unseekable buffer receiving a zip as it is built """
+    def __init__(self):
+        super(_ZipStream, self).__init__()
+        self.chunks = list()
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = list()
+        self.size = 0
+        return data
+
+
+def iter_zip_stream(directory, relpaths=None, chunk_size=ZIP_STREAM_CHUNK):
+    """
+    Zip files of a folder on the fly, holding about chunk_size bytes in
+     memory at a time
+
+    :param directory: Full path of the directory to zip
+    :param relpaths: paths of the files to zip relative to directory,
+     None for all the files
+    :param chunk_size: size of the chunks read and yielded
+    :return: generator of the bytes of the zip
+    """
+    if relpaths is None:
+        relpaths = list()
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(names):
+                relpaths.append(os.path.relpath(os.path.join(root, name),
+                                                directory))
+
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for relpath in relpaths:
+            fpath = os.path.join(directory, relpath)
+            zinfo = zipfile.ZipInfo.from_file(fpath, relpath)
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            # The sizes are only known at the end, make room for large ones
+            large = zinfo.file_size * 1.1 > zipfile.ZIP64_LIMIT
+            with open(fpath, 'rb') as src, \
+                    zf.open(zinfo, 'w', force_zip64=large) as dst:
+                while True:
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+                    dst.write(data)
+                    if sink.size >= chunk_size:
+                        yield sink.pop()
+
+    yield sink.pop()
+
+
+def put_zip_stream(resource_obj, zip_name, directory, relpaths=None,
+                   extract=True):
+    """
+    Upload files of a folder as a zip built while it is sent, with chunked
+     transfer encoding and no temporary file
+
+    :param resource_obj: pyxnat EObject to upload the data to
+    :param zip_name: name of the zip file on XNAT
+    :param directory: Full path of the directory to upload
+    :param relpaths: paths of the files to upload relative to directory,
+     None for all the files
+    :param extract: extract the files of the zip on XNAT
+    :raises: XnatUtilsError if XNAT did not accept the upload
+    :return: None
+    """
+    if not resource_obj.exists():
+        resource_obj.create()
+
+    params = {'overwrite': 'true', 'inbody': 'true',
+              'event_reason': 'DAX uploading file'}
+    if extract:
+        params['extract'] = 'true'
+
+    # Not sent with _exec, the zip stream can not be sent again for a retry,
+    # but with the same timeout and circuit breaker
+    _intf = resource_obj._intf
+    _uri = '{}/files/{}'.format(resource_obj._uri, zip_name)
+    if not _intf.breaker.allow():
+        raise XnatUtilsError('XNAT unavailable:{}'.format(_uri))
+
+    start_time = time.time()
+    try:
+        _resp = _intf.post(
+            _uri, params=params, data=iter_zip_stream(directory, relpaths),
+            timeout=_intf.xnat_timeout)
+    except Exception:
+        _intf.breaker.record_failure(time.time() - start_time)
+        raise
+
+    # XNAT responded, it is up
+    _intf.breaker.record_success(time.time() - start_time)
+    if _resp is None or not _resp.ok:
+        content = _resp.content if _resp is not None else ''
+        raise XnatUtilsError('bad response on post:{}'.format(content))
+
+
 def upload_folder(directory, project_id=None, subject_id=None, session_id=None,
                   scan_id=None, assessor_id=None, resource=None, remove=False,
-                  removeall=False, extract=True):
+                  removeall=False, extract=True, stream=False):
     """
     Upload a folder to some URI in XNAT based on the inputs
 
@@ -2066,6 +2534,7 @@ def upload_folder(directory, project_id=None, subject_id=None, session_id=None,
     :param removeall: Remove all of the files that exist, and upload what is in
                       the local directory.
     :param extract: extract the files if it's a zip
+    :param stream: zip the files while sending them, see upload_folder_to_obj
     :return: True if upload was OK, False otherwise
 
     """
@@ -2079,7 +2548,7 @@ def upload_folder(directory, project_id=None, subject_id=None, session_id=None,
                 project_id, subject_id, session_id, scan_id, assessor_id,
                 resource)
             status = upload_folder_to_obj(directory, resource_obj, resource,
-                                          remove, removeall, extract)
+                                          remove, removeall, extract, stream)
 
     return status
 
@@ -2174,7 +2643,7 @@ class CachedImageSession(object):
     """
     Class to cache the XML information for a session on XNAT
     """
-    def __init__(self, intf, proj, subj, sess):
+    def __init__(self, intf, proj, subj, sess, xml_str=None):
         """
         Entry point for the CachedImageSession class
 
@@ -2182,12 +2651,14 @@ class CachedImageSession(object):
         :param proj: XNAT project ID
         :param subj: XNAT subject ID/label
         :param sess: XNAT session ID/label
+        :param xml_str: session XML already downloaded, fetched if None
         :return: None
 
         """
         self.reset_cached_time()
         experiment = intf.select_experiment(proj, subj, sess)
-        xml_str = experiment.get()
+        if xml_str is None:
+            xml_str = experiment.get()
         self.sess_element = ET.fromstring(xml_str)
         self.project = proj
         self.subject = subj
@@ -2197,8 +2668,10 @@ class CachedImageSession(object):
         self.sess_info_ = None
         self.scans_ = None
         self.assessors_ = None
+        self.assessors_by_label_ = None
         self.datatype_ = None
         self.creation_timestamp_ = None
+        self.cache_path = None
 
     def reset_cached_time(self):
         self.cached_timestamp = datetime.now()
@@ -2207,6 +2680,10 @@ class CachedImageSession(object):
         return 'session'
 
     def reload(self):
+        if self.cache_path and os.path.isfile(self.cache_path):
+            # The session changed since it was cached
+            os.remove(self.cache_path)
+
         experiment = self.intf.select_experiment(
             self.project, self.subject, self.session)
         self.sess_element = ET.fromstring(experiment.get())
@@ -2214,6 +2691,7 @@ class CachedImageSession(object):
         self.sess_info_ = None
         self.scans_ = None
         self.assessors_ = None
+        self.assessors_by_label_ = None
         self.reset_cached_time()
 
     def refresh(self):
@@ -2229,6 +2707,65 @@ class CachedImageSession(object):
             # return value means we didn't refresh
             return False
 
+    def add_assessor(self, assessor_id, label, xsitype, values):
+        """
+        Add an assessor just created on XNAT to the cached XML without
+         downloading the session again
+
+        :param assessor_id: XNAT assessor ID
+        :param label: XNAT assessor label
+        :param xsitype: assessor datatype (e.g proc:genProcData)
+        :param values: dictionary of the values the assessor was created with,
+         keyed as in pyxnat create (e.g proc:genprocdata/proctype)
+        :return: None
+        """
+        assrs_element = self.sess_element.find('xnat:assessors', NS)
+        if assrs_element is None:
+            assrs_element = ET.SubElement(
+                self.sess_element, '{%s}assessors' % NS['xnat'])
+
+        assr_element = ET.SubElement(assrs_element, '{%s}assessor' % NS['xnat'])
+        assr_element.set('{%s}type' % NS['xsi'], xsitype)
+        assr_element.set('ID', assessor_id)
+        assr_element.set('label', label)
+        assr_element.set('project', self.project)
+
+        prefix = xsitype.split(':')[0]
+        for key, value in values.items():
+            name = '%s:%s' % (prefix, key.split('/', 1)[1])
+            _set_element_value(assr_element, name, value)
+
+        if self.assessors_ is not None:
+            cassr = CachedImageAssessor(self.intf, assr_element, self)
+            self.assessors_.append(cassr)
+            if self.assessors_by_label_ is not None:
+                self.assessors_by_label_.setdefault(label, cassr)
+
+    def set_assessor_status(self, label, procstatus, qcstatus):
+        """
+        Set the procstatus and qcstatus of an assessor in the cached XML
+         after setting them on XNAT
+
+        :param label: XNAT assessor label
+        :param procstatus: new procstatus
+        :param qcstatus: new qcstatus
+        :return: None
+        """
+        for cassr in self.assessors():
+            if cassr.label() != label:
+                continue
+
+            assr_element = cassr.assr_element
+            xsitype = assr_element.get('{%s}type' % NS['xsi'])
+            prefix = xsitype.split(':')[0]
+            _set_element_value(
+                assr_element, '%s:procstatus' % prefix, procstatus)
+            _set_element_value(
+                assr_element, 'xnat:validation/status', qcstatus)
+
+            # Drop the info already parsed from the old values
+            cassr.assr_info_ = None
+
     def label(self):
         """
         Get the label of the session
@@ -2344,6 +2881,25 @@ class CachedImageSession(object):
 
         return self.assessors_
 
+    def assessor(self, label):
+        """
+        Get the CachedImageAssessor of the session with a label, from an
+         index by label built the first time
+
+        :param label: XNAT assessor label
+        :return: CachedImageAssessor object, None if not found
+
+        """
+        if self.assessors_by_label_ is None:
+            assessors_by_label = dict()
+            for cassr in self.assessors():
+                # Keep the first one like a search of the list
+                assessors_by_label.setdefault(cassr.label(), cassr)
+
+            self.assessors_by_label_ = assessors_by_label
+
+        return self.assessors_by_label_.get(label)
+
     def info(self):
         """
         Get a dictionary of lots of variables that correspond to the session
@@ -2430,6 +2986,139 @@ class CachedImageSession(object):
         return self.datatype_
 
 
+def _set_element_value(element, name, value):
+    """
+    Set a value in an XML element the way CachedImage*.get() reads it,
+     creating the child element if needed
+
+    :param element: XML element to modify
+    :param name: prefix:tag for the text of a child element or
+     prefix:tag/attribute for an attribute of a child element
+    :param value: string to set
+    :return: None
+    """
+    tag, _, attr = name.partition('/')
+    child = element.find(tag, NS)
+    if child is None:
+        prefix, local = tag.split(':')
+        child = ET.SubElement(element, '{%s}%s' % (NS[prefix], local))
+
+    if attr:
+        child.set(attr, value)
+    else:
+        child.text = value
+
+
+def session_xml_cache_path(cache_dir, sess_info):
+    """
+    Get the path of the cached XML for a session at its last modification
+
+    :param cache_dir: directory of the session XML cache
+    :param sess_info: session dictionary from get_sessions_minimal
+    :return: path of the XML file, None if last_modified is unknown
+    """
+    last_modified = sess_info.get('last_modified')
+    if not last_modified:
+        return None
+
+    key = hashlib.sha1(last_modified.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, sess_info['project_label'],
+                        '{}_{}.xml'.format(sess_info['session_id'], key))
+
+
+def read_session_xml_cache(cache_path):
+    """
+    Read a session XML from the cache
+
+    :param cache_path: path from session_xml_cache_path
+    :return: XML string, None if not cached
+    """
+    if cache_path is None or not os.path.isfile(cache_path):
+        return None
+
+    try:
+        with open(cache_path, 'rb') as f_xml:
+            return f_xml.read()
+    except IOError as err:
+        LOGGER.warn('failed to read cached XML %s:%s' % (cache_path, err))
+        return None
+
+
+def write_session_xml_cache(cache_path, xml_str):
+    """
+    Write a session XML to the cache, replacing the older versions
+
+    :param cache_path: path from session_xml_cache_path
+    :param xml_str: XML string of the session
+    :return: None
+    """
+    if cache_path is None:
+        return
+
+    cache_dir = os.path.dirname(cache_path)
+    sess_id = os.path.basename(cache_path).rsplit('_', 1)[0]
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+        for old_path in glob.glob(os.path.join(cache_dir, sess_id + '_*.xml')):
+            os.remove(old_path)
+
+        if isinstance(xml_str, str):
+            xml_str = xml_str.encode('utf-8')
+
+        # Write then rename so other processes never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f_xml:
+            f_xml.write(xml_str)
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        LOGGER.warn('failed to cache XML %s:%s' % (cache_path, err))
+
+
+def load_cached_sessions(intf, sess_list, cache_dir=None):
+    """
+    Load the CachedImageSession for a list of sessions, downloading the
+     session XML concurrently when the interface supports it.
+
+    :param intf: XnatUtils.InterfaceTemp interface object
+    :param sess_list: list of session dictionaries with project_label,
+     subject_label and session_label
+    :param cache_dir: directory to cache the session XML between runs,
+     a session is only downloaded if its last_modified changed
+    :return: list of CachedImageSession in the same order as sess_list
+    """
+    if cache_dir:
+        cache_paths = [session_xml_cache_path(cache_dir, x)
+                       for x in sess_list]
+    else:
+        cache_paths = [None] * len(sess_list)
+
+    xml_list = [read_session_xml_cache(x) for x in cache_paths]
+    fetch_list = [i for i, xml_str in enumerate(xml_list) if xml_str is None]
+    if cache_dir:
+        LOGGER.debug('session XML cache: %d hit(s), %d miss(es)' % (
+            len(sess_list) - len(fetch_list), len(fetch_list)))
+
+    if hasattr(intf, 'get_many'):
+        uris = ['{}?format=xml'.format(intf.select_experiment(
+            sess_list[i]['project_label'], sess_list[i]['subject_label'],
+            sess_list[i]['session_label'])._uri) for i in fetch_list]
+        for i, xml_str in zip(fetch_list, intf.get_many(uris)):
+            xml_list[i] = xml_str
+            write_session_xml_cache(cache_paths[i], xml_str)
+
+    cached_sessions = list()
+    for x, xml_str, cache_path in zip(sess_list, xml_list, cache_paths):
+        csess = CachedImageSession(
+            intf, x['project_label'], x['subject_label'], x['session_label'],
+            xml_str=xml_str)
+        csess.cache_path = cache_path
+        cached_sessions.append(csess)
+
+    return cached_sessions
+
+
 class CachedImageScan(object):
     """
     Class to cache the XML information for a scan on XNAT
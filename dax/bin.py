@@ -6,7 +6,7 @@
 from datetime import datetime
 import os
 import sys
-from multiprocessing import Pool
+import functools
 import logging
 import importlib.util
 import importlib.machinery
@@ -19,6 +19,7 @@ from . import log
 from . import XnatUtils
 from . import utilities
 from . import processors
+from .upload_service import UploadService
 from .dax_settings import DAX_Settings
 from .errors import DaxError
 DAX_SETTINGS = DAX_Settings()
@@ -438,25 +439,33 @@ def upload(settings_path, max_threads=1):
         logger.info('max uploads already:{}'.format(str(cur_upload_count)))
         return
 
+    if acount == 0:
+        logger.info('nothing to upload')
+        return
+
     logger.info('starting {} upload thread(s)'.format(str(num_threads)))
     sys.stdout.flush()
 
-    pool = Pool(processes=num_threads)
-    for aindex, alabel in enumerate(alist):
-        sys.stdout.flush()
-        pool.apply_async(upload_thread, [host, aindex, alabel, acount, resdir])
+    service = UploadService(
+        host, functools.partial(upload_thread, host, resdir=resdir),
+        lambda: alist, num_workers=min(num_threads, acount),
+        prepare_func=functools.partial(dax_tools_utils.prepare_upload, resdir),
+        prepare_workers=min(num_threads, acount))
+    service.start(watch=False)
+    service.scan()
 
-    logger.info('waiting for upload pool to finish...')
+    logger.info('waiting for upload workers to finish...')
     sys.stdout.flush()
 
-    pool.close()
-    pool.join()
+    service.wait()
+    service.stop()
 
-    logger.info('upload pool finished')
+    logger.info('upload workers finished')
     sys.stdout.flush()
 
 
-def upload_thread(xnat_host, pindex, assessor_label, pcount, resdir):
+def upload_thread(xnat_host, pindex, assessor_label, pcount, resdir,
+                  xnat=None):
     # TODO: move this and associated functions to launcher
     logger = logging.getLogger('dax')
 
@@ -473,30 +482,13 @@ def upload_thread(xnat_host, pindex, assessor_label, pcount, resdir):
         return
 
     try:
-        logger.info('connecting to xnat for upload:{}'.format(xnat_host))
-        # Upload the assessor
-        with XnatUtils.get_interface(xnat_host) as xnat:
-            msg = '*Upload Process:{}/{}:{}'.format(
-                pindex + 1, pcount, assessor_label)
-            logger.info(msg)
-
-            assessor_path = os.path.join(resdir, assessor_label)
-
-            if assessor_utils.is_sgp_assessor(assessor_label):
-                # It's a subject gen proc assessor, handle it specifically
-                dax_tools_utils.upload_assessor_subjgenproc(
-                    xnat, assessor_path)
-            else:
-                assessor_dict = assessor_utils.parse_full_assessor_name(
-                    assessor_label)
-                if assessor_dict:
-                    uploaded = dax_tools_utils.upload_assessor(
-                        xnat, assessor_dict, assessor_path, resdir)
-                    if not uploaded:
-                        msg = 'not uploaded:{}'.format(assessor_label)
-                        logger.warn(msg)
-                else:
-                    logger.warn('     --> wrong label')
+        if xnat is None:
+            logger.info('connecting to xnat for upload:{}'.format(xnat_host))
+            with XnatUtils.get_interface(xnat_host) as xnat:
+                _upload_assessor(xnat, pindex, assessor_label, pcount, resdir)
+        else:
+            # Connection of an upload worker, reused between assessors
+            _upload_assessor(xnat, pindex, assessor_label, pcount, resdir)
     except Exception as err:
         logger.error('error uploading:{}'.format(err))
 
@@ -506,6 +498,30 @@ def upload_thread(xnat_host, pindex, assessor_label, pcount, resdir):
         lockfiles.unlock_flagfile(lock_file)
 
 
+def _upload_assessor(xnat, pindex, assessor_label, pcount, resdir):
+    logger = logging.getLogger('dax')
+    msg = '*Upload Process:{}/{}:{}'.format(
+        pindex + 1, pcount, assessor_label)
+    logger.info(msg)
+
+    assessor_path = os.path.join(resdir, assessor_label)
+
+    if assessor_utils.is_sgp_assessor(assessor_label):
+        # It's a subject gen proc assessor, handle it specifically
+        dax_tools_utils.upload_assessor_subjgenproc(xnat, assessor_path)
+    else:
+        assessor_dict = assessor_utils.parse_full_assessor_name(
+            assessor_label)
+        if assessor_dict:
+            uploaded = dax_tools_utils.upload_assessor(
+                xnat, assessor_dict, assessor_path, resdir)
+            if not uploaded:
+                msg = 'not uploaded:{}'.format(assessor_label)
+                logger.warn(msg)
+        else:
+            logger.warn('     --> wrong label')
+
+
 def undo_processing(assessor_label, logger=None):
     """
     Unset job information for the assessor on XNAT, Delete files, set to run.
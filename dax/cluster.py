@@ -7,13 +7,14 @@ Cluster functionality
 """
 
 import os
+import re
 import time
 import logging
 import subprocess as sb
 from datetime import datetime
 
 from .dax_settings import DAX_Settings
-from .errors import ClusterError
+from .errors import ClusterError, ClusterLaunchException
 
 
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
@@ -98,6 +99,59 @@ def count_jobs_rcq(resdir, job_rungroup, force_no_qsub=False):
         raise ClusterLaunchException
 
 
+class QueueSnapshot(object):
+    """
+    Counts of the jobs on the cluster, fetched once then updated locally as
+     jobs are submitted. The counts are fetched again from the cluster
+     every resync_interval seconds.
+    """
+    def __init__(self, count_func, resync_interval=60):
+        """
+        Entry point for the QueueSnapshot class
+
+        :param count_func: function returning the counts from the cluster as
+         a tuple (launched, pending, pendinguploads), e.g count_jobs
+        :param resync_interval: seconds before fetching the counts again,
+         0 to fetch them every time
+        :return: None
+        """
+        self.count_func = count_func
+        self.resync_interval = resync_interval
+        self.launched = 0
+        self.pending = 0
+        self.pendinguploads = 0
+        self.synced_at = None
+
+    def sync(self):
+        """
+        Fetch the counts from the cluster
+
+        :return: None
+        """
+        self.launched, self.pending, self.pendinguploads = self.count_func()
+        self.synced_at = time.time()
+
+    def counts(self):
+        """
+        Get the counts, fetching them from the cluster if they are too old
+
+        :return: tuple (launched, pending, pendinguploads)
+        """
+        if self.synced_at is None or \
+           time.time() - self.synced_at >= self.resync_interval:
+            self.sync()
+        return (self.launched, self.pending, self.pendinguploads)
+
+    def job_submitted(self):
+        """
+        Count a job just submitted, it is pending until the next sync
+
+        :return: None
+        """
+        self.launched += 1
+        self.pending += 1
+
+
 def job_status(jobid):
     """
     Get the status for a job on the cluster
@@ -128,6 +182,133 @@ def job_status(jobid):
         return None
 
 
+def bulk_job_status():
+    """
+    Get the status of all the jobs in the queue with a single query
+
+    :return: dictionary jobid -> status ('R', 'Q' or None like job_status),
+     None if the queue could not be read
+    """
+    cmd = DAX_SETTINGS.get_cmd_get_job_status_all()
+    LOGGER.debug(str(cmd).strip())
+
+    try:
+        output = sb.check_output(cmd, stderr=sb.STDOUT, shell=True)
+    except sb.CalledProcessError as e:
+        LOGGER.debug(str(e))
+        return None
+
+    statuses = dict()
+    for line in output.decode().splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+
+        jobid, state = fields[0], fields[1]
+        if state == DAX_SETTINGS.get_running_status():
+            statuses[jobid] = 'R'
+        elif state == DAX_SETTINGS.get_queue_status():
+            statuses[jobid] = 'Q'
+        else:
+            statuses[jobid] = None
+
+    return statuses
+
+
+def bulk_job_usage(jobids, chunk_size=500):
+    """
+    Get the usage of several finished jobs, one query per chunk of jobs
+
+    :param jobids: list of job ids to check
+    :param chunk_size: maximum number of job ids per query
+    :return: dictionary jobid -> dictionary with 'mem_used', 'walltime_used',
+     'jobnode' like tracejob_info, jobs not found are not in the dictionary
+    """
+    usage = dict()
+    jobids = sorted(set(j for j in jobids if j and j not in ['0', 'no_qsub']))
+    for i in range(0, len(jobids), chunk_size):
+        cmd = DAX_SETTINGS.get_cmd_get_job_usage_all()\
+                          .safe_substitute({
+                              'jobids': ','.join(jobids[i:i + chunk_size])})
+        LOGGER.debug(str(cmd).strip())
+
+        try:
+            output = sb.check_output(cmd, stderr=sb.STDOUT, shell=True)
+            if output.startswith(b'sacct: error'):
+                raise ClusterError(output)
+        except (sb.CalledProcessError, ClusterError) as e:
+            LOGGER.debug(str(e))
+            continue
+
+        for line in output.decode().splitlines():
+            fields = line.strip().split('|')
+            if len(fields) < 4 or not fields[0].endswith('.batch'):
+                continue
+
+            # Keep the leading number of MaxRSS like awk '{print $1+0}'
+            mem = re.match(r'[0-9.]*', fields[1]).group(0) or '0'
+            usage[fields[0][:-len('.batch')]] = {
+                'mem_used': mem,
+                'walltime_used': fields[2],
+                'jobnode': fields[3]}
+
+    return usage
+
+
+class JobSnapshot(object):
+    """
+    Status and usage of the jobs on the cluster, each fetched with a single
+     query the first time a job asks for it. The usage is fetched for the
+     expected jobs missing from the queue, i.e. the ones that just finished.
+    """
+    def __init__(self, jobids=None):
+        """
+        Entry point for the JobSnapshot class
+
+        :param jobids: job ids of the tasks to update
+        :return: None
+        """
+        self.jobids = set(jobids or [])
+        self.statuses = None
+        self.usage = None
+
+    def job_status(self, jobid):
+        """
+        Get the status of a job, same values as job_status
+
+        :param jobid: job id to check
+        :return: job status
+        """
+        if self.statuses is None:
+            self.statuses = bulk_job_status()
+            if self.statuses is None:
+                # Could not read the queue, ask for each job
+                self.statuses = dict()
+
+        if jobid in self.statuses:
+            return self.statuses[jobid]
+
+        # Not in the queue: finished or launched after the snapshot
+        return job_status(jobid)
+
+    def tracejob_info(self, jobid, jobdate):
+        """
+        Get the usage of a finished job, same values as tracejob_info
+
+        :param jobid: job id to check
+        :param jobdate: launching date of the job
+        :return: dictionary object with 'mem_used', 'walltime_used', 'jobnode'
+        """
+        if self.usage is None:
+            finished = self.jobids.difference(self.statuses or [])
+            self.usage = bulk_job_usage(finished)
+
+        if jobid in self.usage:
+            return self.usage[jobid]
+
+        return tracejob_info(jobid, jobdate)
+
+
 def is_traceable_date(jobdate):
     """
     Check if the job is traceable on the cluster
@@ -1,4 +1,5 @@
 from multiprocessing import Pool
+import functools
 import os
 from datetime import datetime
 import copy
@@ -20,6 +21,7 @@ from .errors import AutoProcessorError, DaxError
 from . import utilities
 from . import rcq
 from .XnatUtils import get_interface
+from .upload_service import UploadService
 
 # dax manager has 3 main classes: DaxManager has a DaxProjectSettingsManager
 # which is a collection of DaxProjectSettings.
@@ -715,28 +717,26 @@ class DaxManager(object):
 
         return build_results
 
-    def queue_uploads(self, upload_pool, run_time):
-        xnat_host = self.xnat_host
-        resdir = self.res_dir
-        assessors_list = dax_tools_utils.get_assessor_list('', resdir)
-        pcount = len(assessors_list)
-
-        # Array to store result accessors
-        upload_results = [None] * pcount
-
-        # Queue each assessor to be uploaded
-        for pindex, alabel in enumerate(assessors_list):
-            logfile = self.log_name(
-                'upload' + str(pindex),
-                'upload',
-                run_time)
-
-            LOGGER.info(f'queue for upload:{pindex}:{alabel}:{logfile}')
-            upload_results[pindex] = upload_pool.apply_async(
-                run_upload_thread,
-                [logfile, xnat_host, pindex, alabel, pcount, resdir])
-
-        return upload_results
+    def start_uploads(self, num_workers, run_time):
+        # Workers upload the assessors found in resdir until the end of run
+        upload_service = UploadService(
+            self.xnat_host,
+            functools.partial(self.run_upload, run_time),
+            functools.partial(
+                dax_tools_utils.get_assessor_list, '', self.res_dir),
+            num_workers=num_workers,
+            prepare_func=functools.partial(
+                dax_tools_utils.prepare_upload, self.res_dir),
+            prepare_workers=num_workers)
+        upload_service.start()
+        return upload_service
+
+    def run_upload(self, run_time, pindex, alabel, pcount, xnat=None):
+        logfile = self.log_name('upload' + str(pindex), 'upload', run_time)
+        LOGGER.info(f'upload:{pindex}:{alabel}:{logfile}')
+        run_upload_thread(
+            logfile, self.xnat_host, pindex, alabel, pcount, self.res_dir,
+            xnat=xnat)
 
     def run(self):
         run_time = datetime.now()
@@ -750,9 +750,7 @@ class DaxManager(object):
         build_results = None
         num_build_threads = 0
         max_upload_count = self.max_upload_count
-        upload_pool = None
-        upload_results = None
-        num_upload_threads = 0
+        upload_service = None
 
         try:
 
@@ -822,9 +820,8 @@ class DaxManager(object):
                     LOGGER.info('max uploads already:{}'.format(cur_upload_count))
                 else:
                     LOGGER.info('starting {} more uploads'.format(num_upload_threads))
-                    upload_pool = Pool(processes=num_upload_threads)
-                    upload_results = self.queue_uploads(upload_pool, run_time)
-                    upload_pool.close()
+                    upload_service = self.start_uploads(
+                        num_upload_threads, run_time)
 
             if self._rcq:
                 _projects = self.settings_manager.project_names()
@@ -853,6 +850,10 @@ class DaxManager(object):
                     self.rcq_update()
                     rcq_count += 1
 
+                    if upload_service:
+                        # Workers are restarted from this thread only
+                        upload_service.check_workers()
+
                     # Show current results
                     if num_build_threads > 0 and not all([x.ready() for x in build_results]):
                         LOGGER.info(f'builds:resultsize={len(build_results)}:poolsize={len(build_pool._pool)}')
@@ -865,16 +866,10 @@ class DaxManager(object):
                         for i, p in enumerate(build_pool._pool):
                             LOGGER.info(f'build thread {i}:pid:{p.pid}:{p.is_alive()}:exit={p.exitcode}')
 
-                    elif num_upload_threads > 0 and not all([x.ready() for x in upload_results]):
-                        LOGGER.info(f'uploads:{len(upload_results)} assessors:{len(upload_pool._pool)} threads')
-                        for i, r in enumerate(upload_results):
-                            try:
-                                LOGGER.info(f'{i}:ready={r.ready()}:result={r.get(timeout=timeout)}')
-                            except:
-                                pass
-
-                        for i, p in enumerate(upload_pool._pool):
-                            LOGGER.info(f'upload thread {i}:pid:{p.pid}:{p.is_alive()}:exit={p.exitcode}')
+                    elif upload_service and upload_service.pending() > 0:
+                        LOGGER.info(f'uploads:{upload_service.status()}')
+                        for i, p in enumerate(upload_service.workers):
+                            LOGGER.info(f'upload worker {i}:pid:{p.pid}:{p.is_alive()}:exit={p.exitcode}')
                     else:
                         LOGGER.info('all builds and uploads done')
                         break
@@ -889,14 +884,15 @@ class DaxManager(object):
                 build_errors = [x.get() for x in build_results if x.get()]
                 run_errors.extend(build_errors)
 
-            if self.is_enabled_upload() and num_upload_threads > 0:
-                # Wait for upload pool of threads to finish all uploads
+            if upload_service:
+                # Wait for the upload workers to finish all uploads
                 LOGGER.info('waiting for uploads to finish')
-                upload_pool.join()
+                upload_service.wait()
+                upload_errors = upload_service.stop()
+                upload_service = None
                 LOGGER.info('uploads complete!')
 
-                # Extract any errors and add to list
-                upload_errors = [x.get() for x in upload_results if x.get()]
+                # Add errors to list
                 run_errors.extend(upload_errors)
 
             if run_errors:
@@ -910,8 +906,8 @@ class DaxManager(object):
             if build_pool:
                 build_pool.join()
 
-            if upload_pool:
-                upload_pool.join()
+            if upload_service:
+                upload_service.stop()
 
         return run_errors
 
@@ -1122,7 +1118,8 @@ class DaxManager(object):
         LOGGER.info('TBD:delete assessors from diskq/rcq that no longer exist on XNAT')
 
 
-def run_upload_thread(logfile, xnat_host, pindex, alabel, pcount, resdir):
+def run_upload_thread(logfile, xnat_host, pindex, alabel, pcount, resdir,
+                      xnat=None):
     # Confirm that assessor is still in queue,
     # it could have been uploaded by a different thread
     if not os.path.exists(os.path.join(resdir, alabel)):
@@ -1137,7 +1134,8 @@ def run_upload_thread(logfile, xnat_host, pindex, alabel, pcount, resdir):
 
     logging.getLogger('dax').handlers = []
     dax.bin.set_logger(logfile, debug=True)
-    dax.bin.upload_thread(xnat_host, pindex, alabel, pcount, resdir)
+    dax.bin.upload_thread(
+        xnat_host, pindex, alabel, pcount, resdir, xnat=xnat)
     logging.getLogger('dax').handlers = []
 
 
@@ -31,6 +31,10 @@ SLURM_JOBNODE = "sacct -j ${jobid}.batch --format NodeList --noheader"
 
 SLURM_JOBSTATUS = "squeue -j ${jobid} --noheader | awk {'print $5'}"
 
+SLURM_JOBSTATUS_ALL = "squeue --me --noheader --format '%i %t'"
+
+SLURM_JOBUSAGE_ALL = "sacct -j ${jobids} --format JobID,MaxRss,CPUTime,NodeList --noheader --parsable2"
+
 SLURM_EXT = '.slurm'
 
 SLURM_SUBMIT = 'sbatch'
@@ -139,6 +143,12 @@ class DAX_Settings(object):
     def get_cmd_get_job_status(self):
         return Template(SLURM_JOBSTATUS)
 
+    def get_cmd_get_job_status_all(self):
+        return SLURM_JOBSTATUS_ALL
+
+    def get_cmd_get_job_usage_all(self):
+        return Template(SLURM_JOBUSAGE_ALL)
+
     def get_queue_status(self):
         return SLURM_QUEUED
 
@@ -172,6 +182,11 @@ class DAX_Settings(object):
     def get_email_opts(self):
         return 'FAIL'
 
+    def get_upload_stream_resources(self):
+        # Comma separated labels of the resources zipped while they are sent
+        value = os.environ.get('DAX_UPLOAD_STREAM_RESOURCES', '')
+        return [x.strip() for x in value.split(',') if x.strip()]
+
     def get_job_template(self, filepath):
         filepath = os.path.expanduser(filepath)
 
@@ -14,8 +14,16 @@ import logging
 import os
 import shutil
 import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool
 import re
+import requests
+import shlex
+import subprocess as sb
 
 from . import bin
 from . import XnatUtils
@@ -54,8 +62,26 @@ _TRASH = 'TRASH'
 _PBS = 'PBS'
 _FLAG_FILES = 'FlagFiles'
 _UPLOAD_SKIP_LIST = [_OUTLOG, _TRASH, _PBS, _FLAG_FILES, 'TRIALSQ', 'SAVE', 'DISKQ']
+_UPLOAD_STATE_FILE = 'UPLOAD_STATE.json'
+_UPLOAD_INDEX_FILE = '.upload_index.json'
+# States of the assessor folders in the upload index
+_UPLOAD_STATE_EMAILED = 'emailed'
+_UPLOAD_STATE_RUNNING = 'running'
+_UPLOAD_STATE_NOT_COMPLETED = 'not_completed'
+_UPLOAD_STATE_READY = 'ready'
+# Seconds before a folder mtime is trusted by the upload index
+UPLOAD_INDEX_MTIME_SLACK = 2
+# Resources uploaded at the same time for one assessor
+UPLOAD_RESOURCE_WORKERS = 4
+# Limits of each zip uploaded for a folder, completion is saved per zip
+UPLOAD_BATCH_FILES = 1000
+UPLOAD_BATCH_BYTES = 1024 ** 3
 SNAPSHOTS_ORIGINAL = 'snapshot_original.png'
 SNAPSHOTS_PREVIEW = 'snapshot_preview.png'
+# md5 of the PDF the snapshots were made from
+_SNAPSHOTS_MD5_FILE = '.snapshots_md5'
+# Seconds before a ghostscript call for the snapshots is killed
+SNAPSHOT_TIMEOUT = 300
 DEFAULT_HEADER = ['host', 'username', 'password', 'projects']
 
 # Cmd:
@@ -165,6 +191,103 @@ def is_dax_upload_running(flagfile):
         return False
 
 
+class ResdirIndex(object):
+    """
+    Upload state of the assessor folders of the upload directory, saved
+     between scans. A folder is checked again only when its mtime changed,
+     which happens when a flag file is added to or removed from it.
+    """
+    def __init__(self, resdir):
+        """
+        Entry point for the ResdirIndex class
+
+        :param resdir: upload directory
+        :return: None
+        """
+        self.resdir = resdir
+        self.path = os.path.join(resdir, _UPLOAD_INDEX_FILE)
+        self.entries = dict()
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            # No index yet or unreadable, all the folders are checked
+            pass
+
+    def _save(self):
+        # Write to a temp file first so the index is never half written
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.resdir, prefix=_UPLOAD_INDEX_FILE)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def scan(self):
+        """
+        Get the upload state of the assessor folders, oldest first
+
+        :return: list of tuples (assessor label, state)
+        """
+        # Recent mtimes are not trusted, their resolution can be a second
+        # or more on network filesystems
+        recent = time.time() - UPLOAD_INDEX_MTIME_SLACK
+        entries = dict()
+        found = list()
+        with os.scandir(self.resdir) as it:
+            for entry in it:
+                if entry.name in _UPLOAD_SKIP_LIST or not entry.is_dir():
+                    continue
+
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    # Removed since listed, uploaded by another process
+                    continue
+
+                cached = self.entries.get(entry.name)
+                if cached and cached[0] == mtime:
+                    state = cached[1]
+                else:
+                    state = get_upload_state(entry.path)
+
+                if mtime < recent:
+                    entries[entry.name] = [mtime, state]
+
+                found.append((mtime, entry.name, state))
+
+        if entries != self.entries:
+            self.entries = entries
+            try:
+                self._save()
+            except (IOError, OSError) as err:
+                LOGGER.warn('failed to save upload index:{}'.format(err))
+
+        found.sort()
+        return [(label, state) for _, label, state in found]
+
+
+def get_upload_state(assessor_path):
+    """
+    Get the upload state of an assessor folder from its flag files
+
+    :param assessor_path: path of the assessor folder
+    :return: one of the _UPLOAD_STATE_* values
+    """
+    try:
+        files = set(os.listdir(assessor_path))
+    except OSError:
+        return _UPLOAD_STATE_RUNNING
+
+    if _EMAILED_FLAG_FILE in files:
+        return _UPLOAD_STATE_EMAILED
+    elif _READY_FLAG_FILE not in files and _FAILED_FLAG_FILE not in files:
+        return _UPLOAD_STATE_RUNNING
+    elif _COMPLETE_FLAG_FILE not in files:
+        return _UPLOAD_STATE_NOT_COMPLETED
+    else:
+        return _UPLOAD_STATE_READY
+
+
 def get_assessor_list(projects, resdir):
     """
     Get the list of assessors labels to upload to XNAT from the queue folder.
@@ -175,34 +298,22 @@ def get_assessor_list(projects, resdir):
     assessor_label_list = list()
 
     LOGGER.debug(' - Get Processes names from the upload folder...')
-    # check all files/folder in the directory
-    dirs = list(filter(os.path.isdir,glob.glob(os.path.join(resdir, '*'))))
-    dirs.sort(key=lambda x: os.path.getmtime(x))
-    for assessor_label in dirs:
-        assessor_label = os.path.basename(assessor_label)
-        if assessor_label in _UPLOAD_SKIP_LIST:
-            continue
+    # check the folders changed since the last scan
+    for assessor_label, state in ResdirIndex(resdir).scan():
         # If projects set, check that the project is in the list of projects
         # to upload to XNAT
         if projects and assessor_label.split('-x-')[0] not in projects:
             continue
 
-        assessor_path = os.path.join(resdir, assessor_label)
-        if not os.path.isdir(assessor_path):
-            continue
-        if os.path.exists(os.path.join(assessor_path, _EMAILED_FLAG_FILE)):
+        if state == _UPLOAD_STATE_EMAILED:
             LOGGER.debug('skipping, exists on XNAT:{}'.format(assessor_label))
             continue
 
-        rflag = os.path.join(assessor_path, _READY_FLAG_FILE)
-        fflag = os.path.join(assessor_path, _FAILED_FLAG_FILE)
-        cflag = os.path.join(assessor_path, _COMPLETE_FLAG_FILE)
-
-        if not (os.path.exists(rflag) or os.path.exists(fflag)):
+        if state == _UPLOAD_STATE_RUNNING:
             LOGGER.debug('skipping, still running:{}'.format(assessor_label))
             continue
 
-        if not os.path.exists(cflag):
+        if state == _UPLOAD_STATE_NOT_COMPLETED:
             LOGGER.debug('skipping, not completed:{}'.format(assessor_label))
             continue
 
@@ -271,9 +382,40 @@ def get_dax_docker_version_assessor(assessor_path):
     return dax_docker_version
 
 
+def _run_snapshot_cmd(cmd, **kwargs):
+    """
+    Run a ghostscript command for the snapshots, killed after
+     SNAPSHOT_TIMEOUT seconds
+
+    :param cmd: command template, one of the GS_CMD strings
+    :param kwargs: values of the fields of the template
+    :return: True if the command succeeded, False otherwise
+    """
+    # Format each argument so the paths do not need quoting
+    args = [x.format(**kwargs) for x in shlex.split(cmd)]
+    LOGGER.debug(' '.join(args))
+    try:
+        sb.run(args, stdout=sb.DEVNULL, stderr=sb.DEVNULL,
+               timeout=SNAPSHOT_TIMEOUT, check=True)
+    except sb.TimeoutExpired:
+        LOGGER.warn('snapshot command timed out:{}'.format(' '.join(args)))
+        return False
+    except (sb.CalledProcessError, OSError) as err:
+        LOGGER.warn('snapshot command failed:{}'.format(err))
+        return False
+
+    return True
+
+
+def _snapshot_exists(snapshot_path):
+    return os.path.exists(snapshot_path) and \
+        os.path.getsize(snapshot_path) > 0
+
+
 def generate_snapshots(assessor_path):
     """
-    Generate Snapshots from the PDF if it exists.
+    Generate Snapshots from the first page of the PDF if it exists. They are
+     generated again only when the md5 of the PDF changed.
 
     :param assessor_path: path for the assessor
     :return: None
@@ -281,22 +423,37 @@ def generate_snapshots(assessor_path):
     snapshot_dir = os.path.join(assessor_path, 'SNAPSHOTS')
     snapshot_original = os.path.join(snapshot_dir, SNAPSHOTS_ORIGINAL)
     snapshot_preview = os.path.join(snapshot_dir, SNAPSHOTS_PREVIEW)
+    hash_path = os.path.join(assessor_path, _SNAPSHOTS_MD5_FILE)
     try:
         pdf_path = glob.glob(assessor_path + '/PDF/*.pdf')[0]
     except Exception as err:
         LOGGER.debug('skipping generate_snapshots:{}:err={}'.format(assessor_path, err))
         return False
 
-    if not os.path.exists(snapshot_original):
-        LOGGER.debug('    +creating original of SNAPSHOTS')
+    pdf_md5 = XnatUtils.file_md5(pdf_path)
+    if os.path.exists(snapshot_original):
+        try:
+            with open(hash_path, 'r') as f:
+                snapshot_md5 = f.read().strip()
+        except IOError:
+            # Snapshots made before the hash was saved, keep them
+            snapshot_md5 = pdf_md5
+
+        if snapshot_md5 == pdf_md5 and _snapshot_exists(snapshot_preview):
+            LOGGER.debug('    +snapshots up to date')
+            return
+
+        LOGGER.debug('    +PDF changed, removing SNAPSHOTS')
+        for snapshot in [snapshot_original, snapshot_preview]:
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
 
-        if not os.path.exists(snapshot_dir):
-            os.mkdir(snapshot_dir)
+    LOGGER.debug('    +creating original of SNAPSHOTS')
+    if not os.path.exists(snapshot_dir):
+        os.mkdir(snapshot_dir)
 
-        # Make the snapshots for the assessors with ghostscript
-        cmd = GS_CMD.format(original=snapshot_original, pdf_path=pdf_path)
-        LOGGER.debug(cmd)
-        os.system(cmd)
+    # Make the snapshots for the assessors with ghostscript
+    _run_snapshot_cmd(GS_CMD, original=snapshot_original, pdf_path=pdf_path)
 
     # Check for empty file
     if os.path.exists(snapshot_original) and os.stat(snapshot_original).st_size == 0:
@@ -304,18 +461,36 @@ def generate_snapshots(assessor_path):
         os.remove(snapshot_original)
 
         # Try the alternate ghostscript call
-        cmd = GS_CMD2.format(original=snapshot_original, pdf_path=pdf_path)
-        LOGGER.debug(cmd)
-        os.system(cmd)
+        _run_snapshot_cmd(
+            GS_CMD2, original=snapshot_original, pdf_path=pdf_path)
 
     # Create the preview snapshot from the original if Snapshots exist
     if os.path.exists(snapshot_original):
         # Make the snapshot_thumbnail
         LOGGER.debug('    +creating preview of SNAPSHOTS')
-        cmd = CONVERT_CMD.format(
-            original=pdf_path, preview=snapshot_preview)
-        LOGGER.debug(cmd)
-        os.system(cmd)
+        made = _run_snapshot_cmd(
+            CONVERT_CMD, original=pdf_path, preview=snapshot_preview)
+
+        # Save the md5 only with both snapshots, so a failed one is made
+        # again by the next upload
+        if made and _snapshot_exists(snapshot_original) and \
+           _snapshot_exists(snapshot_preview):
+            with open(hash_path, 'w') as f:
+                f.write(pdf_md5)
+        else:
+            LOGGER.warn('failed to make SNAPSHOTS:{}'.format(assessor_path))
+
+
+def prepare_upload(resdir, assessor_label):
+    """
+    Generate the snapshots of an assessor before its upload, run by the
+     snapshot workers of the upload service
+
+    :param resdir: upload directory
+    :param assessor_label: label of the assessor
+    :return: None
+    """
+    generate_snapshots(os.path.join(resdir, assessor_label))
 
 
 def copy_outlog(assessor_dict, assessor_path, resdir):
@@ -432,12 +607,15 @@ def should_upload_assessor(assessor_obj,
     return True
 
 
-def upload_assessor(xnat, assessor_dict, assessor_path, resdir):
+def upload_assessor(xnat, assessor_dict, assessor_path, resdir,
+                    stream_resources=None):
     """
     Upload results to an assessor
 
     :param xnat: pyxnat.Interface object
     :param assessor_dict: assessor dictionary
+    :param stream_resources: labels of the resources to zip while sending
+     them, from the DAX settings if None
     :return: None
     """
     # get spiderpath from version.txt file:
@@ -488,24 +666,9 @@ unable to find XML file: %s'
 
         # Upload
         # for each folder=resource in the assessor directory
-        for resource in os.listdir(assessor_path):
-            resource_path = os.path.join(assessor_path, resource)
-            # Need to be in a folder to create the resource :
-            if os.path.isdir(resource_path):
-                LOGGER.debug('    +uploading %s' % (resource))
-                try:
-                    upload_resource(assessor_obj, resource, resource_path)
-                except Exception as e:
-                    try:
-                        LOGGER.warn('failed to upload, trying again')
-                        upload_resource(assessor_obj, resource, resource_path)
-                    except Exception as e:
-                        import traceback
-                        LOGGER.error(traceback.format_exc())
-                        _msg = 'failed to upload, skipping assessor:{}:{}'.format(
-                            resource_path, str(e))
-                        LOGGER.error(_msg)
-                        return
+        if not upload_resources(assessor_obj, assessor_path,
+                                stream_resources=stream_resources):
+            return
 
         # after Upload
         if is_diskq_assessor(os.path.basename(assessor_path), resdir):
@@ -548,26 +711,216 @@ def is_diskq_assessor(assr_label, resdir):
     return os.path.exists(afile)
 
 
-def upload_resource(assessor_obj, resource, resource_path):
+class UploadState(object):
+    """
+    Files of an assessor already uploaded, saved in the assessor directory
+     so an interrupted upload resumes from the last completed files. A file
+     is only skipped if its size and modification time did not change.
+    """
+    def __init__(self, assessor_path):
+        """
+        Entry point for the UploadState class
+
+        :param assessor_path: assessor path on the station
+        :return: None
+        """
+        self.path = os.path.join(assessor_path, _UPLOAD_STATE_FILE)
+        self.lock = threading.Lock()
+        self.state = dict()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.state = json.load(f)
+                LOGGER.info('resuming upload from %s' % self.path)
+            except (IOError, ValueError) as err:
+                LOGGER.warn('ignoring upload state %s: %s' % (self.path, err))
+
+    def _save(self):
+        # Write to a temp file first so the state is never half written
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def started(self, resource):
+        """
+        Check if the upload of a resource was started
+
+        :param resource: resource label
+        :return: True if started, False otherwise
+        """
+        with self.lock:
+            return resource in self.state
+
+    def start(self, resource):
+        """
+        Save the start of the upload of a resource
+
+        :param resource: resource label
+        :return: None
+        """
+        with self.lock:
+            self.state.setdefault(resource, dict())
+            self._save()
+
+    def uploaded(self, resource, relpath, signature):
+        """
+        Check if a file was uploaded
+
+        :param resource: resource label
+        :param relpath: path of the file in the resource
+        :param signature: [size, mtime] of the file, see file_signature
+        :return: True if uploaded, False otherwise
+        """
+        with self.lock:
+            return self.state.get(resource, dict()).get(relpath) == signature
+
+    def record(self, resource, files):
+        """
+        Save files uploaded
+
+        :param resource: resource label
+        :param files: dictionary relpath -> signature of the files
+        :return: None
+        """
+        with self.lock:
+            self.state.setdefault(resource, dict()).update(files)
+            self._save()
+
+
+def file_signature(fpath):
+    """
+    Signature of a file for the upload state
+
+    :param fpath: path of the file
+    :return: list [size, mtime]
+    """
+    fstat = os.stat(fpath)
+    return [fstat.st_size, int(fstat.st_mtime)]
+
+
+def list_resource_files(resource_path):
+    """
+    List the files of a resource folder with their signature
+
+    :param resource_path: resource path on the station
+    :return: dictionary relpath -> signature, sorted by relpath
+    """
+    files = dict()
+    for root, dirs, names in os.walk(resource_path):
+        dirs.sort()
+        for name in sorted(names):
+            fpath = os.path.join(root, name)
+            files[os.path.relpath(fpath, resource_path)] = file_signature(fpath)
+    return files
+
+
+def upload_resources(assessor_obj, assessor_path,
+                     workers=UPLOAD_RESOURCE_WORKERS,
+                     stream_resources=None):
+    """
+    Upload the resource folders of an assessor concurrently, resuming from
+     the upload state of a previous attempt
+
+    :param assessor_obj: pyxnat assessor Eobject
+    :param assessor_path: assessor path on the station
+    :param workers: number of resources uploaded at the same time
+    :param stream_resources: labels of the resources to zip while sending
+     them, without a zip on disk, from the DAX settings if None
+    :return: True if all the resources were uploaded, False otherwise
+    """
+    if stream_resources is None:
+        stream_resources = DAX_SETTINGS.get_upload_stream_resources()
+
+    state = UploadState(assessor_path)
+    resources = list()
+    for resource in sorted(os.listdir(assessor_path)):
+        # Need to be in a folder to create the resource :
+        if os.path.isdir(os.path.join(assessor_path, resource)):
+            resources.append(resource)
+
+    if not resources:
+        return True
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(resources))) as pool:
+        futures = list()
+        for resource in resources:
+            resource_path = os.path.join(assessor_path, resource)
+            LOGGER.debug('    +uploading %s' % (resource))
+            futures.append((resource_path, pool.submit(
+                upload_resource_retry, assessor_obj, resource, resource_path,
+                state, resource in stream_resources)))
+
+        success = True
+        for resource_path, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                import traceback
+                LOGGER.error(traceback.format_exc())
+                _msg = 'failed to upload, skipping assessor:{}:{}'.format(
+                    resource_path, str(e))
+                LOGGER.error(_msg)
+                success = False
+
+    return success
+
+
+def upload_resource_retry(assessor_obj, resource, resource_path, state,
+                          stream=False):
+    """
+    Upload a resource folder to an assessor, trying again once from where
+     the first attempt stopped
+
+    :param assessor_obj: pyxnat assessor Eobject
+    :param resource: resource to upload
+    :param resource_path: resource path on the station
+    :param state: UploadState of the assessor
+    :param stream: zip the files while sending them
+    :return: None
+    """
+    try:
+        upload_resource(assessor_obj, resource, resource_path, state, stream)
+    except Exception:
+        LOGGER.warn('failed to upload, trying again')
+        upload_resource(assessor_obj, resource, resource_path, state, stream)
+
+
+def upload_resource(assessor_obj, resource, resource_path, state=None,
+                    stream=False):
     """
     Upload a resource folder to an assessor
 
     :param assessor_obj: pyxnat assessor Eobject
     :param resource: resource to upload
     :param resource_path: resource path on the station
+    :param state: UploadState of the assessor, None to upload it all
+    :param stream: zip the files while sending them, without a zip on disk
     :return: None
     """
+    if state:
+        files = list_resource_files(resource_path)
+        if state.started(resource) and \
+           all(state.uploaded(resource, r, s) for r, s in files.items()):
+            LOGGER.info('resource %s already uploaded' % resource)
+            return
+
     if resource == 'SNAPSHOTS':
         upload_snapshots(assessor_obj, resource_path)
     else:
         rfiles_list = os.listdir(resource_path)
         if not rfiles_list:
             LOGGER.warn('No files in {}'.format(resource_path))
+        elif state and (len(rfiles_list) > 1 or os.path.isdir(
+                os.path.join(resource_path, rfiles_list[0]))):
+            upload_resource_batches(assessor_obj, resource, resource_path,
+                                    files, state, stream)
+            return
         elif len(rfiles_list) > 1 or os.path.isdir(os.path.join(resource_path, rfiles_list[0])):
             try:
                 XnatUtils.upload_folder_to_obj(
                     resource_path, assessor_obj.out_resource(resource),
-                    resource, removeall=True)
+                    resource, removeall=True, stream=stream)
             except XnatUtilsError as err:
                 print((ERR_MSG % err))
         else:
@@ -579,6 +932,97 @@ def upload_resource(assessor_obj, resource, resource_path):
             except XnatUtilsError as err:
                 print((ERR_MSG % err))
 
+    if state:
+        state.record(resource, files)
+
+
+def upload_resource_batches(assessor_obj, resource, resource_path, files,
+                            state, stream=False):
+    """
+    Upload a resource folder as a series of zips extracted on XNAT, saving
+     the files of each zip in the upload state once it is uploaded
+
+    :param assessor_obj: pyxnat assessor Eobject
+    :param resource: resource to upload
+    :param resource_path: resource path on the station
+    :param files: dictionary relpath -> signature of the files to upload
+    :param state: UploadState of the assessor
+    :param stream: zip the files while sending them
+    :return: None
+    """
+    resource_obj = assessor_obj.out_resource(resource)
+    if not state.started(resource):
+        # First attempt, replace the resource like removeall
+        if resource_obj.exists():
+            resource_obj.delete()
+        state.start(resource)
+
+    batch = dict()
+    batch_bytes = 0
+    batch_index = 0
+    for relpath, signature in files.items():
+        if state.uploaded(resource, relpath, signature):
+            continue
+
+        batch[relpath] = signature
+        batch_bytes += signature[0]
+        if len(batch) >= UPLOAD_BATCH_FILES or \
+           batch_bytes >= UPLOAD_BATCH_BYTES:
+            upload_batch(resource_obj, resource, resource_path, batch,
+                         batch_index, state, stream)
+            batch = dict()
+            batch_bytes = 0
+            batch_index += 1
+
+    if batch:
+        upload_batch(resource_obj, resource, resource_path, batch,
+                     batch_index, state, stream)
+
+
+def upload_batch(resource_obj, resource, resource_path, batch, batch_index,
+                 state, stream=False):
+    """
+    Zip files of a resource folder and upload the zip
+
+    :param resource_obj: pyxnat resource Eobject
+    :param resource: resource label
+    :param resource_path: resource path on the station
+    :param batch: dictionary relpath -> signature of the files to upload
+    :param batch_index: number of the zip for this resource
+    :param state: UploadState of the assessor
+    :param stream: zip the files while sending them, falls back to a zip
+     on disk if XNAT refuses it
+    :return: None
+    """
+    # Zip next to the resource folders, not in them
+    fzip = os.path.join(os.path.dirname(resource_path),
+                        '%s_%d.zip' % (resource, batch_index))
+    if stream:
+        LOGGER.debug('    +streaming %s: %s files'
+                     % (os.path.basename(fzip), str(len(batch))))
+        try:
+            XnatUtils.put_zip_stream(resource_obj, os.path.basename(fzip),
+                                     resource_path, relpaths=list(batch))
+            state.record(resource, batch)
+            return
+        except (XnatUtilsError, requests.RequestException) as err:
+            LOGGER.warn('streaming upload failed, zipping to disk:{}'.format(
+                err))
+
+    try:
+        with zipfile.ZipFile(fzip, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for relpath in batch:
+                zf.write(os.path.join(resource_path, relpath), relpath)
+
+        LOGGER.debug('    +uploading %s: %s files'
+                     % (os.path.basename(fzip), str(len(batch))))
+        resource_obj.put_zip(fzip, overwrite=True, extract=True)
+    finally:
+        if os.path.exists(fzip):
+            os.remove(fzip)
+
+    state.record(resource, batch)
+
 
 def upload_snapshots(assessor_obj, resource_path):
     """
@@ -616,12 +1060,15 @@ def upload_snapshots(assessor_obj, resource_path):
             print((ERR_MSG % err))
 
 
-def upload_assessors(xnat, projects, resdir, num_threads=1):
+def upload_assessors(xnat, projects, resdir, num_threads=1,
+                     stream_resources=None):
     """
     Upload all assessors to XNAT
 
     :param xnat: pyxnat.Interface object
     :param projects: list of projects to upload to XNAT
+    :param stream_resources: labels of the resources to zip while sending
+     them, from the DAX settings if None
     :return: None
     """
     # Get the assessor label from the directory :
@@ -639,7 +1086,8 @@ def upload_assessors(xnat, projects, resdir, num_threads=1):
 
         pool.apply_async(
             upload_thread,
-            [xnat, index, assessor_label, number_of_processes, resdir])
+            [xnat, index, assessor_label, number_of_processes, resdir,
+             stream_resources])
 
     LOGGER.info('waiting for upload pool to finish...')
     sys.stdout.flush()
@@ -804,7 +1252,8 @@ def upload_assessor_subjgenproc(xnat, dirpath):
     shutil.rmtree(dirpath)
 
 
-def upload_thread(xnat, index, assessor_label, number_of_processes, resdir):
+def upload_thread(xnat, index, assessor_label, number_of_processes, resdir,
+                  stream_resources=None):
     assessor_path = os.path.join(resdir, assessor_label)
     msg = "    *Process: %s/%s -- label: %s / time: %s"
     LOGGER.info(msg % (str(index + 1),str(number_of_processes), assessor_label, str(datetime.now())))
@@ -816,7 +1265,7 @@ def upload_thread(xnat, index, assessor_label, number_of_processes, resdir):
         assessor_dict = assessor_utils.parse_full_assessor_name(assessor_label)
         if assessor_dict:
             uploaded = upload_assessor(
-                xnat, assessor_dict, assessor_path, resdir)
+                xnat, assessor_dict, assessor_path, resdir, stream_resources)
             if not uploaded:
                 mess = """    - Assessor label : {label}\n"""
                 LOGGER.warn(mess.format(label=assessor_dict['label']))
@@ -943,7 +1392,7 @@ def upload_results(upload_settings, emailaddress, resdir, num_threads=1):
     :return: None
     """
     # TODO: move resdir into upload_sttings
-    if len(os.listdir(resdir)) == 0:
+    if not [x for x in os.listdir(resdir) if x != _UPLOAD_INDEX_FILE]:
         LOGGER.warn('No data need to be uploaded.\n')
         sys.exit()
 
@@ -969,7 +1418,8 @@ def upload_results(upload_settings, emailaddress, resdir, num_threads=1):
 
                 warnings.extend(
                     upload_assessors(intf, upload_dict['projects'], resdir,
-                                     num_threads))
+                                     num_threads,
+                                     upload_dict.get('stream_resources')))
 
                 # 2) Upload the PBS files
                 # For each file, upload it to the PBS resource
@@ -1001,6 +1451,8 @@ def load_upload_settings(f_settings, host, username, password, projects):
         password : string for XNAT password
           (can be the environment variable containing the value)
         projects : list of projects to upload for the host
+        stream_resources : optional list of the resources to zip while
+          sending them, DAX_UPLOAD_STREAM_RESOURCES if not set
     """
     host_projs = list()
     # If settings file given, load it and use it:
@@ -9,17 +9,20 @@ import sys
 import os
 import traceback
 import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from . import lockfiles
 from . import processors, modules, XnatUtils, task, cluster, processors_v3
-from .task import Task, ClusterTask, XnatTask, mkdirp
+from .task import Task, ClusterTask, XnatTask, AttributeBuffer, mkdirp
+from .task_store import get_task_store
 from .dax_settings import DAX_Settings, DAX_Netrc
 from .errors import (ClusterCountJobsException, ClusterLaunchException,
                      DaxXnatError, DaxLauncherError)
 from . import yaml_doc
 from .processor_graph import ProcessorGraph
-from .utilities import find_with_pred, groupby_to_dict
+from .utilities import find_with_pred, groupby_to_dict, parse_list
 
 __copyright__ = 'Copyright 2019 Vanderbilt University. All Rights Reserved'
 __all__ = ['Launcher']
@@ -77,6 +80,76 @@ def task_needs_status_update(qcstatus):
     return qcstatus in [task.RERUN, task.REPROC]
 
 
+def add_thread_log_handler(handler):
+    """
+    Add a handler to the dax logger for the logs of the current thread only
+
+    :param handler: logging.Handler object
+    :return: None
+    """
+    handler.thread_ident = threading.get_ident()
+    handler.addFilter(lambda record: (
+        record.thread == handler.thread_ident and
+        not getattr(record, 'build_buffered', False)))
+    LOGGER.addHandler(handler)
+
+
+class BuildLogBuffer(logging.Filter):
+    """
+    Filter on the dax logger holding back the logs of the subjects built in
+    worker threads so they can be emitted in order, once each subject is
+    done. Handlers added with add_thread_log_handler still get the logs of
+    their thread as they come.
+    """
+    def __init__(self):
+        super(BuildLogBuffer, self).__init__()
+        self.records = dict()
+        self.lock = threading.Lock()
+
+    def run(self, func, *args):
+        """
+        Run a function buffering its logs
+
+        :param func: function to run in this thread
+        :param args: arguments for the function
+        :return: list of the log records
+        """
+        ident = threading.get_ident()
+        with self.lock:
+            self.records[ident] = list()
+
+        try:
+            func(*args)
+        except Exception as E:
+            err2 = 'Exception class %s caught with message %s'
+            LOGGER.critical('Caught exception in build worker')
+            LOGGER.critical(err2 % (E.__class__, str(E)))
+            LOGGER.critical(traceback.format_exc())
+        finally:
+            with self.lock:
+                records = self.records.pop(ident)
+
+        return records
+
+    def filter(self, record):
+        if getattr(record, 'build_buffered', False):
+            # Emitted again once its subject is done
+            return True
+
+        records = self.records.get(record.thread)
+        if records is None:
+            return True
+
+        for handler in list(LOGGER.handlers):
+            if getattr(handler, 'thread_ident', None) == record.thread and \
+               record.levelno >= handler.level:
+                handler.handle(record)
+
+        record.build_buffered = True
+        records.append(record)
+        return False
+
+
 class Launcher(object):
     """ Launcher object to manage a list of projects from a settings file """
 
@@ -97,7 +170,11 @@ class Launcher(object):
                  job_template='~/job_template.txt',
                  smtp_host=None,
                  timeout_emails=None,
-                 project_sgp_processors={}):
+                 project_sgp_processors={},
+                 xnat_max_concurrency=8,
+                 session_xml_cache=True,
+                 build_workers=1,
+                 queue_resync_sec=60):
         """
         Entry point for the Launcher class
 
@@ -118,16 +195,31 @@ class Launcher(object):
         :param job_email_options: email options for the jobs
         :param job_rungroup: cluster group to run the job under
         :param max_age: maximum time before updating again a session
+        :param xnat_max_concurrency: maximum number of concurrent requests
+         to XNAT when loading data in bulk
+        :param session_xml_cache: keep the session XML in resdir between
+         builds and only download the sessions modified since
+        :param build_workers: number of subjects of a project to build
+         concurrently, in threads sharing the XNAT connection pool
+        :param queue_resync_sec: seconds between two counts of the jobs on the
+         cluster while launching, the jobs launched are counted in between
         :return: None
         """
         self.queue_limit = queue_limit
         self.queue_limit_pending = queue_limit_pending
         self.limit_pendinguploads = limit_pendinguploads
         self.launch_delay_sec = launch_delay_sec
+        self.queue_resync_sec = queue_resync_sec
         self.root_job_dir = root_job_dir
         self.resdir = resdir
         self.smtp_host = smtp_host
         self.timeout_emails = timeout_emails
+        self.xnat_max_concurrency = xnat_max_concurrency
+        if session_xml_cache:
+            self.xml_cache_dir = os.path.join(resdir, 'XMLCACHE')
+        else:
+            self.xml_cache_dir = None
+        self.build_workers = max(1, int(build_workers))
 
         # Processors:
         if not isinstance(project_process_dict, dict):
@@ -259,17 +351,30 @@ name as a key and list of yaml filepaths as values.'
         if project_list is None or len(project_list) == 0:
             LOGGER.info('no projects to launch')
         else:
+            # sessions_local is the comma separated list from the command line
+            if sessions_local and sessions_local.lower() != 'all':
+                sess_filter = parse_list(sessions_local)
+            else:
+                sess_filter = None
+
             msg = 'Loading task queue from: %s'
             LOGGER.info(msg % os.path.join(self.resdir, 'DISKQ'))
-            task_list = load_task_queue(
-                self.resdir,
+            task_count = get_task_store(
+                os.path.join(self.resdir, 'DISKQ')).count_tasks(
                 status=task.NEED_TO_RUN,
                 proj_filter=project_list,
-                sess_filter=sessions_local)
+                sess_filter=sess_filter)
 
             msg = '%s tasks that need to be launched found'
-            LOGGER.info(msg % str(len(task_list)))
-            self.launch_tasks(task_list, force_no_qsub=force_no_qsub)
+            LOGGER.info(msg % str(task_count))
+
+            # Tasks are loaded as they are launched, in project priority
+            task_iter = iter_task_queue(
+                self.resdir,
+                status=task.NEED_TO_RUN,
+                proj_filter=project_list,
+                sess_filter=sess_filter)
+            self.launch_tasks(task_iter, force_no_qsub=force_no_qsub)
 
         self.finish_script(flagfile, project_list, 3, 2, project_local)
 
@@ -288,11 +393,14 @@ name as a key and list of yaml filepaths as values.'
         Launch tasks from the passed list until the queue is full or
          the list is empty
 
-        :param task_list: list of task to launch
+        :param task_list: list or iterator of task to launch, in order
         :param force_no_qsub: run the job locally on the computer (serial mode)
         :return: None
         """
-        launched, pending, pendinguploads = cluster.count_jobs(self.resdir,force_no_qsub)
+        queue = cluster.QueueSnapshot(
+            lambda: cluster.count_jobs(self.resdir, force_no_qsub),
+            self.queue_resync_sec)
+        launched, pending, pendinguploads = queue.counts()
         if not force_no_qsub:
             LOGGER.info(
                 'Cluster: %d/%d total, %d/%d pending, %d/%d pending uploads',
@@ -303,15 +411,17 @@ name as a key and list of yaml filepaths as values.'
 
         # Launch until we reach cluster limit or no jobs left to launch
         _launchcnt = 0
-        _launchmax = len(task_list)
+        task_iter = iter(task_list)
         while(
                 launched < self.queue_limit and
                 pending < self.queue_limit_pending and
-                pendinguploads < self.limit_pendinguploads and
-                len(task_list) > 0
+                pendinguploads < self.limit_pendinguploads
                 ):
 
-            cur_task = task_list.pop()
+            # Only take the next task once there is room for it
+            cur_task = next(task_iter, None)
+            if cur_task is None:
+                break
 
             LOGGER.info('Launching job: %s', cur_task.assessor_label)
 
@@ -334,9 +444,10 @@ name as a key and list of yaml filepaths as values.'
                 raise ClusterLaunchException
 
             _launchcnt = _launchcnt + 1
+            queue.job_submitted()
             time.sleep(self.launch_delay_sec)
 
-            launched, pending, pendinguploads = cluster.count_jobs(self.resdir,force_no_qsub)
+            launched, pending, pendinguploads = queue.counts()
             if not force_no_qsub:
                 LOGGER.info(
                     'Cluster: %d/%d total, %d/%d pending, %d/%d pending uploads',
@@ -346,9 +457,7 @@ name as a key and list of yaml filepaths as values.'
                     )
 
         if not force_no_qsub:
-            LOGGER.info(
-                'Launched %d of %d jobs. Stopping', _launchcnt, _launchmax
-                )
+            LOGGER.info('Launched %d jobs. Stopping', _launchcnt)
 
 
     def update_tasks(self, lockfile_prefix, project_local, sessions_local):
@@ -383,10 +492,15 @@ name as a key and list of yaml filepaths as values.'
 
             LOGGER.info('%s tasks found.' % str(len(task_list)))
 
+            # Query the cluster once for all the running jobs
+            snapshot = cluster.JobSnapshot(
+                [t.get_jobid() for t in task_list
+                 if t.get_status() == task.JOB_RUNNING])
+
             LOGGER.info('Updating tasks...')
             for cur_task in task_list:
                 LOGGER.info('Updating task: %s' % cur_task.assessor_label)
-                cur_task.update_status()
+                cur_task.update_status(job_snapshot=snapshot)
 
         self.finish_script(flagfile, project_list, 2, 2, project_local)
 
@@ -435,7 +549,8 @@ name as a key and list of yaml filepaths as values.'
             self.xnat_user,
             self.xnat_pass,
             self.smtp_host,
-            self.timeout_emails
+            self.timeout_emails,
+            xnat_max_concurrency=self.xnat_max_concurrency
         ) as intf:
 
             if not XnatUtils.has_dax_datatypes(intf):
@@ -476,6 +591,14 @@ name as a key and list of yaml filepaths as values.'
                     LOGGER.critical(err2 % (E.__class__, str(E)))
                     LOGGER.critical(traceback.format_exc())
 
+            stats = intf.get_request_stats()
+            LOGGER.info(
+                'XNAT requests: %d total, %d failed, %d retries, '
+                '%d failed fast, %d breaker opens, %.2fs avg, %.2fs max',
+                stats['requests'], stats['failures'], stats['retries'],
+                stats['fast_fails'], stats['breaker_opens'],
+                stats['latency_avg'], stats['latency_max'])
+
         self.finish_script(flagfile, project_list, 1, 2, project_local)
 
     def build_project(self, intf, project_id, lockfile_prefix, sessions_local,
@@ -516,8 +639,24 @@ name as a key and list of yaml filepaths as values.'
         # get the list of processors for this project
         processor_types = set([x.name for x in auto_procs])
 
+        # check for processor types that are new to this project
+        assr_types = intf.list_project_assessor_types(project_id)
+        has_new = (len(processor_types.difference(assr_types)) > 0)
+        LOGGER.debug(assr_types)
+        LOGGER.debug('has_new=' + str(has_new))
+
+        # Only list the subjects with sessions that could need a build
+        modified_since = None
+        if has_new or (sessions_local and sessions_local.lower() != 'all'):
+            LOGGER.debug('listing all the sessions')
+        elif lastrun:
+            modified_since = lastrun
+        elif lastmod_delta:
+            modified_since = datetime.today() - lastmod_delta
+
         LOGGER.info('* Loading list of sessions from XNAT for project')
-        sess_list = self.get_sessions_list(intf, project_id, sessions_local)
+        sess_list = self.get_sessions_list(
+            intf, project_id, sessions_local, modified_since)
 
         # Skip to session
         if start_sess:
@@ -531,88 +670,132 @@ name as a key and list of yaml filepaths as values.'
         sessions_by_subject = groupby_to_dict(
             sess_list, lambda x: x['subject_id'])
 
-        # check for processor types that are new to this project
-        assr_types = intf.list_project_assessor_types(project_id)
-        has_new = (len(processor_types.difference(assr_types)) > 0)
-        LOGGER.debug(assr_types)
-        LOGGER.debug('has_new=' + str(has_new))
+        subject_sessions = list(sessions_by_subject.values())
+        build_args = (intf, auto_procs, exp_mods, scan_mods, has_new, lastrun,
+                      lastmod_delta)
+        nb_workers = min(self.build_workers, len(subject_sessions))
+        if nb_workers > 1 and (exp_mods or scan_mods):
+            # Modules keep state between sessions, build them one at a time
+            LOGGER.info('project has modules, building subjects serially')
+            nb_workers = 1
+
+        if nb_workers <= 1:
+            for sessions in subject_sessions:
+                self.build_subject(sessions, *build_args)
+        else:
+            LOGGER.info('* Building %d subjects with %d workers' % (
+                len(subject_sessions), nb_workers))
+            log_buffer = BuildLogBuffer()
+            LOGGER.addFilter(log_buffer)
+            try:
+                with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+                    futures = [executor.submit(
+                        log_buffer.run, self.build_subject, sessions,
+                        *build_args) for sessions in subject_sessions]
+
+                    # Emit the logs of each subject in order, as if the
+                    # subjects had been built one at a time
+                    for future in futures:
+                        for record in future.result():
+                            LOGGER.handle(record)
+            finally:
+                LOGGER.removeFilter(log_buffer)
 
-        for subject_id, sessions in list(sessions_by_subject.items()):
-            # Get the cached session objects for this subject
-
-            sessions_to_update = dict()
-
-            # Check which sessions (if any) require an update:
-            for sess_info in sessions:
-                if has_new:
-                    # Don't skip any sessions
-                    pass
-                elif lastrun:
-                    last_mod = datetime.strptime(
-                        sess_info['last_modified'][0:19], UPDATE_FORMAT)
-
-                    if last_mod < lastrun:
-                        mess = "+ Session %s:skipping not modified since last run, last_mod=%s, last_run=%s"
-                        LOGGER.info(mess % (sess_info['label'], str(last_mod),
-                                            str(lastrun)))
-                        continue
-
-                elif lastmod_delta:
-                    last_mod = datetime.strptime(
-                        sess_info['last_modified'][0:19], UPDATE_FORMAT)
-                    now_date = datetime.today()
-                    if now_date > last_mod + lastmod_delta:
-                        mess = "+ Session %s:skipping not modified within delta, last_mod=%s"
-                        LOGGER.info(mess % (sess_info['label'], str(last_mod)))
-                        continue
-                    else:
-                        LOGGER.info('+ Session {}:modified, last_mod={}'.format(
-                            sess_info['label'], str(last_mod)))
+        if not sessions_local or sessions_local.lower() == 'all':
+            # Modules after run
+            LOGGER.debug('* Modules Afterrun')
+            try:
+                self.module_afterrun(intf, project_id)
+            except Exception as E:
+                err2 = 'Exception class %s caught with message %s'
+                LOGGER.critical('Caught exception after running modules')
+                LOGGER.critical(err2 % (E.__class__, str(E)))
+                LOGGER.critical(traceback.format_exc())
 
-                # Append session to list of sessions to update
-                sessions_to_update[sess_info['ID']] = sess_info
+    def build_subject(self, sessions, intf, auto_procs, exp_mods, scan_mods,
+                      has_new, lastrun, lastmod_delta):
+        """
+        Build the sessions of a subject that need an update
 
-            if len(sessions_to_update) == 0:
-                continue
+        :param sessions: list of sessions dictionaries for the subject
+        :param intf: pyxnat.Interface object
+        :param auto_procs: list of processors for the project
+        :param exp_mods: list of session modules for the project
+        :param scan_mods: list of scan modules for the project
+        :param has_new: True to build all the sessions
+        :param lastrun: datetime of the last build, skip older sessions
+        :param lastmod_delta: timedelta, skip sessions modified before it
+        :return: None
+        """
+        sessions_to_update = dict()
+
+        # Check which sessions (if any) require an update:
+        for sess_info in sessions:
+            if has_new:
+                # Don't skip any sessions
+                pass
+            elif lastrun:
+                last_mod = datetime.strptime(
+                    sess_info['last_modified'][0:19], UPDATE_FORMAT)
+
+                if last_mod < lastrun:
+                    mess = "+ Session %s:skipping not modified since last run, last_mod=%s, last_run=%s"
+                    LOGGER.info(mess % (sess_info['label'], str(last_mod),
+                                        str(lastrun)))
+                    continue
+
+            elif lastmod_delta:
+                last_mod = datetime.strptime(
+                    sess_info['last_modified'][0:19], UPDATE_FORMAT)
+                now_date = datetime.today()
+                if now_date > last_mod + lastmod_delta:
+                    mess = "+ Session %s:skipping not modified within delta, last_mod=%s"
+                    LOGGER.info(mess % (sess_info['label'], str(last_mod)))
+                    continue
+                else:
+                    LOGGER.info('+ Session {}:modified, last_mod={}'.format(
+                        sess_info['label'], str(last_mod)))
+
+            # Append session to list of sessions to update
+            sessions_to_update[sess_info['ID']] = sess_info
+
+        if len(sessions_to_update) == 0:
+            return
 
-            # build a full list of sessions for the subject: they may be needed
-            # even if not all sessions are getting updated
-            mess = "+ Subject %s: loading XML for %s session(s)..."
-            LOGGER.info(mess % (sessions[0]['subject_label'], len(sessions)))
-            cached_sessions = [XnatUtils.CachedImageSession(
-                intf, x['project_label'], x['subject_label'],
-                x['session_label']) for x in sessions]
+        # build a full list of sessions for the subject: they may be needed
+        # even if not all sessions are getting updated
+        mess = "+ Subject %s: loading XML for %s session(s)..."
+        LOGGER.info(mess % (sessions[0]['subject_label'], len(sessions)))
+        try:
+            cached_sessions = XnatUtils.load_cached_sessions(
+                intf, sessions, cache_dir=self.xml_cache_dir)
 
             if len(cached_sessions) > 1:
                 cached_sessions = sorted(
                     cached_sessions,
                     key=lambda s: s.creation_timestamp(), reverse=True)
+        except Exception as E:
+            err1 = 'Caught exception loading sessions for subject %s'
+            err2 = 'Exception class %s caught with message %s'
+            LOGGER.critical(err1 % sessions[0]['subject_label'])
+            LOGGER.critical(err2 % (E.__class__, str(E)))
+            LOGGER.critical(traceback.format_exc())
+            return
 
-            # update each of the sessions that require it
-            for sess_info in list(sessions_to_update.values()):
-                try:
-                    # TODO: BenM - ensure that this code is robust to subjects
-                    # without sessions and sessions without assessors / scans
-                    mess = "+ Session %s: building..."
-                    LOGGER.info(mess % sess_info['label'])
-                    self.build_session(
-                        intf, sess_info, auto_procs, exp_mods, scan_mods,
-                        sessions=cached_sessions)
-                except Exception as E:
-                    err1 = 'Caught exception building sessions %s'
-                    err2 = 'Exception class %s caught with message %s'
-                    LOGGER.critical(err1 % sess_info['session_label'])
-                    LOGGER.critical(err2 % (E.__class__, str(E)))
-                    LOGGER.critical(traceback.format_exc())
-
-        if not sessions_local or sessions_local.lower() == 'all':
-            # Modules after run
-            LOGGER.debug('* Modules Afterrun')
+        # update each of the sessions that require it
+        for sess_info in list(sessions_to_update.values()):
             try:
-                self.module_afterrun(intf, project_id)
+                # TODO: BenM - ensure that this code is robust to subjects
+                # without sessions and sessions without assessors / scans
+                mess = "+ Session %s: building..."
+                LOGGER.info(mess % sess_info['label'])
+                self.build_session(
+                    intf, sess_info, auto_procs, exp_mods, scan_mods,
+                    sessions=cached_sessions)
             except Exception as E:
+                err1 = 'Caught exception building sessions %s'
                 err2 = 'Exception class %s caught with message %s'
-                LOGGER.critical('Caught exception after running modules')
+                LOGGER.critical(err1 % sess_info['session_label'])
                 LOGGER.critical(err2 % (E.__class__, str(E)))
                 LOGGER.critical(traceback.format_exc())
 
@@ -655,34 +838,37 @@ name as a key and list of yaml filepaths as values.'
             return
 
         for subj in sorted(subjects):
-            for processor in sgp_processors:
-                # Get list of inputs sets (not yet matched with existing)
-                inputsets = processor.parse_subject(subj, project_data)
-
-                for inputs in inputsets:
-                    if inputs == {}:
-                        # print('empty set, skipping')
-                        return
-
-                    # Get(create) assessor with given inputs and proc type
-                    # TODO: extract subject data only
-                    (assr, info) = processor.get_assessor(
-                        xnat, subj, inputs, project_data)
-
-                    # TODO: apply reproc or rerun if needed
-                    # (assr,info) = undo_processing()
-                    # (assr,info) = reproc_processing()
-
-                    if info['PROCSTATUS'] in [task.NEED_TO_RUN, task.NEED_INPUTS]:
-                        # print('building task')
-                        (assr, info) = self.build_task(
-                            assr, info, processor, project_data)
-
-                        # print('assr after=', info)
-                    else:
-                        LOGGER.info('already built:{}'.format(info['ASSR']))
-
-    def build_task(self, assr, info, processor, project_data):
+            with AttributeBuffer() as attr_buffer:
+                for processor in sgp_processors:
+                    # Get list of inputs sets (not yet matched with existing)
+                    inputsets = processor.parse_subject(subj, project_data)
+
+                    for inputs in inputsets:
+                        if inputs == {}:
+                            # print('empty set, skipping')
+                            return
+
+                        # Get(create) assessor with given inputs and proc type
+                        # TODO: extract subject data only
+                        (assr, info) = processor.get_assessor(
+                            xnat, subj, inputs, project_data)
+
+                        # TODO: apply reproc or rerun if needed
+                        # (assr,info) = undo_processing()
+                        # (assr,info) = reproc_processing()
+
+                        if info['PROCSTATUS'] in [task.NEED_TO_RUN, task.NEED_INPUTS]:
+                            # print('building task')
+                            (assr, info) = self.build_task(
+                                assr, info, processor, project_data,
+                                attr_buffer)
+
+                            # print('assr after=', info)
+                        else:
+                            LOGGER.info('already built:{}'.format(info['ASSR']))
+
+    def build_task(self, assr, info, processor, project_data,
+                   attr_buffer=None):
         resdir = self.resdir
         old_proc_status = info['PROCSTATUS']
         old_qc_status = info['QCSTATUS']
@@ -715,6 +901,8 @@ name as a key and list of yaml filepaths as values.'
 
             LOGGER.info('writing:' + batch_file)
             batch.write()
+            get_task_store(os.path.join(self.resdir, 'DISKQ')).add_task(
+                info['ASSR'])
 
             # Set new statuses to be updated
             new_proc_status = task.JOB_RUNNING
@@ -738,13 +926,17 @@ name as a key and list of yaml filepaths as values.'
             new_qc_status = e.value
 
         # Update on xnat
+        updates = {}
         if new_proc_status != old_proc_status:
-            assr.attrs.set(
-                'proc:subjgenprocdata/procstatus', new_proc_status)
+            updates['proc:subjgenprocdata/procstatus'] = new_proc_status
 
         if new_qc_status != old_qc_status:
-            assr.attrs.set(
-                'proc:subjgenprocdata/validation/status', new_qc_status)
+            updates['proc:subjgenprocdata/validation/status'] = new_qc_status
+
+        if attr_buffer is not None:
+            attr_buffer.mset(assr, updates)
+        elif updates:
+            assr.attrs.mset(updates)
 
         # Update local info
         info['PROCSTATUS'] = new_proc_status
@@ -781,7 +973,7 @@ name as a key and list of yaml filepaths as values.'
         handler = logging.FileHandler(tmp_file)
         handler.setFormatter(logging.Formatter(
             fmt='%(asctime)s - %(levelname)s - %(module)s - %(message)s'))
-        LOGGER.addHandler(handler)
+        add_thread_log_handler(handler)
 
         if sess_mod_list or scan_mod_list:
             # Modules
@@ -805,10 +997,13 @@ name as a key and list of yaml filepaths as values.'
         # Auto Processors
         if auto_proc_list:
             LOGGER.debug('== Build auto processors ==')
-            self.build_auto_processors(csess, auto_proc_list, sessions)
+            with AttributeBuffer() as attr_buffer:
+                self.build_auto_processors(
+                    csess, auto_proc_list, sessions, attr_buffer)
 
         # Close sess log
-        LOGGER.handlers.pop()
+        LOGGER.removeHandler(handler)
+        handler.close()
 
         # Upload build log only if session was changed
         csess.refresh()
@@ -876,12 +1071,15 @@ in session %s'
                     LOGGER.critical(err2 % (E.__class__, str(E)))
                     LOGGER.critical(traceback.format_exc())
 
-    def build_auto_processors(self, csess, auto_proc_list, sessions):
+    def build_auto_processors(self, csess, auto_proc_list, sessions,
+                              attr_buffer=None):
         """ Build yaml-based processors.
 
         :param xnat: pyxnat.Interface object
         :param csess: CachedObject for Session (XnatUtils)
         :param auto_proc_list: list of yaml processors
+        :param attr_buffer: AttributeBuffer for the assessor changes, the
+         caller flushes it
         :return: None
         """
         # sess_info = csess.info()
@@ -909,12 +1107,10 @@ in session %s'
             for inputs, p_assrs in mapping:
                 if len(p_assrs) == 0:
                     assessor = auto_proc.create_assessor(
-                        xnat_session, inputs, relabel=True)
+                        xnat_session, inputs, relabel=True, csess=csess)
                     assessors = [(
                         assessor, assessor.label(),
                         task.NEED_TO_RUN, task.DOES_NOT_EXIST)]
-
-                    csess.refresh()
                 else:
                     assessors = []
                     for p in p_assrs:
@@ -930,9 +1126,11 @@ in session %s'
                     qcstatus = assessor[3]
                     if task_needs_to_run(procstatus, qcstatus):
                         xtask = XnatTask(auto_proc, assessor[0], self.resdir,
-                                         os.path.join(self.resdir, 'DISKQ'))
+                                         os.path.join(self.resdir, 'DISKQ'),
+                                         attr_buffer)
 
-                        if task_needs_status_update(qcstatus):
+                        status_updated = task_needs_status_update(qcstatus)
+                        if status_updated:
                             xtask.update_status()
 
                         LOGGER.debug('building task: ' + xtask.assessor_label)
@@ -945,8 +1143,16 @@ in session %s'
                         deg = 'proc_status=%s, qc_status=%s'
                         LOGGER.debug(deg % (proc_status, qc_status))
 
-                        # Refresh the cached session since we just modified it
-                        csess.refresh()
+                        if status_updated:
+                            # Rerun/reproc can delete outputs, reload it all
+                            if attr_buffer is not None:
+                                attr_buffer.flush()
+                            csess.refresh()
+                        else:
+                            # Only the statuses changed, patch the cache.
+                            # XNAT is checked again once the session is built
+                            csess.set_assessor_status(
+                                assessor[1], proc_status, qc_status)
                     else:
                         # TODO: check that it actually exists in QUEUE
                         LOGGER.debug('already built: ' + assessor[1])
@@ -1207,7 +1413,7 @@ The project is not part of the settings."""
         return assr_list
 
     @staticmethod
-    def get_sessions_list(xnat, project_id, slocal):
+    def get_sessions_list(xnat, project_id, slocal, modified_since=None):
         """
         Get the sessions list from XNAT and sort it.
          Move the new sessions to the front.
@@ -1215,9 +1421,12 @@ The project is not part of the settings."""
         :param xnat: pyxnat.Interface object
         :param project_id: project ID on XNAT
         :param slocal: session selected by user
+        :param modified_since: datetime, only list the subjects with sessions
+         modified since then
         :return: list of sessions sorted for a project
         """
-        list_sessions = xnat.get_sessions_minimal(project_id)
+        list_sessions = xnat.get_sessions_minimal(
+            project_id, modified_since=modified_since)
 
         if slocal and slocal.lower() != 'all':
             # filter the list and keep the match between both list:
@@ -1264,33 +1473,30 @@ The project is not part of the settings."""
         return len(proc_types.difference(assr_types)) > 0
 
 # =============================================================================
-def load_task_queue(resdir, status=None, proj_filter=None, sess_filter=None):
-    """ Load the task queue for DiskQ"""
-    task_list = list()
+def iter_task_queue(resdir, status=None, proj_filter=None, sess_filter=None):
+    """
+    Iterate over the task queue for DiskQ, loading the tasks as they are used
+
+    :param resdir: directory of the DISKQ
+    :param status: procstatus of the tasks, None for all
+    :param proj_filter: list of projects in priority order, None for all
+    :param sess_filter: list of session labels, None for all
+    :return: generator of ClusterTask, by project priority then label
+    """
     diskq_dir = os.path.join(resdir, 'DISKQ')
 
     # TODO: handle subjgenproc assessors, conveniently it works implicitly, but
     # should also handle subject filters
-    for t in os.listdir(os.path.join(diskq_dir, 'BATCH')):
-        if proj_filter or sess_filter:
-            assr = XnatUtils.AssessorHandler(t)
-            if proj_filter and assr.get_project_id() not in proj_filter:
-                LOGGER.debug('ignoring:' + t)
-                continue
-
-            if sess_filter and assr.get_session_label() not in sess_filter:
-                LOGGER.debug('ignoring:' + t)
-                continue
+    labels = get_task_store(diskq_dir).iter_tasks(
+        status=status, proj_filter=proj_filter, sess_filter=sess_filter)
+    for t in labels:
+        LOGGER.debug('loading task:' + t)
+        yield ClusterTask(t, resdir, diskq_dir)
 
-        LOGGER.debug('loading:' + t)
-        task = ClusterTask(os.path.splitext(t)[0], resdir, diskq_dir)
-        LOGGER.debug('status = ' + task.get_status())
 
-        if not status or task.get_status() == status:
-            LOGGER.debug('adding task to list:' + t)
-            task_list.append(task)
-
-    return task_list
+def load_task_queue(resdir, status=None, proj_filter=None, sess_filter=None):
+    """ Load the task queue for DiskQ"""
+    return list(iter_task_queue(resdir, status, proj_filter, sess_filter))
 
 
 def get_sess_lastmod(xnat, sess_info):
@@ -1,6 +1,5 @@
 
 import copy
-import itertools
 import logging
 import sys
 from collections import namedtuple
@@ -193,32 +192,30 @@ class ProcessorParser:
         # the input.
         # These artefact paths are keys into the artefacts dictionary.
 
-        parameter_matrix = \
-            ProcessorParser.generate_parameter_matrix(
-                self.inputs,
-                self.iteration_sources,
-                self.iteration_map,
-                artefacts,
-                artefacts_by_input)
-
         # BDB 6/5/21
         # parameter_matrix is the combinations of inputs from the lists in
         # artefacts_by_inputs. I think these are the cartesian product
         # of lists in artefacts_by_input.
 
         # BDB 6/5/21
-        # Next we filter down the combinations by applying
+        # The combinations are filtered down by applying
         # any filters included in the yaml. currently
         # the only filter supported is a match filter
         # which help us only include combinations where one of the inputs
         # is the same, e.g. the same T1 input
         # This functions uses the artefacts dictionary to get the inputs field
         # from each artefact for comparison.
+        # The filters are checked while the combinations are generated, as
+        # soon as the inputs they compare are chosen.
 
-        parameter_matrix = ProcessorParser.filter_matrix(
-            parameter_matrix,
-            self.match_filters,
-            artefacts)
+        parameter_matrix = \
+            ProcessorParser.generate_parameter_matrix(
+                self.inputs,
+                self.iteration_sources,
+                self.iteration_map,
+                artefacts,
+                artefacts_by_input,
+                self.match_filters)
 
         # BDB 6/5/21
         # And now we use the parameter matrix as a list of what set of inputs 
@@ -829,7 +826,26 @@ class ProcessorParser:
                                   iteration_sources,
                                   iteration_map,
                                   artefacts,
-                                  artefacts_by_input):
+                                  artefacts_by_input,
+                                  match_filters=None):
+        return list(ProcessorParser.iter_parameter_matrix(
+            inputs, iteration_sources, iteration_map, artefacts,
+            artefacts_by_input, match_filters))
+
+    @staticmethod
+    def iter_parameter_matrix(inputs,
+                              iteration_sources,
+                              iteration_map,
+                              artefacts,
+                              artefacts_by_input,
+                              match_filters=None):
+        """
+        Generate the combinations of inputs lazily, the combinations rejected
+        by the match filters are skipped as soon as the inputs they compare
+        are chosen.
+
+        :return: generator of dictionaries of input name to artefact path
+        """
         # generate n dimensional input matrix based on iteration sources
         all_inputs = []
         input_dimension_map = []
@@ -837,7 +853,7 @@ class ProcessorParser:
         # check whether all inputs are present
         for i, iv in list(inputs.items()):
             if len(artefacts_by_input[i]) == 0 and iv['required'] is True:
-                return []
+                return
 
         # add in None for optional inputs so that the matrix can be generated
         # without artefacts present for those inputs
@@ -922,22 +938,16 @@ class ProcessorParser:
                 input_dimension_map.append(cur_input_vector)
 
         # perform a cartesian product of the dimension map entries to get the
-        # final input combinations
-        matrix = [list(
-            itertools.chain.from_iterable(x)) for x in itertools.product(
-                *input_dimension_map)]
-
-        matrix_headers = list(itertools.chain.from_iterable(all_inputs))
-
-        # rebuild the matrix to order the inputs consistently
-        final_matrix = []
-        for r in matrix:
-            row = dict()
-            for i in range(len(matrix_headers)):
-                row[matrix_headers[i]] = r[i]
-            final_matrix.append(row)
-
-        return final_matrix
+        # final input combinations, checking the filters along the way
+        checks = utilities.match_checks(
+            match_filters or [],
+            all_inputs,
+            lambda name, row: ProcessorParser.get_input_value(
+                name, row, artefacts))
+
+        for entries in utilities.filtered_product(
+                input_dimension_map, checks):
+            yield utilities.matrix_row(all_inputs, entries)
 
     @staticmethod
     def compare_to_existing(csesses, proc_type, parameter_matrix):
@@ -164,7 +164,8 @@ class Processor(object):
         """
         raise NotImplementedError()
 
-    def create_assessor(self, xnatsession, inputs, relabel=False):
+    def create_assessor(self, xnatsession, inputs, relabel=False,
+                        csess=None):
         attempts = 0
         while attempts < 100:
             guid = str(uuid4())
@@ -198,6 +199,11 @@ class Processor(object):
                 assessor.create(assessors=self.xsitype.lower(),
                                 ID=guid, label=label,
                                 **kwargs)
+
+                if csess is not None:
+                    # Update the cached session instead of reloading it
+                    csess.add_assessor(guid, label, self.xsitype, kwargs)
+
                 return assessor
 
             attempts += 1
@@ -6,6 +6,7 @@ import json
 import requests
 import itertools
 import copy
+import functools
 from uuid import uuid4
 from datetime import date
 
@@ -75,6 +76,72 @@ def validate_yaml_filename(filename):
     return True
 
 
+@functools.lru_cache(maxsize=None)
+def compile_patterns(patterns):
+    """
+    Compile a list of fnmatch patterns into a single regex
+
+    :param patterns: tuple of fnmatch patterns
+    :return: compiled regex matching any of the patterns
+    """
+    if not patterns:
+        # Nothing can match an empty list of patterns
+        return re.compile(r'(?!)')
+
+    return re.compile('|'.join(fnmatch.translate(x) for x in patterns))
+
+
+def index_project_data(project_data):
+    """
+    Index the scans and assessors of project data by session and subject,
+    by proctype and by label. The index is kept in project_data so it is
+    only built once per build and shared by all the processors. It only
+    holds references to the records of project_data.
+
+    :param project_data: dictionary of project data with scans and assessors
+     lists, and optionally sgp
+    :return: dictionary of indexes
+    """
+    index = project_data.get('index')
+    if index is not None:
+        return index
+
+    scans = project_data.get('scans', [])
+    assrs = project_data.get('assessors', [])
+    sgp = project_data.get('sgp', [])
+
+    index = {
+        'scans_by_session': utilities.groupby_to_dict(
+            scans, lambda x: x['SESSION']),
+        'scans_by_subject': utilities.groupby_to_dict(
+            scans, lambda x: x['SUBJECT']),
+        'assessors_by_session': utilities.groupby_to_dict(
+            assrs, lambda x: x['SESSION']),
+        'assessors_by_subject': utilities.groupby_to_dict(
+            assrs, lambda x: x['SUBJECT']),
+        'assessors_by_proctype': utilities.groupby_to_dict(
+            assrs, lambda x: (x['SESSION'], x['PROCTYPE'])),
+        'sgp_by_proctype': utilities.groupby_to_dict(
+            sgp, lambda x: (x['SUBJECT'], x['PROCTYPE'])),
+        'scan_by_id': {
+            (x['SESSION'], x['SCANID']): x for x in reversed(scans)},
+        'assessor_by_label': {
+            (x['SESSION'], x['ASSR']): x for x in reversed(assrs)},
+        'inputs_by_path': {x['full_path']: x['INPUTS'] for x in assrs},
+        'first_mr_session': dict(),
+    }
+
+    # First MR session of each subject by date
+    mr_scans = [x for x in scans if x['XSITYPE'] == 'xnat:mrSessionData']
+    for subject, subj_scans in utilities.groupby_to_dict(
+            mr_scans, lambda x: x['SUBJECT']).items():
+        first_scan = sorted(subj_scans, key=lambda x: x['DATE'])[0]
+        index['first_mr_session'][subject] = first_scan['SESSION']
+
+    project_data['index'] = index
+    return index
+
+
 class Processor_v3(object):
     """Processor class for v3 YAML files"""
 
@@ -112,6 +179,8 @@ class Processor_v3(object):
         self.user_overrides = {}
         self.extra_user_overrides = {}
         self.xsitype = "proc:genProcData"
+        # File lists of the input resources, see resource_files
+        self.resource_files = {}
 
         if user_inputs:
             self.user_inputs = user_inputs   # used to override default values
@@ -209,9 +278,8 @@ class Processor_v3(object):
 
     def get_assessor(self, session, inputs, project_data):
         proctype = self.get_proctype()
-        assrs = project_data.get('assessors')
-        assrs = [x for x in assrs if x['SESSION'] == session]
-        assrs = [x for x in assrs if x['PROCTYPE'] == proctype]
+        index = index_project_data(project_data)
+        assrs = index['assessors_by_proctype'].get((session, proctype), [])
         assrs = [x for x in assrs if x['INPUTS'] == inputs]
 
         if len(assrs) > 0:
@@ -230,7 +298,7 @@ class Processor_v3(object):
             LOGGER.debug('no existing assessors found, creating a new one')
 
             # Get the subject for this session
-            scans = [x for x in project_data['scans'] if x['SESSION'] == session]
+            scans = index['scans_by_session'][session]
             subject = scans[0]['SUBJECT']
 
             # Create the assessor
@@ -709,7 +777,8 @@ class Processor_v3(object):
             # extra blank line
             f.write('\n')
 
-    def create_assessor(self, xnatsession, inputs, relabel=False):
+    def create_assessor(self, xnatsession, inputs, relabel=False,
+                        csess=None):
         guidchars = 8  # how many characters in the guid?
         attempts = 0
         while attempts < 100:
@@ -746,6 +815,11 @@ class Processor_v3(object):
             assessor.create(
                 assessors=self.xsitype.lower(), ID=guid, label=label, **kwargs
             )
+
+            if csess is not None:
+                # Update the cached session instead of reloading it
+                csess.add_assessor(guid, label, self.xsitype, kwargs)
+
             return assessor
 
     def create_assessor_pd(self, project, subject, session, inputs):
@@ -892,24 +966,24 @@ class Processor_v3(object):
         # is not a list, the build will "leak" past what has been requested and
         # start building every project. This is now checked in _map_artefacts_to_inputs
 
-        parameter_matrix = self._generate_parameter_matrix(
-            artefacts, artefacts_by_input
-        )
-
         # BDB 6/5/21
         # parameter_matrix is the combinations of inputs from the lists in
         # artefacts_by_inputs. I think these are the cartesian product
         # of lists in artefacts_by_input.
 
         # BDB 6/5/21
-        # Next we filter down the combinations by applying
+        # The combinations are filtered down by applying
         # any filters included in the yaml. currently
         # the only filter supported is a match filter
         # which help us only include combinations where one of the inputs
         # is the same, e.g. the same T1 input
         # This functions uses the artefacts dictionary to get the inputs field
         # from each artefact for comparison.
-        parameter_matrix = self._filter_matrix(parameter_matrix, artefacts)
+        # The filters are checked while the combinations are generated, as
+        # soon as the inputs they compare are chosen.
+        parameter_matrix = self._generate_parameter_matrix(
+            artefacts, artefacts_by_input
+        )
 
         # BDB 6/5/21
         # And now we use the parameter matrix as a list of what set of inputs
@@ -936,15 +1010,11 @@ class Processor_v3(object):
         artefacts_by_input = self._map_inputs(session, project_data)
         LOGGER.debug(f'artefacts_by_input={artefacts_by_input}')
 
-        param_sets = self._generate_parameter_matrix_pd(artefacts_by_input)
-        LOGGER.debug(f'parameter_matrix={param_sets}')
-
         # Apply filters (e.g., remove parameter sets where inputs don't match)
-        artefact_inputs = {}
-        for i, a in enumerate(project_data['assessors']):
-            artefact_inputs[a['full_path']] = a['INPUTS']
+        artefact_inputs = index_project_data(project_data)['inputs_by_path']
 
-        param_sets = self._filter_matrix_pd(param_sets, artefact_inputs)
+        param_sets = self._generate_parameter_matrix_pd(
+            artefacts_by_input, artefact_inputs)
         LOGGER.debug(f'filtered={param_sets}')
 
         return param_sets
@@ -1031,13 +1101,12 @@ class Processor_v3(object):
                     cur_res = inp_res
                     break
 
-            # TODO: optimize this to get resource list only once
             for vnum, vinput in enumerate(assr_inputs[v['input']]):
                 fname = None
-                robj = get_resource(assr._intf, vinput, resource)
 
                 # Get list of all files in the resource, relative paths
-                file_list = [x._urn for x in robj.files().get('path')]
+                file_list = resource_files(
+                    assr._intf, vinput, resource, self.resource_files)
                 if len(file_list) == 0:
                     LOGGER.debug('empty or missing resource')
                     raise NeedInputsException('No Resource')
@@ -1165,14 +1234,13 @@ class Processor_v3(object):
             # TODO: use project_data to initially check for resource in 
             # the scan RESOURCES, should be faster than querying xnat again
 
-
-            # TODO: optimize this to get resource list only once
             for vnum, vinput in enumerate(inputs[v['input']]):
                 fname = None
-                robj = get_resource(assr._intf, vinput, resource)
 
                 # Get list of all files in the resource, relative paths
-                file_list = [x._urn for x in robj.files().get('path')]
+                file_list = resource_files(
+                    assr._intf, vinput, resource,
+                    get_resource_catalog(project_data))
                 if len(file_list) == 0:
                     LOGGER.debug('empty or missing resource')
                     raise NeedInputsException('No Resource')
@@ -1374,31 +1442,25 @@ class Processor_v3(object):
 
     def _get_petscans(self, session, project_data):
         petscans = []
-        scans = project_data.get('scans')
-        subject = ''
+        index = index_project_data(project_data)
+        scans = index['scans_by_session'].get(session, [])
 
-        for s in scans:
-            if s['SESSION'] == session:
-                subject = s['SUBJECT']
-                break
-
-        if subject:
-            petscans = [x for x in scans if x['SUBJECT'] == subject and x['XSITYPE'] == 'xnat:petSessionData']
+        if scans:
+            subject = scans[0]['SUBJECT']
+            petscans = [x for x in index['scans_by_subject'][subject] if x['XSITYPE'] == 'xnat:petSessionData']
 
         return petscans
 
     def is_first_mr_session(self, session, project_data):
         is_first = True
 
-        # Get the sessions/dates for this subject
-        scans = project_data.get('scans')
-        subject = [x for x in scans if x['SESSION'] == session][0]['SUBJECT']
-        LOGGER.debug(f'is_first_mr_session:{session}:{subject}:getting scans')
-        scans = [x for x in scans if x['SUBJECT'] == subject and x['XSITYPE'] == 'xnat:mrSessionData']
-        scans = sorted(scans, key=lambda x: x['DATE'])
+        # Get the first mr session for this subject
+        index = index_project_data(project_data)
+        subject = index['scans_by_session'][session][0]['SUBJECT']
+        first_session = index['first_mr_session'].get(subject)
 
         # Check if this is the first
-        if len(scans) > 0 and scans[0]['SESSION'] != session:
+        if first_session is not None and first_session != session:
             LOGGER.debug(f'is_first_mr_session:{session}:nope')
             is_first = False
 
@@ -1411,8 +1473,9 @@ class Processor_v3(object):
 
         # Get lists for scans/assrs for this session
         LOGGER.debug('prepping session data')
-        scans = [x for x in project_data.get('scans') if x['SESSION'] == session]
-        assrs = [x for x in project_data.get('assessors') if x['SESSION'] == session]
+        index = index_project_data(project_data)
+        scans = index['scans_by_session'].get(session, [])
+        assrs = index['assessors_by_session'].get(session, [])
 
         petscans = []
         # if this is the first mri, add scans
@@ -1426,51 +1489,43 @@ class Processor_v3(object):
         for i, iv in sorted(inputs.items()):
             if 'tracer' in iv and iv['tracer']:
                 # PET scan
+                tracer_regex = compile_patterns(tuple(iv['tracer']))
+                types_regex = compile_patterns(tuple(iv['types']))
                 for p in petscans:
                     # Match the tracer name
-                    tracer_name = p['TRACER']
-                    tracer_match = False
-                    for expression in iv['tracer']:
-                        regex = re.compile(fnmatch.translate(expression))
-                        if regex.match(tracer_name):
-                            # found a match so exit the loop
-                            tracer_match = True
-                            break
-
-                    if not tracer_match:
+                    if not tracer_regex.match(p['TRACER']):
                         # None of the expressions matched
                         continue
 
                     # Now try to match the scan type
-                    for expression in iv['types']:
-                        regex = re.compile(fnmatch.translate(expression))
-                        if regex.match(p['SCANTYPE']):
-                            # Found a match, now check quality
-                            if p['QUALITY'] == 'unusable':
-                                LOGGER.debug('excluding unusable scan')
-                            else:
-                                artefacts_by_input[i].append(p['full_path'])
+                    if types_regex.match(p['SCANTYPE']):
+                        # Found a match, now check quality
+                        if p['QUALITY'] == 'unusable':
+                            LOGGER.debug('excluding unusable scan')
+                        else:
+                            artefacts_by_input[i].append(p['full_path'])
 
             elif iv['artefact_type'] == 'scan':
                 # Input is a scan, so we iterate subject scans
-                # to look for matches
+                # to look for matches, matching each scan type only once
+                types_regex = compile_patterns(tuple(iv['types']))
+                type_matches = {}
                 for cscan in scans:
-                    # First we try to match the session type of the scan
                     # match scan type
-                    for expression in iv['types']:
-                        regex = re.compile(fnmatch.translate(expression))
-                        if regex.match(cscan.get('SCANTYPE')):
-                            scanid = cscan.get('SCANID')
-                            LOGGER.debug('match found!')
-                            if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
-                                LOGGER.info(f'Excluding unusable scan:{scanid}')
-                            else:
-                                # Get scan path, scan ID for each matching scan.
-                                # Break if the scan matches so we don't find it again comparing
-                                # vs a different requested type
-                                artefacts_by_input[i].append(cscan['full_path'])
-                                artefact_ids_by_input[i].append(scanid)
-                                break
+                    scantype = cscan.get('SCANTYPE')
+                    if scantype not in type_matches:
+                        type_matches[scantype] = bool(
+                            types_regex.match(scantype))
+
+                    if type_matches[scantype]:
+                        scanid = cscan.get('SCANID')
+                        LOGGER.debug('match found!')
+                        if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
+                            LOGGER.info(f'Excluding unusable scan:{scanid}')
+                        else:
+                            # Get scan path, scan ID for each matching scan.
+                            artefacts_by_input[i].append(cscan['full_path'])
+                            artefact_ids_by_input[i].append(scanid)
 
                 # If requested, check for multiple matching scans in the list and only keep
                 # the first. Sort lowercase by alpha, on scan ID.
@@ -1694,25 +1749,19 @@ class Processor_v3(object):
             input_dimension_map.append(merged_input_vector)
 
         # perform a cartesian product of the dimension map entries to get the
-        # final input combinations
-        matrix = [
-            list(itertools.chain.from_iterable(x))
-            for x in itertools.product(*input_dimension_map)
+        # final input combinations, checking the match filters along the way
+        checks = utilities.match_checks(
+            self.match_filters,
+            all_inputs,
+            lambda name, row: get_input_value(name, row, artefacts))
+
+        return [
+            utilities.matrix_row(all_inputs, x)
+            for x in utilities.filtered_product(input_dimension_map, checks)
         ]
 
-        matrix_headers = list(itertools.chain.from_iterable(all_inputs))
-
-        # rebuild the matrix to order the inputs consistently
-        final_matrix = []
-        for r in matrix:
-            row = dict()
-            for i in range(len(matrix_headers)):
-                row[matrix_headers[i]] = r[i]
-            final_matrix.append(row)
-
-        return final_matrix
-
-    def _generate_parameter_matrix_pd(self, artefacts_by_input):
+    def _generate_parameter_matrix_pd(self, artefacts_by_input,
+                                      artefact_inputs):
         inputs = self.proc_inputs
         iteration_sources = self.iteration_sources
 
@@ -1753,24 +1802,17 @@ class Processor_v3(object):
             input_dimension_map.append(merged_input_vector)
 
         # perform a cartesian product of the dimension map entries to get the
-        # final input combinations
-        matrix = [
-            list(itertools.chain.from_iterable(x))
-            for x in itertools.product(*input_dimension_map)
+        # final input combinations, checking the match filters along the way
+        checks = utilities.match_checks(
+            self.match_filters,
+            all_inputs,
+            lambda name, row: get_input_value_pd(name, row, artefact_inputs))
+
+        return [
+            utilities.matrix_row(all_inputs, x)
+            for x in utilities.filtered_product(input_dimension_map, checks)
         ]
 
-        matrix_headers = list(itertools.chain.from_iterable(all_inputs))
-
-        # rebuild the matrix to order the inputs consistently
-        final_matrix = []
-        for r in matrix:
-            row = dict()
-            for i in range(len(matrix_headers)):
-                row[matrix_headers[i]] = r[i]
-            final_matrix.append(row)
-
-        return final_matrix
-
     def _compare_to_existing(self, csess, parameter_matrix):
         assessors = [[] for _ in range(len(parameter_matrix))]
 
@@ -1807,74 +1849,6 @@ class Processor_v3(object):
 
         return list(zip(copy.deepcopy(parameter_matrix), assessors))
 
-    def _filter_matrix(self, parameter_matrix, artefacts):
-        match_filters = self.match_filters
-
-        filtered_matrix = []
-        for cur_param in parameter_matrix:
-            # Reset matching for this param set
-            all_match = True
-
-            for cur_filter in match_filters:
-                # Get the first value to compare with others
-                first_val = get_input_value(
-                    cur_filter[0], cur_param, artefacts)
-
-                # Compare other values with first value
-                for cur_input in cur_filter[1:]:
-                    cur_val = get_input_value(cur_input, cur_param, artefacts)
-
-                    if cur_val is None:
-                        LOGGER.warn(f'cannot match, empty inputs:{cur_input}')
-                        all_match = False
-                        break
-
-                    if cur_val != first_val:
-                        # A single non-match breaks the whole thing
-                        all_match = False
-                        break
-
-            if all_match:
-                # Keep this param set if everything matches
-                filtered_matrix.append(cur_param)
-
-        return filtered_matrix
-
-    def _filter_matrix_pd(self, parameter_matrix, artefact_inputs):
-        match_filters = self.match_filters
-
-        filtered_matrix = []
-        for cur_param in parameter_matrix:
-            # Reset matching for this param set
-            all_match = True
-
-            for cur_filter in match_filters:
-                # Get the first value to compare with others
-                first_val = get_input_value_pd(
-                    cur_filter[0], cur_param, artefact_inputs)
-
-                # Compare other values with first value
-                for cur_input in cur_filter[1:]:
-                    cur_val = get_input_value_pd(
-                        cur_input, cur_param, artefact_inputs)
-
-                    if cur_val is None:
-                        logger.warn(f'cannot match, empty inputs:{cur_input}')
-                        all_match = False
-                        break
-
-                    if cur_val != first_val:
-                        # A single non-match breaks the whole thing
-                        all_match = False
-                        break
-
-            if all_match:
-                # Keep this param set if everything matches
-                filtered_matrix.append(cur_param)
-
-        return filtered_matrix
-
-
     def _populate_proc_inputs(self):
         for ik, iv in self.proc_inputs.items():
             for i, r in enumerate(iv['resources']):
@@ -1987,6 +1961,38 @@ def get_resource(xnat, input_path, resource):
     return robj
 
 
+def resource_files(xnat, input_path, resource, catalog):
+    """
+    Get the files of a scan or assessor resource, listed on XNAT only the
+    first time the resource is used in catalog
+
+    :param xnat: pyxnat.Interface object
+    :param input_path: path of the scan or assessor on XNAT
+    :param resource: label of the resource
+    :param catalog: dictionary of the file lists already fetched
+    :return: list of the file paths relative to the resource, not to be
+     modified
+    """
+    key = (input_path, resource)
+    if key not in catalog:
+        robj = get_resource(xnat, input_path, resource)
+        catalog[key] = [x._urn for x in robj.files().get('path')]
+
+    return catalog[key]
+
+
+def get_resource_catalog(project_data):
+    """
+    Get the file lists of the resources used as inputs, kept in project_data
+    like the index so each resource is listed once per build for all the
+    processors
+
+    :param project_data: dictionary of project data
+    :return: dictionary (input path, resource) -> list of files
+    """
+    return project_data.setdefault('resource_files', dict())
+
+
 # Returns the processing type (proctype) as parsed from the already
 # validated yaml file name
 def parse_proctype(yaml_file):
@@ -2028,9 +2034,8 @@ class SgpProcessor(Processor_v3):
 
     def get_assessor(self, xnat, subject, inputs, project_data):
         proctype = self.get_proctype()
-        sgp = project_data.get('sgp')
-        sgp = [x for x in sgp if x['SUBJECT'] == subject]
-        sgp = [x for x in sgp if x['PROCTYPE'] == proctype]
+        index = index_project_data(project_data)
+        sgp = index['sgp_by_proctype'].get((subject, proctype), [])
         sgp = [x for x in sgp if x['INPUTS'] == inputs]
 
         if len(sgp) > 0:
@@ -2352,15 +2357,11 @@ class SgpProcessor(Processor_v3):
         artefacts_by_input = self._map_inputs(subject, project_data)
         LOGGER.debug(f'artefacts_by_input={artefacts_by_input}')
 
-        param_sets = self._generate_parameter_matrix_pd(artefacts_by_input)
-        LOGGER.debug(f'parameter_matrix={param_sets}')
-
         # Filter down the combinations by applying any filters
-        artefact_inputs = {}
-        for i, a in enumerate(project_data['assessors']):
-            artefact_inputs[a['full_path']] = a['INPUTS']
+        artefact_inputs = index_project_data(project_data)['inputs_by_path']
 
-        param_sets = self._filter_matrix_pd(param_sets, artefact_inputs)
+        param_sets = self._generate_parameter_matrix_pd(
+            artefacts_by_input, artefact_inputs)
         LOGGER.debug(f'filtered={param_sets}')
 
         return param_sets
@@ -2399,13 +2400,13 @@ class SgpProcessor(Processor_v3):
                     cur_res = inp_res
                     break
 
-            # TODO: optimize this to get resource list only once
             for vnum, vinput in enumerate(inputs[v['input']]):
                 fname = None
-                robj = get_resource(assr._intf, vinput, resource)
 
                 # Get list of all files in the resource, relative paths
-                file_list = [x._urn for x in robj.files().get('path')]
+                file_list = resource_files(
+                    assr._intf, vinput, resource,
+                    get_resource_catalog(project_data))
                 if len(file_list) == 0:
                     LOGGER.debug('empty or missing resource')
                     raise NeedInputsException('No Resource')
@@ -2598,13 +2599,19 @@ class SgpProcessor(Processor_v3):
         artefacts_by_input = {k: [] for k in inputs}
 
         # Get lists for scans/assrs for this subject
-        scans = [x for x in project_data.get('scans') if x['SUBJECT'] == subject]
-        assrs = [x for x in project_data.get('assessors') if x['SUBJECT'] == subject]
+        index = index_project_data(project_data)
+        scans = index['scans_by_subject'].get(subject, [])
+        assrs = index['assessors_by_subject'].get(subject, [])
 
         # Find list of scans/assessors that match each specified input
         # for i, iv in list(inputs.items()):
         for i, iv in sorted(inputs.items()):
+            sesstypes_regex = compile_patterns(tuple(iv['sesstypes'] or []))
+
             if iv['artefact_type'] == 'scan':
+                tracers_regex = compile_patterns(tuple(iv['tracers'] or []))
+                types_regex = compile_patterns(tuple(iv['types']))
+
                 # Input is a scan, so we iterate subject scans
                 # to look for matches
                 for cscan in scans:
@@ -2617,46 +2624,30 @@ class SgpProcessor(Processor_v3):
 
                     # Check tracers
                     if iv['tracers']:
-                        tracer_match = False
-                        for tracer in iv['tracers']:
-                            regex = re.compile(fnmatch.translate(tracer))
-                            if regex.match(cscan['TRACER']):
-                                LOGGER.debug('tracer match')
-                                tracer_match = True
-
-                        if not tracer_match:
+                        if not tracers_regex.match(cscan['TRACER']):
                             # Wrong tracer
                             LOGGER.debug(f"wrong tracer:{cscan['TRACER']}")
                             continue
 
+                        LOGGER.debug('tracer match')
+
                     # Check sesstypes
                     if iv['sesstypes']:
-                        sesstypematch = False
-                        for typeexp in iv['sesstypes']:
-                            regex = re.compile(fnmatch.translate(typeexp))
-                            if regex.match(cscan.get('SESSTYPE')):
-                                sesstypematch = True
-                                LOGGER.debug('session type match')
-                                continue
-
-                        if not sesstypematch:
+                        if not sesstypes_regex.match(cscan.get('SESSTYPE')):
                             LOGGER.debug('no session type match')
                             continue
 
+                        LOGGER.debug('session type match')
+
                     # All matches for session, now match scan type
-                    for expression in iv['types']:
-                        regex = utilities.extract_exp(expression)
-                        if regex.match(cscan.get('SCANTYPE')):
-                            scanid = cscan.get('ID')
-                            if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
-                                LOGGER.info(f'Exclude unusable scan {scanid}')
-                            else:
-                                # Get scan path, scan ID for each matched scan.
-                                # Break if the scan matches so we don't find it
-                                # again comparing vs a different requested type
-                                artefacts_by_input[i].append(
-                                    cscan.get('full_path'))
-                                break
+                    if types_regex.match(cscan.get('SCANTYPE')):
+                        scanid = cscan.get('ID')
+                        if iv['skip_unusable'] and cscan.get('QUALITY') == 'unusable':
+                            LOGGER.info(f'Exclude unusable scan {scanid}')
+                        else:
+                            # Get scan path for each matched scan
+                            artefacts_by_input[i].append(
+                                cscan.get('full_path'))
 
             elif iv['artefact_type'] == 'assessor':
                 for cassr in assrs:
@@ -2669,17 +2660,7 @@ class SgpProcessor(Processor_v3):
                     # Then check session types
                     if iv['sesstypes']:
                         sesstype = cassr.get('SESSTYPE')
-                        sess_match = False
-                        for typeexp in iv['sesstypes']:
-                            regex = re.compile(fnmatch.translate(typeexp))
-                            if regex.match(sesstype):
-                                sess_match = True
-                                break
-                            else:
-                                LOGGER.debug(f'wrong sesstype:{typeexp}:{sesstype}')
-                                continue
-
-                        if not sess_match:
+                        if not sesstypes_regex.match(sesstype):
                             LOGGER.debug(f'no sesstype match:{sesstype}')
                             continue
 
@@ -2760,10 +2741,10 @@ def get_scan_status(project_data, scan_path):
     sess_label = path_parts[6]
     scan_label = path_parts[8]
 
-    scans = project_data.get('scans')
-    for s in scans:
-        if s['SESSION'] == sess_label and s['SCANID'] == scan_label:
-            return s['QUALITY']
+    scan = index_project_data(project_data)['scan_by_id'].get(
+        (sess_label, scan_label))
+    if scan is not None:
+        return scan['QUALITY']
 
     raise XnatUtilsError('Invalid scan path:' + scan_path)
 
@@ -2773,10 +2754,10 @@ def get_assr_status(project_data, assr_path):
     sess_label = path_parts[6]
     assr_label = path_parts[8]
 
-    assrs = project_data.get('assessors')
-    for a in assrs:
-        if a['SESSION'] == sess_label and a['ASSR'] == assr_label:
-            return a['PROCSTATUS'], a['QCSTATUS']
+    assr = index_project_data(project_data)['assessor_by_label'].get(
+        (sess_label, assr_label))
+    if assr is not None:
+        return assr['PROCSTATUS'], assr['QCSTATUS']
 
     raise XnatUtilsError('Invalid assessor path:' + assr_path)
 
@@ -8,9 +8,11 @@ from datetime import datetime
 import yaml
 import requests
 
-from ..cluster import PBS, count_jobs_rcq
+from ..cluster import PBS, QueueSnapshot, count_jobs_rcq
 from ..lockfiles import lock_flagfile, unlock_flagfile
+from ..processors_v3 import index_project_data
 from .projectinfo import load_project_info
+from .recordwriter import RecordWriter
 from ..utilities import get_this_instance, parse_list
 
 
@@ -264,13 +266,9 @@ class AnalysisLauncher(object):
                     continue
 
             if updates:
-                # upload changes
-                logger.debug(f'updating redcap:{updates}')
-                try:
-                    projects_redcap.import_records(updates)
-                except Exception as err:
-                    err = 'connection to REDCap interrupted'
-                    logger.error(err)
+                # upload changes in chunks
+                with RecordWriter(projects_redcap) as writer:
+                    writer.extend(updates)
 
             if launch_enabled:
 
@@ -284,10 +282,14 @@ class AnalysisLauncher(object):
                 p_limit = int(instance_settings['main_queuelimit_pending'])
                 u_limit = int(instance_settings['main_limit_pendinguploads'])
 
+                # Count the jobs on the cluster, then the ones we launch
+                queue = QueueSnapshot(lambda: count_jobs_rcq(
+                    self._resdir, instance_settings['main_rungroup']))
+
                 # Launch jobs
                 updates = []
                 for i, cur in enumerate(launch_list):
-                    launched, pending, uploads = count_jobs_rcq(self._resdir, instance_settings['main_rungroup'])
+                    launched, pending, uploads = queue.counts()
                     logger.info(f'Cluster:{launched}/{q_limit} total, {pending}/{p_limit} pending, {uploads}/{u_limit} uploads')
 
                     if launched >= q_limit:
@@ -309,6 +311,8 @@ class AnalysisLauncher(object):
 
                         # Check for success
                         if jobid and label:
+                            queue.job_submitted()
+
                             # Append to updates for redcap, clear existing info
                             updates.append({
                                 def_field: cur[def_field],
@@ -346,13 +350,9 @@ class AnalysisLauncher(object):
                             })
 
                 if updates:
-                    # upload changes
-                    logger.info(f'updating redcap:{updates}')
-                    try:
-                        projects_redcap.import_records(updates)
-                    except Exception as err:
-                        err = 'connection to REDCap interrupted'
-                        logger.error(err)
+                    # upload changes in chunks
+                    with RecordWriter(projects_redcap) as writer:
+                        writer.extend(updates)
         finally:
             # Delete the lock file
             logger.debug(f'deleting lock file:{lock_file}')
@@ -432,7 +432,7 @@ class AnalysisLauncher(object):
         inputs = []
 
         # Get the scans for this session
-        scans = [x for x in info['scans'] if x['SESSION'] == session]
+        scans = index_project_data(info)['scans_by_session'].get(session, [])
 
         for scan_spec in spec.get('scans', []):
             logger.debug(f'scan_spec={scan_spec}')
@@ -531,7 +531,8 @@ class AnalysisLauncher(object):
                         ))
 
         # Get the assessors for this session
-        assessors = [x for x in info['assessors'] if x['SESSION'] == session]
+        assessors = index_project_data(info)['assessors_by_session'].get(
+            session, [])
 
         # Filter to only complete assessors
         logger.debug(f'found {len(assessors)} total assessors, filtering')
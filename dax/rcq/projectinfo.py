@@ -1,7 +1,9 @@
 import logging
 import json
+import sys
 
 from dax.XnatUtils import decode_inputs
+from dax.processors_v3 import index_project_data
 
 
 logger = logging.getLogger('manager.rcq.projectinfo')
@@ -110,6 +112,12 @@ SGP_RENAME = {
     'proc:subjgenprocdata/validation/status': 'QCSTATUS',
     'proc:subjgenprocdata/inputs': 'INPUTS'}
 
+# Columns repeated across many rows, stored once in memory
+SHARED_COLUMNS = [
+    'PROJECT', 'SUBJECT', 'SESSION', 'SESSTYPE', 'TRACER', 'NOTE', 'DATE',
+    'SITE', 'SCANTYPE', 'QUALITY', 'XSITYPE', 'PROCTYPE', 'PROCSTATUS',
+    'QCSTATUS', 'QCBY']
+
 XSI2MOD = {
     'xnat:eegSessionData': 'EEG',
     'xnat:mrSessionData': 'MR',
@@ -126,8 +134,19 @@ def load_project_info(xnat, project):
     info['assessors'] = _load_assr_data(xnat, project)
     info['sgp'] = _load_sgp_data(xnat, project)
 
-    info['all_sessions'] = list(set([x['SESSION'] for x in info['scans']]))
-    info['all_subjects'] = list(set([x['SUBJECT'] for x in info['scans']]))
+    # Index once, the index is shared by all the processors
+    index = index_project_data(info)
+    info['all_sessions'] = list(index['scans_by_session'].keys())
+    info['all_subjects'] = list(index['scans_by_subject'].keys())
+
+    return info
+
+
+def _intern_columns(info):
+    """Share the strings of the columns repeated across rows."""
+    for k in SHARED_COLUMNS:
+        if isinstance(info.get(k), str):
+            info[k] = sys.intern(info[k])
 
     return info
 
@@ -156,7 +175,7 @@ def _scan_info(record):
         info['SCANID'])
     info['full_path'] = _p
 
-    return info
+    return _intern_columns(info)
 
 
 def _assessor_info(record):
@@ -180,7 +199,7 @@ def _assessor_info(record):
     # set_modality
     info['MODALITY'] = XSI2MOD.get(info['XSITYPE'], 'UNK')
 
-    return info
+    return _intern_columns(info)
 
 
 def _sgp_info(record):
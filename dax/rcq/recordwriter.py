@@ -0,0 +1,132 @@
+""" Write-behind buffer of REDCap record updates for rcq."""
+
+import logging
+import time
+
+
+logger = logging.getLogger('manager.rcq.recordwriter')
+
+
+# Records imported by each call to REDCap
+CHUNK_SIZE = 500
+
+# Tries of each chunk before giving up
+RETRIES = 3
+
+# Seconds before trying a chunk again, doubled after each failure
+RETRY_DELAY = 5
+
+
+class RecordWriter(object):
+    """Buffer of updates to REDCap records, imported in chunks.
+
+    Updates of the same record and repeat instance are merged, the last value
+    of each field wins. A chunk that fails is tried RETRIES times before its
+    updates are logged and dropped.
+    """
+    def __init__(
+        self,
+        projects_redcap,
+        chunk_size=CHUNK_SIZE,
+        retries=RETRIES,
+        retry_delay=RETRY_DELAY
+    ):
+        self._rc = projects_redcap
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._pending = {}
+        self.written = 0
+        self.failed = 0
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _key(self, update):
+        key = (
+            update[self._rc.def_field],
+            update.get('redcap_repeat_instrument', ''),
+            str(update.get('redcap_repeat_instance', '')))
+
+        if key[2] == 'new':
+            # Each new instance is a different record
+            key += (len(self._pending),)
+
+        return key
+
+    def add(self, update):
+        """Add an update, the buffer is imported once a chunk is full."""
+        key = self._key(update)
+        if key in self._pending:
+            self._pending[key].update(update)
+        else:
+            self._pending[key] = dict(update)
+
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def extend(self, updates):
+        """Add a list of updates."""
+        for update in updates:
+            self.add(update)
+
+    def flush(self):
+        """Import the buffered updates, return the ones that failed."""
+        updates = list(self._pending.values())
+        self._pending = {}
+        failed = []
+
+        for i in range(0, len(updates), self.chunk_size):
+            chunk = updates[i:i + self.chunk_size]
+            if not self._import_chunk(chunk):
+                failed.extend(chunk)
+
+        if updates:
+            logger.info(self.report())
+
+        return failed
+
+    def _import_chunk(self, chunk):
+        delay = self.retry_delay
+
+        for attempt in range(1, self.retries + 1):
+            logger.debug(f'updating redcap:{chunk}')
+            start = time.time()
+            try:
+                self._rc.import_records(chunk)
+                success = True
+            except Exception as err:
+                logger.warning(f'updating redcap failed:try {attempt}/{self.retries}:{err}')
+                success = False
+
+            self.calls += 1
+            self.seconds += time.time() - start
+
+            if success:
+                self.written += len(chunk)
+                return True
+
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+
+        logger.error(f'connection to REDCap interrupted, updates lost:{chunk}')
+        self.failed += len(chunk)
+        return False
+
+    def report(self):
+        """Describe the records written, latency and throughput."""
+        latency = self.seconds / self.calls if self.calls else 0.0
+        throughput = self.written / self.seconds if self.seconds else 0.0
+        return (
+            f'redcap writes:{self.written} records, {self.failed} failed, '
+            f'{self.calls} calls, {latency:.2f}s per call, '
+            f'{throughput:.1f} records/s')
@@ -94,14 +94,18 @@ class TaskBuilder(object):
                     include_filters = []
 
                 logger.debug(f'building processor:{filepath}')
-                self._build_processor(
-                    filepath,
-                    user_inputs,
-                    info,
-                    include_filters,
-                    custom=row['CUSTOM'],
-                    only_session=only_session,
-                    only_subject=only_subject)
+                try:
+                    self._build_processor(
+                        filepath,
+                        user_inputs,
+                        info,
+                        include_filters,
+                        custom=row['CUSTOM'],
+                        only_session=only_session,
+                        only_subject=only_subject)
+                finally:
+                    # Save the tasks built in REDCap
+                    self._queue.flush()
 
     def update_session(self, project, session):
         return self.update(project, only_session=session)
@@ -4,15 +4,17 @@ import os
 import logging
 import json
 import subprocess
-from datetime import date
+from datetime import date, datetime
 import shutil
 import time
 
 import pandas as pd
 
 from ..processors import load_from_yaml
-from ..cluster import PBS, count_jobs_rcq
+from ..cluster import PBS, QueueSnapshot, count_jobs_rcq
 from ..lockfiles import lock_flagfile, unlock_flagfile
+from ..task_store import get_task_store
+from .recordwriter import RecordWriter
 
 
 logger = logging.getLogger('manager.rcq.tasklauncher')
@@ -22,6 +24,120 @@ DONE_STATUSES = ['COMPLETE', 'JOB_FAILED', 'LOST']
 
 SUBDIRS = ['OUTLOG', 'PBS', 'PROCESSOR']
 
+# Open taskqueue records saved between updates, in resdir
+TASKQUEUE_CACHE = '.rcq_taskqueue.json'
+
+# Seconds subtracted from the time of the last export, for clock differences
+# with REDCap. REDCap compares date_begin in the local time of its server, set
+# main_rcqcursorslack (hours) in the instance settings when the time zones of
+# REDCap and of this host differ
+CURSOR_SLACK = 600
+
+# Seconds between two exports of all the taskqueue records
+FULL_SYNC_INTERVAL = 6 * 3600
+
+
+class TaskQueueCache(object):
+    """Open taskqueue records kept in a local file between updates.
+
+    Only the records modified since the last export of each project are
+    requested from REDCap, a full export is done every FULL_SYNC_INTERVAL
+    seconds.
+    """
+    def __init__(self, projects_redcap, cache_file, cursor_slack=CURSOR_SLACK):
+        self._projects_redcap = projects_redcap
+        self.cache_file = cache_file
+        self.cursor_slack = cursor_slack
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _save(self, cache):
+        # Write to a temp file first so the cache is never half written
+        tmp_file = f'{self.cache_file}.{os.getpid()}'
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, self.cache_file)
+
+    def _is_full_sync(self, cache, projects, now):
+        if not cache or 'cursors' not in cache:
+            return True
+
+        if now - cache['full'] > FULL_SYNC_INTERVAL:
+            return True
+
+        if cache['projects'] is None:
+            # Cache has all projects
+            return False
+
+        # Cache is missing projects
+        return projects is None or not set(projects) <= set(cache['projects'])
+
+    def open_tasks(self, projects=None):
+        """Get the open tasks of projects, all projects if None."""
+        def_field = self._projects_redcap.def_field
+        now = time.time()
+        cache = self._load()
+        full_sync = self._is_full_sync(cache, projects, now)
+
+        kwargs = {'forms': ['taskqueue'], 'fields': [def_field]}
+        if projects:
+            kwargs['records'] = projects
+
+        if full_sync:
+            logger.info(f'loading current taskqueue records:{projects}')
+            tasks = {}
+            cursors = {}
+            cache = {'full': now, 'projects': projects}
+        else:
+            logger.info(f'loading changed taskqueue records:{projects}')
+            tasks = cache['tasks']
+            cursors = cache['cursors']
+
+            # Start from the oldest export of the projects requested, each
+            # project keeps its own cursor so exporting a subset of the
+            # projects does not skip the changes of the others
+            cursor = min(
+                (cursors.get(p, cache['full']) for p in projects or cursors),
+                default=cache['full'])
+            kwargs['date_begin'] = datetime.fromtimestamp(
+                cursor - self.cursor_slack)
+
+        rec = self._projects_redcap.export_records(**kwargs)
+
+        # Replace the open tasks of each record exported
+        changed = {}
+        for x in rec:
+            project_tasks = changed.setdefault(x[def_field], [])
+            if x['redcap_repeat_instrument'] != 'taskqueue':
+                continue
+
+            if x['task_status'] in DONE_STATUSES + ['DELETED']:
+                continue
+
+            project_tasks.append(x)
+
+        logger.info(f'taskqueue records changed:{len(changed)}')
+        tasks.update(changed)
+        for p in (projects or set(tasks) | set(cursors)):
+            cursors[p] = now
+
+        cache.update({'cursors': cursors, 'tasks': tasks})
+
+        try:
+            self._save(cache)
+        except (IOError, OSError) as err:
+            logger.error(f'failed to save taskqueue cache:{err}')
+
+        if projects is None:
+            projects = sorted(tasks.keys())
+
+        return [t for p in projects for t in tasks.get(p, [])]
+
 
 class TaskLauncher(object):
     def __init__(self, projects_redcap, instance_settings):
@@ -30,6 +146,12 @@ class TaskLauncher(object):
         self.resdir = self._instance_settings['main_resdir']
         self._perlimit = self._instance_settings.get('main_perlimit', None)
 
+        # Hours of slack for the taskqueue exports, CURSOR_SLACK if not set
+        self._cursor_slack = CURSOR_SLACK
+        if self._instance_settings.get('main_rcqcursorslack', None):
+            self._cursor_slack = float(
+                self._instance_settings['main_rcqcursorslack']) * 3600
+
     def update(self, launch_enabled=True, projects=None):
         """Update all tasks in taskqueue of projects_redcap."""
         launch_list = []
@@ -49,25 +171,18 @@ class TaskLauncher(object):
             return
 
         try:
-            # Get the current task table
-            if projects:
-                logger.info(f'loading current taskqueue records:{projects}')
-                rec = projects_redcap.export_records(
-                    records=projects,
-                    forms=['taskqueue'],
-                    fields=[def_field])
-            else:
-                logger.info('loading current taskqueue records')
-                rec = projects_redcap.export_records(
-                    forms=['taskqueue'],
-                    fields=[def_field])
-
-            # Filter to only open jobs
-            rec = [x for x in rec if x['redcap_repeat_instrument'] == 'taskqueue']
-            rec = [x for x in rec if x['task_status'] not in DONE_STATUSES]
-
-            # Ignore deleted
-            rec = [x for x in rec if x['task_status'] != 'DELETED']
+            # Get the open tasks, only the records changed since the last
+            # update are exported from REDCap
+            rec = TaskQueueCache(
+                projects_redcap,
+                f'{resdir}/{TASKQUEUE_CACHE}',
+                self._cursor_slack,
+            ).open_tasks(projects)
+
+            # Get the state of all the running jobs at once
+            sacct_rows = get_sacct_rows([
+                x['task_jobid'] for x in rec
+                if x['task_status'] == 'RUNNING' and x.get('task_jobid', '')])
 
             # Update each task
             for i, t in enumerate(rec):
@@ -83,7 +198,7 @@ class TaskLauncher(object):
 
                     # check on running job
                     logger.debug(f'checking on running job:{assr}')
-                    task_updates = get_updates(t)
+                    task_updates = get_updates(t, sacct_rows)
                     if task_updates:
                         task_updates.update({
                             def_field: t[def_field],
@@ -139,13 +254,9 @@ class TaskLauncher(object):
                     continue
 
             if updates:
-                # upload changes
-                logger.info(f'updating redcap:{updates}')
-                try:
-                    projects_redcap.import_records(updates)
-                except Exception as err:
-                    err = 'connection to REDCap interrupted'
-                    logger.error(err)
+                # upload changes in chunks
+                with RecordWriter(projects_redcap) as writer:
+                    writer.extend(updates)
 
             if launch_enabled:
                 if self._perlimit:
@@ -159,10 +270,14 @@ class TaskLauncher(object):
                 u_limit = int(instance_settings['main_limit_pendinguploads'])
                 launch_delay = int(instance_settings['main_launch_delay_sec'])
 
+                # Count the jobs on the cluster, then the ones we launch
+                queue = QueueSnapshot(lambda: count_jobs_rcq(
+                    resdir, instance_settings['main_rungroup']))
+
                 # Launch jobs
                 updates = []
                 for i, t in enumerate(launch_list):
-                    launched, pending, uploads = count_jobs_rcq(resdir, instance_settings['main_rungroup'])
+                    launched, pending, uploads = queue.counts()
                     logger.info(f'Cluster:{launched}/{q_limit} total, {pending}/{p_limit} pending, {uploads}/{u_limit} uploads')
 
                     if launched >= q_limit:
@@ -222,6 +337,7 @@ class TaskLauncher(object):
                         # Launch it!
                         jobid = self.launch_task(t)
                         if jobid:
+                            queue.job_submitted()
                             updates.append({
                                 def_field: t[def_field],
                                 'redcap_repeat_instrument': 'taskqueue',
@@ -253,13 +369,9 @@ class TaskLauncher(object):
                         delete_task_dirs(outdir)
 
                 if updates:
-                    # upload changes
-                    logger.debug(f'updating redcap:{updates}')
-                    try:
-                        projects_redcap.import_records(updates)
-                    except Exception as err:
-                        err = 'connection to REDCap interrupted'
-                        logger.error(err)
+                    # upload changes in chunks
+                    with RecordWriter(projects_redcap) as writer:
+                        writer.extend(updates)
         finally:
             # Delete the lock file
             logger.debug(f'deleting lock file:{lock_file}')
@@ -394,18 +506,6 @@ class TaskLauncher(object):
             # Set task status to be saved as failed
             task['task_status'] = 'JOB_FAILED'
 
-        # Save attributes to disk
-        save_attr(f'{diskq}/jobstartdate/{assr}', today_str)
-        save_attr(f'{diskq}/jobid/{assr}', task['task_jobid'])
-        save_attr(f'{diskq}/memused/{assr}', task['task_memused'])
-        save_attr(f'{diskq}/walltimeused/{assr}', task['task_timeused'])
-        save_attr(f'{diskq}/jobnode/{assr}', task['task_jobnode'])
-
-        if task['task_status'] in ['COMPLETED', 'COMPLETE']:
-            save_attr(f'{diskq}/procstatus/{assr}', 'COMPLETE')
-        else:
-            save_attr(f'{diskq}/procstatus/{assr}', 'JOB_FAILED')
-
         # Copy batch file to diskq so upload works correctly
         try:
             os.makedirs(f'{diskq}/BATCH')
@@ -416,6 +516,21 @@ class TaskLauncher(object):
             f'{diskq}/BATCH/{assr}.slurm'
         )
 
+        if task['task_status'] in ['COMPLETED', 'COMPLETE']:
+            procstatus = 'COMPLETE'
+        else:
+            procstatus = 'JOB_FAILED'
+
+        # Save attributes to the diskq task store
+        get_task_store(diskq).set_attrs(assr, {
+            'jobstartdate': today_str,
+            'jobid': task['task_jobid'],
+            'memused': task['task_memused'],
+            'walltimeused': task['task_timeused'],
+            'jobnode': task['task_jobnode'],
+            'procstatus': procstatus,
+        })
+
         # Copy processor files for info on pdf
         try:
             os.makedirs(f'{diskq}/processor')
@@ -479,8 +594,41 @@ def delete_task_dirs(taskdir):
         logger.error(f'while deleting:{taskdir}')
 
 
-def get_updates(task):
-    """Update information about given task from local SLURM."""
+def get_sacct_rows(jobids, chunk_size=500):
+    """Get the sacct rows of the batch steps of jobs, one call per chunk.
+
+    Return dict of jobid to row without the JobID, None if sacct failed.
+    """
+    rows = {}
+
+    for i in range(0, len(jobids), chunk_size):
+        steps = ','.join(f'{x}.batch' for x in jobids[i:i + chunk_size])
+        cmd = f'sacct -j {steps} --units G --noheader -p --format JobID,MaxRss,cputime,NodeList,Start,End,State'
+
+        logger.debug(f'running command:{cmd}')
+
+        try:
+            output = subprocess.check_output(cmd, shell=True)
+            output = output.decode().strip()
+        except subprocess.CalledProcessError:
+            logger.info(f'error running command:{cmd}')
+            return None
+
+        for line in output.splitlines():
+            if '|' not in line:
+                continue
+
+            step, row = line.strip().split('|', 1)
+            rows[step.split('.')[0]] = row
+
+    return rows
+
+
+def get_updates(task, sacct_rows=None):
+    """Update information about given task from local SLURM.
+
+    sacct_rows from get_sacct_rows avoids a sacct call per task.
+    """
     assr = task['task_assessor']
     task_updates = {}
 
@@ -489,16 +637,20 @@ def get_updates(task):
         return
 
     jobid = task['task_jobid']
-    cmd = f'sacct -j {jobid}.batch --units G --noheader -p --format MaxRss,cputime,NodeList,Start,End,State'
 
-    logger.debug(f'running command:{cmd}')
+    if sacct_rows is not None:
+        output = sacct_rows.get(str(jobid), '')
+    else:
+        cmd = f'sacct -j {jobid}.batch --units G --noheader -p --format MaxRss,cputime,NodeList,Start,End,State'
 
-    try:
-        output = subprocess.check_output(cmd, shell=True)
-        output = output.decode().strip()
-    except subprocess.CalledProcessError:
-        logger.info(f'error running command:{cmd}')
-        return
+        logger.debug(f'running command:{cmd}')
+
+        try:
+            output = subprocess.check_output(cmd, shell=True)
+            output = output.decode().strip()
+        except subprocess.CalledProcessError:
+            logger.info(f'error running command:{cmd}')
+            return
 
     if not output:
         logger.debug(f'no output')
@@ -532,14 +684,3 @@ def get_updates(task):
         task_updates['task_status'] = job_state
 
     return task_updates
-
-
-def save_attr(path, value):
-    """Save attribute by writing given value to given file path."""
-    try:
-        os.makedirs(os.path.dirname(path))
-    except FileExistsError:
-        pass
-
-    with open(path, 'w') as f:
-        f.write(str(value) + '\n')
@@ -8,6 +8,7 @@ import pandas as pd
 import numpy as np
 
 from ..assessor_utils import parse_full_assessor_name, is_sgp_assessor
+from .recordwriter import RecordWriter
 
 
 logger = logging.getLogger('manager.rcq.taskqueue')
@@ -17,6 +18,9 @@ class TaskQueue(object):
 
     def __init__(self, projects_redcap):
         self._rc = projects_redcap
+        self._writer = RecordWriter(projects_redcap)
+        self._ids = {}
+        self._created = set()
 
     def sync(self, xnat, projects):
         def_field = self._rc.def_field
@@ -179,29 +183,44 @@ class TaskQueue(object):
         return updates
 
     def apply_updates(self, updates):
-        try:
-            self._rc.import_records(updates)
-        except Exception as err:
-            logger.error(err)
+        self._writer.extend(updates)
+        self._writer.flush()
+
+    def flush(self):
+        """Import the tasks added since the last flush."""
+        self._writer.flush()
+
+    def _task_ids(self, project):
+        """Get task ids of project by assessor, loaded once per project."""
+        if project not in self._ids:
+            rec = self._rc.export_records(
+                forms=['taskqueue'],
+                records=[project],
+                fields=[self._rc.def_field, 'task_assessor'])
+
+            rec = [x for x in rec if x['redcap_repeat_instrument'] == 'taskqueue']
+
+            ids = {}
+            for x in rec:
+                assessor = x['task_assessor']
+                if assessor in ids:
+                    logger.error(f'duplicate tasks for assessor, not good:{assessor}')
+                    continue
 
-    def _assessor_task_id(self, project, assessor):
-        task_id = None
+                ids[assessor] = x['redcap_repeat_instance']
 
-        rec = self._rc.export_records(
-            forms=['taskqueue'],
-            records=[project],
-            fields=[self._rc.def_field, 'task_assessor'])
+            self._ids[project] = ids
 
-        rec = [x for x in rec if x['redcap_repeat_instrument'] == 'taskqueue']
-        rec = [x for x in rec if x['task_assessor'] == assessor]
+        return self._ids[project]
 
-        if len(rec) > 1:
-            logger.error(f'duplicate tasks for assessor, not good:{assessor}')
-            task_id = rec[0]['redcap_repeat_instance']
-        elif len(rec) == 1:
-            task_id = rec[0]['redcap_repeat_instance']
+    def _assessor_task_id(self, project, assessor):
+        if (project, assessor) in self._created:
+            # REDCap numbers new tasks, write them to read their ids
+            self._writer.flush()
+            self._ids.pop(project, None)
+            self._created = set(x for x in self._created if x[0] != project)
 
-        return task_id
+        return self._task_ids(project).get(assessor, None)
 
     def _add_task(
         self,
@@ -215,7 +234,7 @@ class TaskQueue(object):
         userinputs,
         custom=False
     ):
-        """Add a new task record ."""
+        """Add a new task record, imported with the next chunk of updates."""
 
         # Convert to string for storing
         var2val = json.dumps(var2val)
@@ -233,56 +252,49 @@ class TaskQueue(object):
 
         if task_id:
             # Update existing record
-            try:
-                record = {
-                    def_field: project,
-                    'redcap_repeat_instrument': 'taskqueue',
-                    'redcap_repeat_instance': task_id,
-                    'task_status': 'QUEUED',
-                    'task_inputlist': inputlist,
-                    'task_var2val': var2val,
-                    'task_walltime': walltime,
-                    'task_memreq': memreq,
-                    'task_yamlfile': task_yamlfile,
-                    'task_userinputs': userinputs,
-                    'task_timeused': '',
-                    'task_memused': '',
-                }
-                response = self._rc.import_records([record])
-                assert 'count' in response
-                logger.debug('task record created')
-            except AssertionError as err:
-                logger.error(f'upload failed:{err}')
-                return
+            record = {
+                def_field: project,
+                'redcap_repeat_instrument': 'taskqueue',
+                'redcap_repeat_instance': task_id,
+                'task_status': 'QUEUED',
+                'task_inputlist': inputlist,
+                'task_var2val': var2val,
+                'task_walltime': walltime,
+                'task_memreq': memreq,
+                'task_yamlfile': task_yamlfile,
+                'task_userinputs': userinputs,
+                'task_timeused': '',
+                'task_memused': '',
+            }
         else:
-            # Create a new record
-            try:
-                record = {
-                    def_field: project,
-                    'redcap_repeat_instrument': 'taskqueue',
-                    'redcap_repeat_instance': 'new',
-                    'task_assessor': assr,
-                    'task_status': 'QUEUED',
-                    'task_inputlist': inputlist,
-                    'task_var2val': var2val,
-                    'task_walltime': walltime,
-                    'task_memreq': memreq,
-                    'task_yamlfile': task_yamlfile,
-                    'task_userinputs': userinputs,
-                }
-                response = self._rc.import_records([record])
-                assert 'count' in response
-                logger.debug('task record created')
-
-            except AssertionError as err:
-                logger.error(f'upload failed:{err}')
-                return
+            # Create a new record, REDCap assigns the instance when imported
+            self._created.add((project, assr))
+            record = {
+                def_field: project,
+                'redcap_repeat_instrument': 'taskqueue',
+                'redcap_repeat_instance': 'new',
+                'task_assessor': assr,
+                'task_status': 'QUEUED',
+                'task_inputlist': inputlist,
+                'task_var2val': var2val,
+                'task_walltime': walltime,
+                'task_memreq': memreq,
+                'task_yamlfile': task_yamlfile,
+                'task_userinputs': userinputs,
+            }
+
+        self._writer.add(record)
 
         # If the file is not in yaml dir, we need to upload it to the task
         if task_yamlfile == 'CUSTOM':
             logger.debug(f'yaml not in shared library, uploading to task')
+
+            # The record must exist before its file
+            if self._writer.flush():
+                logger.error(f'upload failed:{assr}')
+                return
+
             if not task_id:
-                # Try to match existing record
                 task_id = self._assessor_task_id(project, assr)
 
             logger.debug(f'uploading file:{yamlfile}')
@@ -74,6 +74,9 @@ class TrialBuilder(object):
 
                 self._build_session_trial(processor, session, info)
 
+            # Save the task in REDCap
+            self._queue.flush()
+
     def _build_session_trial(self, processor, session, project_info):
         # Get list of inputs sets (not yet matched with existing)
         inputsets = processor.parse_session_pd(session, project_info)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" retry.py
+
+Backoff, circuit breaker and alert rate limiting for XNAT requests
+"""
+
+import logging
+import random
+import threading
+import time
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['backoff_delay', 'CircuitBreaker', 'get_breaker']
+LOGGER = logging.getLogger('dax')
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Breakers shared by all the interfaces of this process, one per host
+_BREAKERS = dict()
+_BREAKERS_LOCK = threading.Lock()
+
+
+def backoff_delay(attempt, base, cap):
+    """
+    Exponential backoff with jitter
+
+    :param attempt: retry number, starting at 0
+    :param base: delay in seconds for the first retry
+    :param cap: maximum delay in seconds
+    :return: seconds to wait before the retry
+    """
+    delay = min(cap, base * (2 ** attempt))
+    return random.uniform(delay / 2.0, delay)
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker shared across requests to one XNAT host.
+
+    After threshold consecutive failed requests the breaker opens and every
+    request fails fast until cooldown seconds have passed. Then a single
+    request is let through, the breaker closes again if it succeeds.
+    The breaker also keeps the counters reported by stats().
+    """
+    def __init__(self, threshold=5, cooldown=300, alert_interval=3600):
+        """
+        Entry point for the CircuitBreaker class
+
+        :param threshold: consecutive failures before opening
+        :param cooldown: seconds to stay open before trying again
+        :param alert_interval: minimum seconds between two alerts
+        :return: None
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.alert_interval = alert_interval
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_alert = None
+        self.lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'failures': 0,
+            'retries': 0,
+            'fast_fails': 0,
+            'breaker_opens': 0,
+            'alerts_sent': 0,
+            'alerts_suppressed': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def allow(self):
+        """
+        Check if a request can be sent
+
+        :return: True if the request can go, False to fail fast
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN and \
+               time.time() - self.opened_at >= self.cooldown:
+                # Let one request through to test the host
+                self.state = HALF_OPEN
+                return True
+
+            self.counters['fast_fails'] += 1
+            return False
+
+    def is_open(self):
+        """
+        Check if the breaker is failing requests fast
+
+        :return: True if open, False otherwise
+        """
+        with self.lock:
+            return self.state == OPEN
+
+    def record_success(self, latency):
+        """
+        Record a request that got a response from the host
+
+        :param latency: seconds the request took
+        :return: None
+        """
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['latency_total'] += latency
+            self.counters['latency_max'] = max(
+                self.counters['latency_max'], latency)
+            if self.state != CLOSED:
+                LOGGER.info('XNAT is responding again, closing breaker')
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self, latency):
+        """
+        Record a request that timed out or could not connect
+
+        :param latency: seconds the request took
+        :return: None
+        """
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['failures'] += 1
+            self.counters['latency_total'] += latency
+            self.counters['latency_max'] = max(
+                self.counters['latency_max'], latency)
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+               (self.state == CLOSED and self.failures >= self.threshold):
+                LOGGER.warn('XNAT not responding, opening breaker for %s secs'
+                            % str(self.cooldown))
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.counters['breaker_opens'] += 1
+
+    def record_retry(self):
+        """
+        Record a request sent again after a failure
+
+        :return: None
+        """
+        with self.lock:
+            self.counters['retries'] += 1
+
+    def should_alert(self):
+        """
+        Check if an alert can be sent now, counting the suppressed ones
+
+        :return: number of alerts suppressed since the last one sent,
+         or None if this alert must be suppressed
+        """
+        with self.lock:
+            now = time.time()
+            if self.last_alert is not None and \
+               now - self.last_alert < self.alert_interval:
+                self.counters['alerts_suppressed'] += 1
+                return None
+
+            suppressed = self.counters['alerts_suppressed']
+            self.counters['alerts_suppressed'] = 0
+            self.counters['alerts_sent'] += 1
+            self.last_alert = now
+            return suppressed
+
+    def stats(self):
+        """
+        Get the counters of the breaker
+
+        :return: dictionary of counters, state and average latency
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats['state'] = self.state
+            if stats['requests'] > 0:
+                stats['latency_avg'] = \
+                    stats['latency_total'] / stats['requests']
+            else:
+                stats['latency_avg'] = 0.0
+            return stats
+
+
+def get_breaker(host, threshold=5, cooldown=300, alert_interval=3600):
+    """
+    Get the circuit breaker shared by all the requests to host
+
+    :param host: XNAT host url
+    :return: CircuitBreaker object
+    """
+    with _BREAKERS_LOCK:
+        if host not in _BREAKERS:
+            _BREAKERS[host] = CircuitBreaker(
+                threshold, cooldown, alert_interval)
+        return _BREAKERS[host]
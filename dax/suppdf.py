@@ -12,6 +12,7 @@ from PyPDF2 import PdfReader, PdfWriter
 from .XnatUtils import get_assessor_inputs
 from .utilities import read_yaml
 from .assessor_utils import parse_full_assessor_name, is_sgp_assessor
+from .task_store import ATTRIBUTES, get_task_store
 from .version import VERSION as dax_version
 
 # TODO: recode this so the arguments are just the text to use
@@ -225,12 +226,12 @@ def load_version(assr_path):
 
 
 def load_attr(assr_path, attr):
-    filepath = os.path.join(
-            os.path.dirname(assr_path),
-            'DISKQ',
-            attr,
-            os.path.basename(assr_path))
+    diskq = os.path.join(os.path.dirname(assr_path), 'DISKQ')
+    if attr in ATTRIBUTES:
+        return get_task_store(diskq).get_attr(
+            os.path.basename(assr_path), attr)
 
+    filepath = os.path.join(diskq, attr, os.path.basename(assr_path))
     with open(filepath, 'r') as f:
         return f.readline().strip()
 
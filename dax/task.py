@@ -13,10 +13,11 @@ from .errors import (NeedInputsException, NoDataException,
                      ClusterLaunchException)
 from .dax_settings import DAX_Settings, DEFAULT_DATATYPE, DEFAULT_FS_DATATYPE
 from . import assessor_utils
+from .task_store import get_task_store
 
 
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
-__all__ = ['Task', 'ClusterTask', 'XnatTask']
+__all__ = ['Task', 'ClusterTask', 'XnatTask', 'AttributeBuffer']
 DAX_SETTINGS = DAX_Settings()
 # Logger to print logs
 LOGGER = logging.getLogger('dax')
@@ -109,15 +110,105 @@ def create_flag(flag_path):
     open(flag_path, 'w').close()
 
 
+class AttributeBuffer(object):
+    """Pending attribute changes of XNAT assessors.
+
+    Tasks given a buffer stage their changes here instead of writing each one,
+    flush() then writes all the changes of an assessor with a single mset.
+    Later values of the same attribute replace earlier ones.
+    """
+    def __init__(self):
+        self._pending = {}
+        self.changes = 0
+        self.requests = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def mset(self, assessor, values):
+        """
+        Stage attribute values of an assessor
+
+        :param assessor: pyxnat assessor object
+        :param values: dictionary of attribute paths to values
+        :return: None
+
+        """
+        if not values:
+            return
+
+        if assessor._uri in self._pending:
+            self._pending[assessor._uri][1].update(values)
+        else:
+            self._pending[assessor._uri] = (assessor, dict(values))
+
+        self.changes += 1
+
+    def pending(self, assessor):
+        """
+        Get the staged attribute values of an assessor
+
+        :param assessor: pyxnat assessor object
+        :return: dictionary of attribute paths to values not yet written
+
+        """
+        if assessor._uri in self._pending:
+            return dict(self._pending[assessor._uri][1])
+
+        return {}
+
+    def flush(self):
+        """
+        Write the staged values, one request per assessor
+
+        :return: list of the assessors that could not be updated
+
+        """
+        pending = list(self._pending.values())
+        self._pending = {}
+        failed = []
+
+        for assessor, values in pending:
+            try:
+                assessor.attrs.mset(values)
+                self.requests += 1
+            except Exception as err:
+                LOGGER.error('failed to set attributes of %s: %s'
+                             % (assessor._uri, err))
+                failed.append(assessor)
+
+        self.failed += len(failed)
+        if pending:
+            LOGGER.debug(self.report())
+
+        return failed
+
+    def report(self):
+        """Describe the requests saved by buffering."""
+        return ('assessor attributes: %d changes, %d requests, %d saved, '
+                '%d failed' % (self.changes, self.requests,
+                               self.changes - self.requests - self.failed,
+                               self.failed))
+
+
 class Task(object):
     """ Class Task to generate/manage the assessor with the cluster """
-    def __init__(self, processor, assessor, upload_dir):
+    def __init__(self, processor, assessor, upload_dir, attr_buffer=None):
         """
         Init of class Task
 
         :param processor: processor used
         :param assessor: pyxnat assessor object
         :param upload_dir: upload directory to copy data after job finished.
+        :param attr_buffer: AttributeBuffer to stage changes on XNAT in,
+         attributes are written right away if None
         :return: None
 
         """
@@ -125,10 +216,36 @@ class Task(object):
         self.assessor = assessor
         self.upload_dir = upload_dir
         self.atype = processor.xsitype.lower()
+        self.attr_buffer = attr_buffer
 
         # Cache for convenience
         self.assessor_label = assessor_utils.full_label_from_assessor(assessor)
 
+    def _write_attrs(self, values):
+        """
+        Set attributes of the assessor on XNAT, staged in the attribute buffer
+         of the task if it has one
+
+        :param values: dictionary of attribute paths to values
+        :return: None
+
+        """
+        if self.attr_buffer is not None:
+            self.attr_buffer.mset(self.assessor, values)
+        else:
+            self.assessor.attrs.mset(values)
+
+    def _pending_attrs(self):
+        """
+        Get the attributes of the assessor staged but not yet written
+
+        :return: dictionary of attribute paths to values
+        """
+        if self.attr_buffer is None:
+            return {}
+
+        return self.attr_buffer.pending(self.assessor)
+
     def get_processor_name(self):
         """
         Get the name of the Processor for the Task.
@@ -243,7 +360,7 @@ class Task(object):
         :return: None
 
         """
-        self.assessor.attrs.set('%s/memused' % self.atype, memused)
+        self._write_attrs({'%s/memused' % self.atype: memused})
 
     def get_walltime(self):
         """
@@ -264,7 +381,7 @@ class Task(object):
         :return: None
 
         """
-        self.assessor.attrs.set('%s/walltimeused' % self.atype, walltime)
+        self._write_attrs({'%s/walltimeused' % self.atype: walltime})
 
     def get_jobnode(self):
         """
@@ -286,7 +403,7 @@ class Task(object):
         :return: None
 
         """
-        self.assessor.attrs.set('%s/jobnode' % self.atype, jobnode)
+        self._write_attrs({'%s/jobnode' % self.atype: jobnode})
 
     def undo_processing(self):
         """
@@ -568,7 +685,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.set('%s/jobstartdate' % self.atype, date_str)
+        self._write_attrs({'%s/jobstartdate' % self.atype: date_str})
 
     def get_createdate(self):
         """
@@ -588,7 +705,7 @@ undo_processing...')
         :return: String of today's date in "%Y-%m-%d" format
 
         """
-        self.assessor.attrs.set('%s/date' % self.atype, date_str)
+        self._write_attrs({'%s/date' % self.atype: date_str})
         return date_str
 
     def set_createdate_today(self):
@@ -614,8 +731,10 @@ undo_processing...')
             xnat_status = DOES_NOT_EXIST
         elif self.atype.lower() in [DEFAULT_DATATYPE.lower(),
                                     DEFAULT_FS_DATATYPE.lower()]:
-            xnat_status = self.assessor.attrs.get('%s/procstatus'
-                                                  % self.atype.lower())
+            name = '%s/procstatus' % self.atype.lower()
+            xnat_status = self._pending_attrs().get(name)
+            if xnat_status is None:
+                xnat_status = self.assessor.attrs.get(name)
         else:
             xnat_status = 'UNKNOWN_xsiType: %s' % self.atype
         return xnat_status
@@ -629,12 +748,10 @@ undo_processing...')
         """
         if cached_sessions:
             for csess in cached_sessions:
-                for cassr in csess.assessors():
-                    if cassr.label() == self.assessor_label:
-                        pstatus = cassr.info()['procstatus']
-                        qstatus = cassr.info()['qcstatus']
-                        jobid = cassr.info()['jobid']
-                        return pstatus, qstatus, jobid
+                cassr = csess.assessor(self.assessor_label)
+                if cassr is not None:
+                    info = cassr.info()
+                    return info['procstatus'], info['qcstatus'], info['jobid']
 
         if not self.assessor.exists():
             xnat_status = DOES_NOT_EXIST
@@ -642,11 +759,12 @@ undo_processing...')
             jobid = ''
         elif self.atype.lower() in [DEFAULT_DATATYPE.lower(),
                                     DEFAULT_FS_DATATYPE.lower()]:
-            xnat_status, qcstatus, jobid = self.assessor.attrs.mget([
-                '%s/procstatus' % self.atype,
-                '%s/validation/status' % self.atype,
-                '%s/jobid' % self.atype
-            ])
+            names = ['%s/procstatus' % self.atype,
+                     '%s/validation/status' % self.atype,
+                     '%s/jobid' % self.atype]
+            values = dict(zip(names, self.assessor.attrs.mget(names)))
+            values.update(self._pending_attrs())
+            xnat_status, qcstatus, jobid = [values[x] for x in names]
         else:
             xnat_status = 'UNKNOWN_xsiType: %s' % self.atype
             qcstatus = 'UNKNOWN_xsiType: %s' % self.atype
@@ -662,7 +780,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.set('%s/procstatus' % self.atype, status)
+        self._write_attrs({'%s/procstatus' % self.atype: status})
 
     def get_qcstatus(self):
         """
@@ -694,7 +812,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.mset({
+        self._write_attrs({
             '%s/validation/status' % self.atype: qcstatus,
             '%s/validation/validated_by' % self.atype: 'NULL',
             '%s/validation/date' % self.atype: 'NULL',
@@ -711,7 +829,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.mset({
+        self._write_attrs({
             '%s/procstatus' % self.atype: procstatus,
             '%s/validation/status' % self.atype: qcstatus,
         })
@@ -724,7 +842,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.set('%s/jobid' % self.atype, jobid)
+        self._write_attrs({'%s/jobid' % self.atype: jobid})
 
     def set_launch(self, jobid):
         """
@@ -736,7 +854,7 @@ undo_processing...')
 
         """
         today_str = str(date.today())
-        self.assessor.attrs.mset({
+        self._write_attrs({
             '%s/jobstartdate' % self.atype.lower(): today_str,
             '%s/jobid' % self.atype.lower(): jobid,
             '%s/procstatus' % self.atype.lower(): JOB_RUNNING,
@@ -844,6 +962,7 @@ class ClusterTask(Task):
         self.assessor_id = None
         self.diskq = diskq
         self.upload_dir = upload_dir
+        self.job_snapshot = None
 
     def get_processor_name(self):
         """
@@ -921,7 +1040,10 @@ class ClusterTask(Task):
             return
 
         # Get usage with tracejob
-        jobinfo = cluster.tracejob_info(jobid, jobstrdate)
+        if self.job_snapshot:
+            jobinfo = self.job_snapshot.tracejob_info(jobid, jobstrdate)
+        else:
+            jobinfo = cluster.tracejob_info(jobid, jobstrdate)
         if jobinfo['mem_used'].strip():
             self.set_memused(jobinfo['mem_used'])
         else:
@@ -1012,13 +1134,16 @@ class ClusterTask(Task):
         """
         raise NotImplementedError()
 
-    def update_status(self):
+    def update_status(self, job_snapshot=None):
         """
         Update the status of a Cluster Task object.
 
+        :param job_snapshot: cluster.JobSnapshot shared by the tasks updated
+         together, None to query the cluster for this job only
         :return: the "new" status (updated) of the Task.
 
         """
+        self.job_snapshot = job_snapshot
         old_status = self.get_status()
         new_status = old_status
         LOGGER.debug('old_status='+old_status)
@@ -1068,7 +1193,10 @@ class ClusterTask(Task):
         jobid = self.get_jobid()
 
         if jobid and jobid != '0':
-            jobstatus = cluster.job_status(jobid)
+            if self.job_snapshot:
+                jobstatus = self.job_snapshot.job_status(jobid)
+            else:
+                jobstatus = cluster.job_status(jobid)
 
         LOGGER.debug('jobid,jobstatus='+str(jobid)+','+str(jobstatus))
 
@@ -1229,9 +1357,9 @@ class ClusterTask(Task):
 
         """
         today_str = str(date.today())
-        self.set_attr('jobstartdate', today_str)
-        self.set_attr('jobid', jobid)
-        self.set_attr('procstatus', JOB_RUNNING)
+        self.set_attrs({'jobstartdate': today_str,
+                        'jobid': jobid,
+                        'procstatus': JOB_RUNNING})
 
     def commands(self, jobdir):
         """
@@ -1336,23 +1464,13 @@ class ClusterTask(Task):
         raise NotImplementedError()
 
     def get_attr(self, name):
-        apath = self.attr_path(name)
-
-        if not os.path.exists(apath):
-            return None
-
-        with open(apath, 'r') as f:
-            return f.read().strip()
+        return get_task_store(self.diskq).get_attr(self.assessor_label, name)
 
     def set_attr(self, name, value):
-        attr_path = self.attr_path(name)
-        attr_dir = os.path.dirname(attr_path)
-        mkdirp(attr_dir)
-        with open(self.attr_path(name), 'w') as f:
-            f.write(str(value) + '\n')
+        self.set_attrs({name: value})
 
-    def attr_path(self, attr):
-        return os.path.join(self.diskq, attr, self.assessor_label)
+    def set_attrs(self, values):
+        get_task_store(self.diskq).set_attrs(self.assessor_label, values)
 
     def complete_task(self):
         self.check_job_usage()
@@ -1411,8 +1529,12 @@ class ClusterTask(Task):
         return JOB_FAILED
 
     def delete_attr(self, attr):
+        get_task_store(self.diskq).delete_attr(self.assessor_label, attr)
+
+    def delete_processor_spec(self):
+        # Delete processor spec file
         try:
-            os.remove(self.attr_path(attr))
+            os.remove(self.processor_spec_path())
         except OSError:
             pass
 
@@ -1425,27 +1547,27 @@ class ClusterTask(Task):
 
     def delete(self):
         # Delete attributes
-        attr_list = ['jobid', 'jobnode', 'procstatus', 'walltimeused',
-                     'memused', 'jobstartdate', 'processor']
-        for attr in attr_list:
-            self.delete_attr(attr)
-
+        get_task_store(self.diskq).delete_task(self.assessor_label)
+        self.delete_processor_spec()
         self.delete_batch()
 
 
 class XnatTask(Task):
     """ Class Task to generate/manage the assessor with the cluster """
-    def __init__(self, processor, assessor, upload_dir, diskq):
+    def __init__(self, processor, assessor, upload_dir, diskq,
+                 attr_buffer=None):
         """
         Init of class Task
 
         :param processor: processor used
         :param assessor: assessor dict ?
         :param upload_dir: upload directory to copy data when job finished.
+        :param attr_buffer: AttributeBuffer to stage changes on XNAT in
         :return: None
 
         """
-        super(XnatTask, self).__init__(processor, assessor, upload_dir)
+        super(XnatTask, self).__init__(
+            processor, assessor, upload_dir, attr_buffer)
         self.diskq = diskq
 
     def check_job_usage(self):
@@ -1590,6 +1712,7 @@ undo_processing...')
                         self.processor.job_template)
             LOGGER.info('writing:' + batch_file)
             batch.write()
+            get_task_store(self.diskq).add_task(self.assessor_label)
 
             # Set new statuses to be updated
             new_proc_status = JOB_RUNNING
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" task_store.py
+
+SQLite store for the attributes of the DISKQ tasks
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['TaskStore', 'get_task_store']
+LOGGER = logging.getLogger('dax')
+
+TASK_DB = 'tasks.db'
+BATCH_DIRNAME = 'BATCH'
+# Attributes stored for each task, they were one file per task in
+# DISKQ/<attribute>/<assessor_label> before the store
+ATTRIBUTES = ['procstatus', 'jobid', 'memused', 'walltimeused', 'jobnode',
+              'jobstartdate']
+# Status of a task without procstatus, see ClusterTask.get_status
+DEFAULT_STATUS = 'NEED_TO_RUN'
+
+# Stores of this process, one per DISKQ directory
+_STORES = dict()
+_STORES_LOCK = threading.Lock()
+
+
+class TaskStore(object):
+    """
+    Tasks of a DISKQ directory and their attributes in a single SQLite file,
+     indexed by status and project. The tasks found in the old one file per
+     attribute layout are imported when the file is created.
+    """
+    def __init__(self, diskq, timeout=60):
+        """
+        Entry point for the TaskStore class
+
+        :param diskq: DISKQ directory of the tasks
+        :param timeout: seconds to wait for a lock held by another process
+        :return: None
+        """
+        self.diskq = diskq
+        self.db_path = os.path.join(diskq, TASK_DB)
+        self.lock = threading.Lock()
+        if not os.path.isdir(diskq):
+            os.makedirs(diskq)
+
+        self.conn = sqlite3.connect(
+            self.db_path, timeout=timeout, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                'label TEXT PRIMARY KEY, project TEXT, session TEXT, %s)'
+                % ', '.join('%s TEXT' % a for a in ATTRIBUTES))
+            self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_procstatus '
+                              'ON tasks (procstatus)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_project '
+                              'ON tasks (project, label)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta ('
+                              'name TEXT PRIMARY KEY, value TEXT)')
+
+        self.import_diskq()
+
+    def import_diskq(self):
+        """
+        Import the tasks of the one file per attribute layout, only once
+
+        :return: None
+        """
+        batch_dir = os.path.join(self.diskq, BATCH_DIRNAME)
+        with self.lock, self.conn:
+            # Take the write lock so a single process imports
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE name='imported'").fetchone()
+            if row:
+                return
+
+            imported = list()
+            if os.path.isdir(batch_dir):
+                for batch_file in os.listdir(batch_dir):
+                    label = os.path.splitext(batch_file)[0]
+                    values = dict()
+                    for attr in ATTRIBUTES:
+                        apath = os.path.join(self.diskq, attr, label)
+                        if os.path.exists(apath):
+                            with open(apath, 'r') as f:
+                                values[attr] = f.read().strip()
+                            imported.append(apath)
+
+                    self._insert(label, values)
+
+            self.conn.execute(
+                "INSERT INTO meta (name, value) VALUES ('imported', '1')")
+
+        if imported:
+            LOGGER.info('imported %s task attributes into %s'
+                        % (str(len(imported)), self.db_path))
+
+        # Attributes now live in the store, remove the old files
+        for apath in imported:
+            try:
+                os.remove(apath)
+            except OSError:
+                pass
+
+    def _insert(self, label, values=None):
+        """
+        Add a task if missing, the lock and transaction are the caller's
+
+        :param label: assessor label of the task
+        :param values: dictionary of attributes of the task
+        :return: None
+        """
+        # Same fields as XnatUtils.AssessorHandler, that module imports ours
+        project = session = None
+        labels = label.split('-x-')
+        if len(labels) in [4, 5]:
+            project = labels[0]
+            session = labels[2]
+
+        values = values or dict()
+        self.conn.execute(
+            'INSERT OR IGNORE INTO tasks (label, project, session, %s) '
+            'VALUES (?, ?, ?, %s)'
+            % (', '.join(ATTRIBUTES), ', '.join('?' for _ in ATTRIBUTES)),
+            [label, project, session] + [values.get(a) for a in ATTRIBUTES])
+
+    def add_task(self, label):
+        """
+        Add a task to the store, call it when writing the batch file
+
+        :param label: assessor label of the task
+        :return: None
+        """
+        with self.lock, self.conn:
+            self._insert(label)
+
+    def delete_task(self, label):
+        """
+        Remove a task and its attributes from the store
+
+        :param label: assessor label of the task
+        :return: None
+        """
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM tasks WHERE label=?', (label,))
+
+    def get_attr(self, label, name):
+        """
+        Get an attribute of a task
+
+        :param label: assessor label of the task
+        :param name: name of the attribute, one of ATTRIBUTES
+        :return: the value, None if not set
+        """
+        self._check_attr(name)
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT %s FROM tasks WHERE label=?' % name,
+                (label,)).fetchone()
+
+        return row[0] if row else None
+
+    def set_attrs(self, label, values):
+        """
+        Set attributes of a task in a single transaction
+
+        :param label: assessor label of the task
+        :param values: dictionary of attributes name -> value
+        :return: None
+        """
+        names = list(values.keys())
+        for name in names:
+            self._check_attr(name)
+
+        with self.lock, self.conn:
+            self._insert(label)
+            self.conn.execute(
+                'UPDATE tasks SET %s WHERE label=?'
+                % ', '.join('%s=?' % n for n in names),
+                [str(values[n]).strip() for n in names] + [label])
+
+    def delete_attr(self, label, name):
+        """
+        Unset an attribute of a task
+
+        :param label: assessor label of the task
+        :param name: name of the attribute, one of ATTRIBUTES
+        :return: None
+        """
+        self._check_attr(name)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'UPDATE tasks SET %s=NULL WHERE label=?' % name, (label,))
+
+    @staticmethod
+    def _where(status=None, projects=None, sess_filter=None):
+        """
+        Build the conditions of a query on the tasks
+
+        :param status: procstatus of the tasks, None for all
+        :param projects: list of projects, None for all
+        :param sess_filter: list of session labels, None for all
+        :return: tuple (list of conditions, list of parameters)
+        """
+        where = list()
+        params = list()
+        if status == DEFAULT_STATUS:
+            where.append("(procstatus=? OR procstatus IS NULL "
+                         "OR procstatus='')")
+            params.append(status)
+        elif status:
+            where.append('procstatus=?')
+            params.append(status)
+
+        for column, values in [('project', projects),
+                               ('session', sess_filter)]:
+            if values:
+                values = list(values)
+                where.append('%s IN (%s)'
+                             % (column, ', '.join('?' for _ in values)))
+                params.extend(values)
+
+        return where, params
+
+    def count_tasks(self, status=None, proj_filter=None, sess_filter=None):
+        """
+        Count the tasks with an indexed query
+
+        :param status: procstatus of the tasks, None for all
+        :param proj_filter: list of projects, None for all
+        :param sess_filter: list of session labels, None for all
+        :return: number of tasks
+        """
+        where, params = self._where(status, proj_filter, sess_filter)
+        query = 'SELECT COUNT(*) FROM tasks'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def iter_tasks(self, status=None, proj_filter=None, sess_filter=None,
+                   chunk_size=100):
+        """
+        Iterate over the tasks, reading chunk_size of them at a time.
+         The tasks are in the order of the projects in proj_filter, then by
+         label. Tasks updated while iterating are not returned twice.
+
+        :param status: procstatus of the tasks, None for all
+        :param proj_filter: list of projects in priority order, None for all
+        :param sess_filter: list of session labels, None for all
+        :param chunk_size: number of tasks read by each query
+        :return: generator of assessor labels
+        """
+        if proj_filter:
+            # Keep the first occurence of each project
+            projects = list()
+            for project in proj_filter:
+                if [project] not in projects:
+                    projects.append([project])
+        else:
+            projects = [None]
+
+        for project in projects:
+            where, params = self._where(status, project, sess_filter)
+            where.append('label > ?')
+            query = 'SELECT label FROM tasks WHERE %s ORDER BY label LIMIT ?'\
+                    % ' AND '.join(where)
+
+            last = ''
+            while True:
+                with self.lock:
+                    labels = [r[0] for r in self.conn.execute(
+                        query, params + [last, chunk_size])]
+
+                for label in labels:
+                    yield label
+
+                if len(labels) < chunk_size:
+                    break
+
+                last = labels[-1]
+
+    def list_tasks(self, status=None, proj_filter=None, sess_filter=None):
+        """
+        List the tasks, in the same order as iter_tasks
+
+        :param status: procstatus of the tasks, None for all
+        :param proj_filter: list of projects in priority order, None for all
+        :param sess_filter: list of session labels, None for all
+        :return: list of assessor labels
+        """
+        return list(self.iter_tasks(status, proj_filter, sess_filter))
+
+    @staticmethod
+    def _check_attr(name):
+        """
+        Check the name of an attribute before using it in a query
+
+        :param name: name of the attribute
+        :raises: ValueError if not one of ATTRIBUTES
+        :return: None
+        """
+        if name not in ATTRIBUTES:
+            raise ValueError('unknown task attribute: %s' % name)
+
+
+def get_task_store(diskq):
+    """
+    Get the task store of a DISKQ directory shared by this process
+
+    :param diskq: DISKQ directory of the tasks
+    :return: TaskStore object
+    """
+    # One connection per process, they can not be shared after a fork
+    key = (os.getpid(), os.path.abspath(diskq))
+    with _STORES_LOCK:
+        if key not in _STORES:
+            _STORES[key] = TaskStore(diskq)
+        return _STORES[key]
@@ -0,0 +1,46 @@
+
+from unittest import TestCase, mock
+
+from dax import cluster
+
+
+SQUEUE_OUTPUT = b'101 R\n102 PD\n103 CG\n'
+
+SACCT_OUTPUT = (b'104|||\n'
+                b'104.batch|2048K|00:10:00|node01\n'
+                b'104.extern|12K|00:10:00|node01\n')
+
+
+class JobSnapshotUnitTests(TestCase):
+
+    @mock.patch('dax.cluster.sb.check_output')
+    def test_bulk_job_status(self, check_output):
+        check_output.return_value = SQUEUE_OUTPUT
+        statuses = cluster.bulk_job_status()
+        self.assertEqual(statuses, {'101': 'R', '102': None, '103': None})
+
+    @mock.patch('dax.cluster.sb.check_output')
+    def test_bulk_job_usage(self, check_output):
+        check_output.return_value = SACCT_OUTPUT
+        usage = cluster.bulk_job_usage(['104', '0', ''])
+        self.assertEqual(check_output.call_count, 1)
+        self.assertEqual(usage, {'104': {'mem_used': '2048',
+                                         'walltime_used': '00:10:00',
+                                         'jobnode': 'node01'}})
+
+    @mock.patch('dax.cluster.sb.check_output')
+    def test_snapshot_queries_once(self, check_output):
+        check_output.side_effect = [SQUEUE_OUTPUT, SACCT_OUTPUT]
+        snapshot = cluster.JobSnapshot(['101', '102', '104'])
+        self.assertEqual(snapshot.job_status('101'), 'R')
+        self.assertEqual(snapshot.job_status('102'), None)
+        self.assertEqual(snapshot.tracejob_info('104', '2020-01-01'),
+                         {'mem_used': '2048',
+                          'walltime_used': '00:10:00',
+                          'jobnode': 'node01'})
+        self.assertEqual(snapshot.tracejob_info('104', '2020-01-01'),
+                         {'mem_used': '2048',
+                          'walltime_used': '00:10:00',
+                          'jobnode': 'node01'})
+        self.assertEqual(check_output.call_count, 2)
+        self.assertIn('-j 104 ', check_output.call_args[0][0])
@@ -811,3 +811,36 @@ class ProcessorParserUnitTests(TestCase):
               "It must be one of 'all', 'some'")]
         self.assertEqual(errors, expected)
 
+    def test_generate_parameter_matrix_match_filters(self):
+        class TestEntity:
+            def __init__(self, inputs):
+                self.inputs = inputs
+
+            def get_inputs(self):
+                return self.inputs
+
+        class TestArtefact:
+            def __init__(self, inputs=None):
+                self.entity = TestEntity(inputs)
+
+        t1s = ['/t1/{}'.format(i) for i in range(3)]
+        asrs = ['/asr/{}'.format(i) for i in range(3)]
+        artefacts = dict((x, TestArtefact()) for x in t1s)
+        for t1, asr in zip(t1s, asrs):
+            artefacts[asr] = TestArtefact({'t1': t1})
+
+        inputs = {
+            'scan1': {'select': ['foreach'], 'required': True},
+            'asr1': {'select': ['foreach'], 'required': True}}
+        artefacts_by_input = {'scan1': t1s, 'asr1': asrs}
+
+        matrix = ProcessorParser.iter_parameter_matrix(
+            inputs, ['scan1', 'asr1'], {}, artefacts, artefacts_by_input,
+            [['scan1', 'asr1/t1']])
+        self.assertEqual(
+            list(matrix),
+            [{'scan1': t1, 'asr1': asr} for t1, asr in zip(t1s, asrs)])
+
+        matrix = ProcessorParser.generate_parameter_matrix(
+            inputs, ['scan1', 'asr1'], {}, artefacts, artefacts_by_input)
+        self.assertEqual(len(matrix), 9)
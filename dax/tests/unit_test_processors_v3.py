@@ -0,0 +1,59 @@
+from unittest import TestCase, mock
+
+from dax import processors_v3
+from dax.task import NeedInputsException
+
+
+SCAN_PATH = '/projects/P/subjects/S/experiments/E/scans/1'
+
+
+def fake_resource(xnat, input_path, resource):
+    robj = mock.Mock()
+    if resource == 'NIFTI':
+        robj.files.return_value.get.return_value = [
+            mock.Mock(_urn='t1.nii.gz')]
+    else:
+        robj.files.return_value.get.return_value = []
+    return robj
+
+
+class ResourceCatalogUnitTests(TestCase):
+    def setUp(self):
+        self.proc = processors_v3.Processor_v3.__new__(
+            processors_v3.Processor_v3)
+        self.proc.proc_inputs = {
+            'scan_t1': {
+                'artefact_type': 'scan',
+                'needs_qc': False,
+                'resources': [
+                    {'varname': 't1', 'ftype': 'FILE', 'resource': 'NIFTI',
+                     'fmatch': '*.nii.gz'},
+                    {'varname': 'edat', 'ftype': 'FILE',
+                     'resource': 'EDAT'}]}}
+        self.proc.variables_to_inputs = {
+            't1': {'input': 'scan_t1', 'resource': 'NIFTI'}}
+        self.assr = mock.Mock()
+        self.assr._intf.host = 'https://xnat'
+
+    @mock.patch('dax.processors_v3.get_resource', side_effect=fake_resource)
+    def test_resource_listed_once_per_build(self, get_resource):
+        project_data = {}
+        inputs = {'scan_t1': [SCAN_PATH]}
+        for _ in range(2):
+            variable_set, input_list = self.proc.find_inputs_pd(
+                self.assr, inputs, project_data)
+            self.assertEqual(variable_set, {'t1': 't1.nii.gz'})
+
+        self.assertEqual(get_resource.call_count, 1)
+
+        # Empty listings are kept too
+        self.proc.variables_to_inputs = {
+            'edat': {'input': 'scan_t1', 'resource': 'EDAT'}}
+        for _ in range(2):
+            with self.assertRaises(NeedInputsException):
+                self.proc.find_inputs_pd(self.assr, inputs, project_data)
+
+        self.assertEqual(get_resource.call_count, 2)
+        self.assertEqual(
+            project_data['resource_files'],
+            {(SCAN_PATH, 'NIFTI'): ['t1.nii.gz'], (SCAN_PATH, 'EDAT'): []})
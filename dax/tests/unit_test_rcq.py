@@ -0,0 +1,199 @@
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase, mock
+
+from dax.rcq import tasklauncher
+from dax.rcq.recordwriter import RecordWriter
+from dax.rcq.taskqueue import TaskQueue
+
+
+SACCT_OUTPUT = (b'201.batch|1.5G|01:00:00|node01|2024-01-01T10:00:00|'
+                b'2024-01-01T11:00:00|COMPLETED|\n'
+                b'202.batch||00:05:00|node02|2024-01-01T10:55:00|Unknown|'
+                b'RUNNING|\n')
+
+
+def task_row(project, instance, status, jobid=''):
+    return {
+        'project_name': project,
+        'redcap_repeat_instrument': 'taskqueue',
+        'redcap_repeat_instance': instance,
+        'task_assessor': f'{project}-x-S-x-E-x-proc-x-{instance}',
+        'task_status': status,
+        'task_jobid': jobid}
+
+
+class FakeRedcap(object):
+    def __init__(self, rows):
+        self.def_field = 'project_name'
+        self.rows = rows
+        self.exports = []
+
+        self.imports = []
+        self.fail_imports = 0
+        self.files = []
+
+    def import_records(self, records):
+        if self.fail_imports:
+            self.fail_imports -= 1
+            raise IOError('connection lost')
+        self.imports.append(records)
+        for x in records:
+            if x['redcap_repeat_instance'] == 'new':
+                # Number new instances like REDCap
+                ids = [int(y['redcap_repeat_instance']) for y in self.rows
+                       if y['project_name'] == x['project_name']]
+                self.rows.append(dict(
+                    x, redcap_repeat_instance=max(ids or [0]) + 1))
+        return {'count': len(records)}
+
+    def import_file(self, **kwargs):
+        self.files.append((kwargs['record'], kwargs['repeat_instance']))
+
+    def export_records(self, **kwargs):
+        self.exports.append(kwargs)
+        records = kwargs.get('records')
+        return [x for x in self.rows
+                if not records or x['project_name'] in records]
+
+
+class TaskQueueCacheUnitTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_only_changed_records_exported(self):
+        rc = FakeRedcap([
+            {'project_name': 'A', 'redcap_repeat_instrument': ''},
+            task_row('A', 1, 'RUNNING', '201'),
+            task_row('A', 2, 'COMPLETE'),
+            task_row('B', 1, 'QUEUED')])
+
+        tasks = tasklauncher.TaskQueueCache(rc, self.cache_file).open_tasks()
+        self.assertEqual(
+            [(x['project_name'], x['redcap_repeat_instance']) for x in tasks],
+            [('A', 1), ('B', 1)])
+        self.assertNotIn('date_begin', rc.exports[0])
+
+        # B was modified, A comes from the cache
+        rc.rows = [task_row('B', 1, 'RUNNING', '202'), task_row('B', 2, 'QUEUED')]
+        tasks = tasklauncher.TaskQueueCache(rc, self.cache_file).open_tasks()
+        self.assertIn('date_begin', rc.exports[1])
+        self.assertEqual(
+            [(x['project_name'], x['task_status']) for x in tasks],
+            [('A', 'RUNNING'), ('B', 'RUNNING'), ('B', 'QUEUED')])
+
+        tasks = tasklauncher.TaskQueueCache(rc, self.cache_file).open_tasks(
+            ['A'])
+        self.assertIn('date_begin', rc.exports[2])
+        self.assertEqual([x['project_name'] for x in tasks], ['A'])
+
+    def test_full_export_for_new_projects(self):
+        rc = FakeRedcap([task_row('A', 1, 'QUEUED'), task_row('B', 1, 'QUEUED')])
+        tasklauncher.TaskQueueCache(rc, self.cache_file).open_tasks(['A'])
+        tasks = tasklauncher.TaskQueueCache(rc, self.cache_file).open_tasks(
+            ['A', 'B'])
+        self.assertNotIn('date_begin', rc.exports[1])
+        self.assertEqual(len(tasks), 2)
+
+    @mock.patch('dax.rcq.tasklauncher.time.time')
+    def test_cursor_per_project(self, now):
+        rc = FakeRedcap([task_row('A', 1, 'QUEUED'), task_row('B', 1, 'QUEUED')])
+        for t, projects in [(1000, None), (2000, ['A']), (3000, ['A'])]:
+            now.return_value = t
+            tasklauncher.TaskQueueCache(rc, self.cache_file, 7200).open_tasks(
+                projects)
+
+        # Exporting A does not move the cursor of B
+        now.return_value = 4000
+        tasklauncher.TaskQueueCache(rc, self.cache_file, 7200).open_tasks()
+        self.assertEqual(
+            [x.get('date_begin') for x in rc.exports],
+            [None] + [datetime.fromtimestamp(t - 7200)
+                      for t in [1000, 2000, 1000]])
+
+
+class SacctUnitTests(TestCase):
+
+    @mock.patch('dax.rcq.tasklauncher.subprocess.check_output')
+    def test_get_updates_from_bulk_sacct(self, check_output):
+        check_output.return_value = SACCT_OUTPUT
+        rows = tasklauncher.get_sacct_rows(['201', '202'])
+        self.assertEqual(check_output.call_count, 1)
+
+        updates = tasklauncher.get_updates(
+            task_row('A', 1, 'RUNNING', '201'), rows)
+        self.assertEqual(updates['task_status'], 'COMPLETED')
+        self.assertEqual(updates['task_memused'], '1.5G')
+
+        updates = tasklauncher.get_updates(
+            task_row('A', 2, 'RUNNING', '202'), rows)
+        self.assertEqual(updates, {'task_jobnode': 'node02',
+                                   'task_jobstart': '2024-01-01T10:55:00'})
+        self.assertEqual(check_output.call_count, 1)
+
+
+class RecordWriterUnitTests(TestCase):
+
+    @mock.patch('dax.rcq.recordwriter.time.sleep')
+    def test_coalesce_chunk_and_retry(self, sleep):
+        rc = FakeRedcap([])
+        rc.fail_imports = 1
+        with RecordWriter(rc, chunk_size=2) as writer:
+            writer.add(task_row('A', 1, 'RUNNING'))
+            writer.add({'project_name': 'A',
+                        'redcap_repeat_instrument': 'taskqueue',
+                        'redcap_repeat_instance': 1,
+                        'task_status': 'COMPLETED'})
+            self.assertEqual(len(writer), 1)
+            writer.add(task_row('A', 2, 'QUEUED'))
+
+            # Full chunk imported on the second try
+            self.assertEqual(len(writer), 0)
+            self.assertEqual(sleep.call_count, 1)
+            writer.add(task_row('B', 1, 'QUEUED'))
+
+        self.assertEqual(
+            [[x['task_status'] for x in chunk] for chunk in rc.imports],
+            [['COMPLETED', 'QUEUED'], ['QUEUED']])
+        self.assertEqual((writer.written, writer.failed, writer.calls),
+                         (3, 0, 3))
+
+    def test_new_tasks_numbered_by_redcap(self):
+        rc = FakeRedcap([task_row('A', 3, 'COMPLETE')])
+        queue = TaskQueue(rc)
+        for assr in ['A-x-1', 'A-x-2', rc.rows[0]['task_assessor']]:
+            queue._add_task('A', assr, [], {}, '1:00:00', 1024,
+                            '/tmp/proc.yaml', None)
+
+        self.assertEqual(rc.imports, [])
+        queue.flush()
+        self.assertEqual(len(rc.imports), 1)
+        self.assertEqual(
+            [x['redcap_repeat_instance'] for x in rc.imports[0]],
+            ['new', 'new', 3])
+
+    def test_custom_task_flushed_before_upload(self):
+        rc = FakeRedcap([task_row('A', 3, 'COMPLETE')])
+        queue = TaskQueue(rc)
+        queue._add_task('A', 'A-x-1', [], {}, '1:00:00', 1024,
+                        '/tmp/proc.yaml', None)
+        with tempfile.NamedTemporaryFile(suffix='.yaml') as f:
+            queue._add_task('A', 'A-x-2', [], {}, '1:00:00', 1024,
+                            f.name, None, custom=True)
+
+        # Both new tasks written, the file goes to the one REDCap numbered
+        self.assertEqual(len(rc.imports), 1)
+        self.assertEqual(rc.files, [('A', 5)])
+
+        # Adding a task created in this build updates it
+        queue._add_task('A', 'A-x-1', [], {}, '1:00:00', 1024,
+                        '/tmp/proc.yaml', None)
+        queue.flush()
+        self.assertEqual(rc.imports[-1][0]['redcap_repeat_instance'], 4)
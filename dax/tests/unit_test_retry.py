@@ -0,0 +1,43 @@
+
+from unittest import TestCase
+
+from dax import retry
+
+
+class CircuitBreakerUnitTests(TestCase):
+
+    def test_backoff_delay(self):
+        for attempt in range(6):
+            delay = retry.backoff_delay(attempt, 5, 60)
+            expected = min(60, 5 * 2 ** attempt)
+            self.assertGreaterEqual(delay, expected / 2.0)
+            self.assertLessEqual(delay, expected)
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = retry.CircuitBreaker(threshold=2, cooldown=0)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure(1.0)
+        self.assertFalse(breaker.is_open())
+        breaker.record_failure(1.0)
+        self.assertTrue(breaker.is_open())
+
+        # Cooldown over: one trial request, closing on success
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success(0.5)
+        self.assertTrue(breaker.allow())
+
+        stats = breaker.stats()
+        self.assertEqual(stats['state'], retry.CLOSED)
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['failures'], 2)
+        self.assertEqual(stats['fast_fails'], 1)
+        self.assertEqual(stats['breaker_opens'], 1)
+
+    def test_alerts_rate_limited(self):
+        breaker = retry.CircuitBreaker(alert_interval=3600)
+        self.assertEqual(breaker.should_alert(), 0)
+        self.assertIsNone(breaker.should_alert())
+        self.assertIsNone(breaker.should_alert())
+        breaker.last_alert -= 3600
+        self.assertEqual(breaker.should_alert(), 2)
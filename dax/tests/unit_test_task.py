@@ -0,0 +1,77 @@
+
+from unittest import TestCase
+
+from dax.task import (Task, AttributeBuffer, COMPLETE, JOB_PENDING,
+                      NEED_TO_RUN, RERUN)
+
+
+class FakeAttrs(object):
+    def __init__(self, values):
+        self.values = values
+        self.requests = []
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def mget(self, names):
+        return [self.values.get(x) for x in names]
+
+    def set(self, name, value):
+        self.mset({name: value})
+
+    def mset(self, values):
+        self.requests.append(dict(values))
+        self.values.update(values)
+
+
+class FakeAssessor(object):
+    def __init__(self, label, values):
+        self._uri = '/data/experiments/' + label
+        self._label = label
+        self.attrs = FakeAttrs(values)
+
+    def label(self):
+        return self._label
+
+    def exists(self):
+        return True
+
+    def out_resources(self):
+        return []
+
+
+class FakeProcessor(object):
+    xsitype = 'proc:genProcData'
+
+
+class AttributeBufferUnitTests(TestCase):
+
+    def test_rerun_written_in_one_request(self):
+        assr = FakeAssessor('P-x-S-x-E-x-proc-x-1', {
+            'proc:genprocdata/procstatus': COMPLETE,
+            'proc:genprocdata/validation/status': RERUN,
+            'proc:genprocdata/jobid': '100'})
+
+        with AttributeBuffer() as attr_buffer:
+            task = Task(FakeProcessor(), assr, '/tmp', attr_buffer)
+            self.assertEqual(task.update_status(), NEED_TO_RUN)
+            task.set_launch('200')
+            self.assertEqual(assr.attrs.requests, [])
+
+            # Staged values are seen by the task
+            self.assertEqual(task.get_status(), 'JOB_RUNNING')
+            self.assertEqual(task.get_statuses(),
+                             ('JOB_RUNNING', JOB_PENDING, '200'))
+
+        self.assertEqual(len(assr.attrs.requests), 1)
+        self.assertEqual(assr.attrs.values['proc:genprocdata/jobnode'], ' ')
+        self.assertEqual(attr_buffer.changes, 7)
+        self.assertEqual(attr_buffer.requests, 1)
+        self.assertIn('6 saved', attr_buffer.report())
+
+    def test_without_buffer(self):
+        assr = FakeAssessor('P-x-S-x-E-x-proc-x-1', {})
+        task = Task(FakeProcessor(), assr, '/tmp')
+        task.set_status(NEED_TO_RUN)
+        task.set_jobid('200')
+        self.assertEqual(len(assr.attrs.requests), 2)
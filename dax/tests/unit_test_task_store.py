@@ -0,0 +1,117 @@
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dax import task_store
+from dax.launcher import Launcher
+from dax.task import ClusterTask, JOB_RUNNING, NEED_TO_RUN
+
+
+class TaskStoreUnitTests(TestCase):
+
+    def setUp(self):
+        self.resdir = tempfile.mkdtemp()
+        self.diskq = os.path.join(self.resdir, 'DISKQ')
+        os.makedirs(os.path.join(self.diskq, 'BATCH'))
+
+    def tearDown(self):
+        shutil.rmtree(self.resdir)
+
+    def write_file(self, *path, content=''):
+        fpath = os.path.join(self.diskq, *path)
+        if not os.path.isdir(os.path.dirname(fpath)):
+            os.makedirs(os.path.dirname(fpath))
+        with open(fpath, 'w') as f:
+            f.write(content)
+        return fpath
+
+    def test_import_diskq_layout(self):
+        label = 'proj1-x-subj1-x-sess1-x-scan1-x-proc1'
+        self.write_file('BATCH', label + '.slurm')
+        status_file = self.write_file('procstatus', label,
+                                      content=JOB_RUNNING + '\n')
+        self.write_file('jobid', label, content='1234\n')
+        self.write_file('BATCH', 'proj2-x-subj2-x-sess2-x-proc2.slurm')
+
+        store = task_store.TaskStore(self.diskq)
+        self.assertFalse(os.path.exists(status_file))
+        self.assertEqual(store.get_attr(label, 'procstatus'), JOB_RUNNING)
+        self.assertEqual(store.get_attr(label, 'jobid'), '1234')
+        self.assertEqual(store.list_tasks(status=JOB_RUNNING), [label])
+        self.assertEqual(store.list_tasks(status=NEED_TO_RUN),
+                         ['proj2-x-subj2-x-sess2-x-proc2'])
+        self.assertEqual(store.list_tasks(proj_filter=['proj2'],
+                                          sess_filter=['sess2']),
+                         ['proj2-x-subj2-x-sess2-x-proc2'])
+
+        # Imported once only
+        self.write_file('BATCH', 'proj3-x-subj3-x-sess3-x-proc3.slurm')
+        store = task_store.TaskStore(self.diskq)
+        self.assertEqual(len(store.list_tasks()), 2)
+
+    def test_cluster_task_attributes(self):
+        label = 'proj1-x-subj1-x-sess1-x-proc1'
+        self.write_file('BATCH', label + '.slurm')
+        task_store.get_task_store(self.diskq).add_task(label)
+
+        ctask = ClusterTask(label, self.resdir, self.diskq)
+        self.assertEqual(ctask.get_status(), NEED_TO_RUN)
+        ctask.set_launch('5678')
+        self.assertEqual(ctask.get_status(), JOB_RUNNING)
+        self.assertEqual(ctask.get_jobid(), '5678')
+        ctask.delete_attr('jobid')
+        self.assertIsNone(ctask.get_jobid())
+
+        ctask.delete()
+        self.assertEqual(
+            task_store.get_task_store(self.diskq).list_tasks(), [])
+        self.assertFalse(
+            os.path.exists(os.path.join(self.diskq, 'BATCH', label + '.slurm')))
+
+    def test_iter_tasks_priority_order(self):
+        store = task_store.TaskStore(self.diskq)
+        labels = ['projA-x-s-x-sess%d-x-proc' % i for i in range(5)] + \
+                 ['projB-x-s-x-sess%d-x-proc' % i for i in range(5)]
+        for label in labels:
+            store.add_task(label)
+
+        # Launching tasks while iterating does not skip or repeat any
+        found = list()
+        for label in store.iter_tasks(status=NEED_TO_RUN,
+                                      proj_filter=['projB', 'projA'],
+                                      chunk_size=2):
+            store.set_attrs(label, {'procstatus': JOB_RUNNING})
+            found.append(label)
+        self.assertEqual(found, labels[5:] + labels[:5])
+        self.assertEqual(store.count_tasks(status=NEED_TO_RUN), 0)
+
+        # Stopping early only reads the first chunk
+        task_iter = store.iter_tasks(status=JOB_RUNNING, chunk_size=2)
+        self.assertEqual(next(task_iter), labels[0])
+        task_iter.close()
+
+    def test_launch_jobs_session_filter(self):
+        store = task_store.get_task_store(self.diskq)
+        for sess in ['sess1', 'sess2', 'sess3']:
+            store.add_task('proj1-x-subj1-x-%s-x-proc1' % sess)
+
+        launcher = Launcher.__new__(Launcher)
+        launcher.launcher_type = 'diskq-combined'
+        launcher.resdir = self.resdir
+        launched = list()
+        with mock.patch.object(Launcher, 'init_script',
+                               return_value=['proj1']), \
+                mock.patch.object(Launcher, 'finish_script'), \
+                mock.patch.object(
+                    Launcher, 'launch_tasks',
+                    side_effect=lambda tasks, **kwargs: launched.extend(
+                        x.assessor_label for x in tasks)):
+            launcher.launch_jobs('prefix', 'proj1', 'sess1, sess3')
+            self.assertEqual(launched, ['proj1-x-subj1-x-sess1-x-proc1',
+                                        'proj1-x-subj1-x-sess3-x-proc1'])
+
+            launched.clear()
+            launcher.launch_jobs('prefix', 'proj1', 'all')
+            self.assertEqual(len(launched), 3)
@@ -0,0 +1,301 @@
+
+import functools
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from unittest import TestCase, mock
+
+import requests
+
+from dax import dax_tools_utils
+from dax.upload_service import UploadService
+
+
+class FakeResource(object):
+    """ Resource recording the files of the zips put on it """
+    def __init__(self, fail_after=None):
+        self.files = list()
+        self.puts = 0
+        self.fail_after = fail_after
+
+    def exists(self):
+        return bool(self.files)
+
+    def delete(self):
+        self.files = list()
+
+    def put_zip(self, fzip, overwrite=False, extract=True):
+        if self.fail_after is not None and self.puts >= self.fail_after:
+            raise IOError('connection lost')
+        self.puts += 1
+        with zipfile.ZipFile(fzip) as zf:
+            self.files.extend(zf.namelist())
+
+
+class FakeAssessor(object):
+    def __init__(self, resource):
+        self.resource = resource
+
+    def out_resource(self, label):
+        return self.resource
+
+
+class UploadStateUnitTests(TestCase):
+
+    def setUp(self):
+        self.assessor_path = tempfile.mkdtemp()
+        self.resource_path = os.path.join(self.assessor_path, 'DATA')
+        os.makedirs(os.path.join(self.resource_path, 'sub'))
+        for i in range(5):
+            with open(os.path.join(self.resource_path, 'sub', 'f%d' % i),
+                      'w') as f:
+                f.write('data')
+
+    def tearDown(self):
+        shutil.rmtree(self.assessor_path)
+
+    def test_resume_after_interruption(self):
+        old_batch = dax_tools_utils.UPLOAD_BATCH_FILES
+        dax_tools_utils.UPLOAD_BATCH_FILES = 2
+        try:
+            # Interrupted after the first zip
+            resource = FakeResource(fail_after=1)
+            state = dax_tools_utils.UploadState(self.assessor_path)
+            with self.assertRaises(IOError):
+                dax_tools_utils.upload_resource(
+                    FakeAssessor(resource), 'DATA', self.resource_path, state)
+            self.assertEqual(resource.files, ['sub/f0', 'sub/f1'])
+
+            # A new attempt only sends the files left
+            resource.fail_after = None
+            state = dax_tools_utils.UploadState(self.assessor_path)
+            dax_tools_utils.upload_resource(
+                FakeAssessor(resource), 'DATA', self.resource_path, state)
+            self.assertEqual(sorted(resource.files),
+                             ['sub/f%d' % i for i in range(5)])
+            self.assertEqual(resource.puts, 3)
+
+            # Nothing left to send
+            dax_tools_utils.upload_resource(
+                FakeAssessor(resource), 'DATA', self.resource_path, state)
+            self.assertEqual(resource.puts, 3)
+            self.assertEqual(os.listdir(self.assessor_path).count('DATA_0.zip'),
+                             0)
+        finally:
+            dax_tools_utils.UPLOAD_BATCH_FILES = old_batch
+
+    @mock.patch('dax.dax_tools_utils.XnatUtils.put_zip_stream',
+                side_effect=requests.ConnectionError('connection reset'))
+    def test_stream_falls_back_to_zip(self, put_zip_stream):
+        resource = FakeResource()
+        state = dax_tools_utils.UploadState(self.assessor_path)
+        dax_tools_utils.upload_batch(
+            resource, 'DATA', self.resource_path, {'sub/f0': None}, 0, state,
+            stream=True)
+        self.assertEqual(put_zip_stream.call_count, 1)
+        self.assertEqual(resource.files, ['sub/f0'])
+
+    @mock.patch('dax.dax_tools_utils.upload_resource_retry')
+    def test_stream_resources_from_settings(self, upload_resource_retry):
+        with mock.patch.dict(os.environ,
+                             {'DAX_UPLOAD_STREAM_RESOURCES': 'DATA, PDF'}):
+            self.assertTrue(dax_tools_utils.upload_resources(
+                FakeAssessor(FakeResource()), self.assessor_path))
+        self.assertTrue(upload_resource_retry.call_args[0][4])
+
+        dax_tools_utils.upload_resources(
+            FakeAssessor(FakeResource()), self.assessor_path,
+            stream_resources=[])
+        self.assertFalse(upload_resource_retry.call_args[0][4])
+
+
+class FakeInterface(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def touch_upload(updir, pindex, assessor_label, pcount, xnat=None):
+    if assessor_label.endswith('bad'):
+        raise IOError('connection lost')
+    open(os.path.join(updir, assessor_label), 'w').close()
+
+
+def exit_upload(pindex, assessor_label, pcount, xnat=None):
+    os._exit(1)
+
+
+def touch_prepare(updir, assessor_label):
+    open(os.path.join(updir, assessor_label + '.prepared'), 'w').close()
+
+
+class UploadServiceUnitTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_upload_queued_labels(self):
+        labels = ['a1', 'a2', 'a3bad']
+        with mock.patch('dax.upload_service.XnatUtils.get_interface',
+                        return_value=FakeInterface()):
+            service = UploadService(
+                'host', functools.partial(touch_upload, self.tmpdir),
+                lambda: labels, num_workers=2)
+            service.start(watch=False)
+            self.assertEqual(service.scan(), 3)
+            # Labels already uploaded are not queued again
+            service.wait(poll_interval=0.1)
+            self.assertEqual(service.scan(), 0)
+            errors = service.stop()
+
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['a1', 'a2'])
+        self.assertEqual(len(errors), 1)
+        self.assertIn('a3bad', errors[0])
+        self.assertEqual(service.status()['finished'], 3)
+
+    def test_prepare_before_upload(self):
+        with mock.patch('dax.upload_service.XnatUtils.get_interface',
+                        return_value=FakeInterface()):
+            service = UploadService(
+                'host', functools.partial(touch_upload, self.tmpdir),
+                lambda: ['a1', 'a2'], num_workers=1,
+                prepare_func=functools.partial(touch_prepare, self.tmpdir),
+                prepare_workers=2)
+            service.start(watch=False)
+            service.scan()
+            service.wait(poll_interval=0.1)
+            errors = service.stop()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['a1', 'a1.prepared', 'a2', 'a2.prepared'])
+
+    def test_dead_worker_restarted_by_owner(self):
+        with mock.patch('dax.upload_service.XnatUtils.get_interface',
+                        return_value=FakeInterface()):
+            service = UploadService(
+                'host', exit_upload, lambda: ['a1'], num_workers=1,
+                scan_interval=0.05)
+            service.start()
+            worker = service.workers[0]
+            worker.join(timeout=10)
+            self.assertEqual(worker.exitcode, 1)
+
+            # The watcher thread does not fork a new worker
+            time.sleep(0.2)
+            self.assertIs(service.workers[0], worker)
+
+            service.check_workers()
+            self.assertIsNot(service.workers[0], worker)
+            self.assertTrue(service.workers[0].is_alive())
+            self.assertEqual(service.restarts, 1)
+            service.stop()
+
+
+class ResdirIndexUnitTests(TestCase):
+    def setUp(self):
+        self.resdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.resdir)
+
+    def make_assessor(self, label, flags, mtime):
+        path = os.path.join(self.resdir, label)
+        os.makedirs(path)
+        for flag in flags:
+            open(os.path.join(path, flag), 'w').close()
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_only_changed_folders_checked(self):
+        ready = [dax_tools_utils._READY_FLAG_FILE,
+                 dax_tools_utils._COMPLETE_FLAG_FILE]
+        self.make_assessor('P-x-S-x-E-x-A-x-proc', ready, 2000)
+        self.make_assessor('P-x-S-x-E-x-B-x-proc', ready, 1000)
+        running = self.make_assessor('P-x-S-x-E-x-C-x-proc', [], 3000)
+        os.makedirs(os.path.join(self.resdir, 'OUTLOG'))
+
+        self.assertEqual(
+            dax_tools_utils.get_assessor_list(None, self.resdir),
+            ['P-x-S-x-E-x-B-x-proc', 'P-x-S-x-E-x-A-x-proc'])
+
+        # The job of C is done, the others are not checked again
+        for flag in ready:
+            open(os.path.join(running, flag), 'w').close()
+        os.utime(running, (4000, 4000))
+        with mock.patch('dax.dax_tools_utils.get_upload_state',
+                        wraps=dax_tools_utils.get_upload_state) as state:
+            labels = dax_tools_utils.get_assessor_list(['P'], self.resdir)
+
+        state.assert_called_once_with(running)
+        self.assertEqual(labels, ['P-x-S-x-E-x-B-x-proc',
+                                  'P-x-S-x-E-x-A-x-proc',
+                                  'P-x-S-x-E-x-C-x-proc'])
+        self.assertEqual(
+            dax_tools_utils.get_assessor_list(['Q'], self.resdir), [])
+
+
+class SnapshotsUnitTests(TestCase):
+    def setUp(self):
+        self.assessor_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.assessor_path, 'PDF'))
+        self.pdf_path = os.path.join(self.assessor_path, 'PDF', 'report.pdf')
+        with open(self.pdf_path, 'w') as f:
+            f.write('%PDF-1.4 first')
+
+    def tearDown(self):
+        shutil.rmtree(self.assessor_path)
+
+    @staticmethod
+    def fake_gs(cmd, **kwargs):
+        output = kwargs.get('original', '')
+        if 'preview' in kwargs:
+            output = kwargs['preview']
+        with open(output, 'w') as f:
+            f.write('png')
+        return True
+
+    def test_snapshots_made_once_per_pdf(self):
+        with mock.patch('dax.dax_tools_utils._run_snapshot_cmd',
+                        side_effect=self.fake_gs) as run:
+            dax_tools_utils.generate_snapshots(self.assessor_path)
+            self.assertEqual(run.call_count, 2)
+
+            # Same PDF, nothing to do
+            dax_tools_utils.generate_snapshots(self.assessor_path)
+            self.assertEqual(run.call_count, 2)
+
+            with open(self.pdf_path, 'w') as f:
+                f.write('%PDF-1.4 second')
+            dax_tools_utils.generate_snapshots(self.assessor_path)
+            self.assertEqual(run.call_count, 4)
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.assessor_path, 'SNAPSHOTS'))),
+            [dax_tools_utils.SNAPSHOTS_ORIGINAL,
+             dax_tools_utils.SNAPSHOTS_PREVIEW])
+
+    def test_failed_preview_made_again(self):
+        def fail_preview(cmd, **kwargs):
+            if 'preview' in kwargs:
+                return False
+            return self.fake_gs(cmd, **kwargs)
+
+        with mock.patch('dax.dax_tools_utils._run_snapshot_cmd',
+                        side_effect=fail_preview) as run:
+            dax_tools_utils.generate_snapshots(self.assessor_path)
+            self.assertEqual(run.call_count, 2)
+
+        with mock.patch('dax.dax_tools_utils._run_snapshot_cmd',
+                        side_effect=self.fake_gs) as run:
+            dax_tools_utils.generate_snapshots(self.assessor_path)
+            self.assertEqual(run.call_count, 2)
+
+            dax_tools_utils.generate_snapshots(self.assessor_path)
+            self.assertEqual(run.call_count, 2)
@@ -1,3 +1,4 @@
+import itertools as it
 from unittest import TestCase
 from dax import utilities
 
@@ -67,3 +68,23 @@ class GroupbyToDictTest(TestCase):
         for t in tests:
             actual = utilities.strip_leading_and_trailing_spaces(t[0])
             self.assertEqual(actual, t[1])
+
+
+class FilteredProductTest(TestCase):
+
+    def test_filtered_product(self):
+        dimensions = [[1, 2, 3], ['a', 'b'], [True, False]]
+        self.assertEqual(list(utilities.filtered_product(dimensions)),
+                         list(it.product(*dimensions)))
+
+        # The check is run once per prefix, before the last dimension
+        calls = []
+
+        def check(chosen):
+            calls.append(chosen)
+            return chosen[0] == 2
+
+        actual = list(utilities.filtered_product(dimensions, [(1, check)]))
+        self.assertEqual(actual, [x for x in it.product(*dimensions)
+                                  if x[0] == 2])
+        self.assertEqual(calls, [(1,), (2,), (3,)])
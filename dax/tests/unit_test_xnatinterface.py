@@ -1,10 +1,12 @@
 
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import itertools
 
+import requests
 
 from dax import XnatUtils
+from dax import retry
 
 
 class InterfaceTempUnitTests(TestCase):
@@ -92,3 +94,50 @@ class InterfaceTempUnitTests(TestCase):
                     t[1],
                     XnatUtils.InterfaceTemp.object_type_from_path(instr),
                     'unexpected object type')
+
+    def test_get_many_keeps_order(self):
+        intf = XnatUtils.InterfaceTemp.__new__(XnatUtils.InterfaceTemp)
+        intf.xnat_max_concurrency = 4
+        intf._exec = lambda uri, method='GET': uri.upper()
+
+        uris = ['/data/a{}'.format(i) for i in range(20)]
+        self.assertListEqual(
+            [x.upper() for x in uris], intf.get_many(uris))
+
+        intf.xnat_max_concurrency = 1
+        self.assertListEqual(['/DATA/B'], intf.get_many(['/data/b']))
+
+    def test_unexpected_error_ends_breaker_trial(self):
+        intf = XnatUtils.InterfaceTemp.__new__(XnatUtils.InterfaceTemp)
+        intf.xnat_retries = 0
+        intf.xnat_timeout = 1
+        intf.breaker = retry.CircuitBreaker(threshold=1, cooldown=0)
+        intf.breaker.record_failure(1.0)
+
+        error = requests.exceptions.ChunkedEncodingError('broken')
+        with mock.patch.object(XnatUtils.Interface, '_exec',
+                               side_effect=error):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                intf._exec('/data/projects')
+
+        # The trial failed, the next request gets a new trial
+        self.assertEqual(intf.breaker.state, retry.OPEN)
+        self.assertTrue(intf.breaker.allow())
+
+    def test_zip_stream_timeout_recorded(self):
+        intf = XnatUtils.InterfaceTemp.__new__(XnatUtils.InterfaceTemp)
+        intf.xnat_timeout = 7
+        intf.breaker = retry.CircuitBreaker(threshold=1, cooldown=300)
+        intf.post = mock.Mock(side_effect=requests.exceptions.ReadTimeout())
+        resource_obj = mock.Mock(_uri='/data/experiments/E1/resources/R1',
+                                 _intf=intf)
+
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            XnatUtils.put_zip_stream(resource_obj, 'R1.zip', '/tmp')
+        self.assertEqual(intf.post.call_args[1]['timeout'], 7)
+
+        # The breaker is open, the next upload fails fast
+        self.assertEqual(intf.breaker.stats()['failures'], 1)
+        with self.assertRaises(XnatUtils.XnatUtilsError):
+            XnatUtils.put_zip_stream(resource_obj, 'R1.zip', '/tmp')
+        self.assertEqual(intf.post.call_count, 1)
@@ -1,6 +1,8 @@
 from unittest import TestCase
 
 import json
+import os
+import tempfile
 
 from dax import XnatUtils
 from dax import assessor_utils
@@ -51,3 +53,284 @@ class XnatUtilsUnitTest(TestCase):
         for t in range(len(test_entries)):
             name = assessor_utils.full_label(*test_entries[t])
             self.assertEqual(test_names[t], name)
+
+    def test_load_cached_sessions_uses_xml_cache(self):
+        class TestExperiment:
+            def __init__(self, label):
+                self._uri = '/data/experiments/' + label
+
+        class TestInterface:
+            def __init__(self):
+                self.fetched = []
+
+            def select_experiment(self, proj, subj, sess):
+                return TestExperiment(sess)
+
+            def get_many(self, uris):
+                self.fetched.extend(uris)
+                return ['<MRSession label="{}"/>'.format(
+                    x.split('/')[-1].split('?')[0]) for x in uris]
+
+        sess_list = [{'project_label': 'proj1', 'subject_label': 'subj1',
+                      'session_label': label, 'session_id': 'ID_' + label,
+                      'last_modified': '2020-01-01 10:00:00.0'}
+                     for label in ['sess1', 'sess2']]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            intf = TestInterface()
+            csess_list = XnatUtils.load_cached_sessions(
+                intf, sess_list, cache_dir=cache_dir)
+            self.assertEqual(len(intf.fetched), 2)
+            self.assertEqual([x.label() for x in csess_list],
+                             ['sess1', 'sess2'])
+
+            # Unchanged sessions come from the cache
+            intf = TestInterface()
+            csess_list = XnatUtils.load_cached_sessions(
+                intf, sess_list, cache_dir=cache_dir)
+            self.assertEqual(intf.fetched, [])
+            self.assertEqual([x.label() for x in csess_list],
+                             ['sess1', 'sess2'])
+
+            # A modified session is downloaded again and replaces the old XML
+            sess_list[1]['last_modified'] = '2020-01-02 10:00:00.0'
+            csess_list = XnatUtils.load_cached_sessions(
+                intf, sess_list, cache_dir=cache_dir)
+            self.assertEqual(intf.fetched,
+                             ['/data/experiments/sess2?format=xml'])
+            self.assertEqual(
+                len(os.listdir(os.path.join(cache_dir, 'proj1'))), 2)
+
+    def test_cached_session_patch_assessors(self):
+        class TestExperiment:
+            _uri = '/data/experiments/sess1'
+
+        class TestInterface:
+            def select_experiment(self, proj, subj, sess):
+                return TestExperiment()
+
+        xml_str = '<xnat:MRSession xmlns:xnat="http://nrg.wustl.edu/xnat" ' \
+                  'ID="ID_sess1" label="sess1"/>'
+        csess = XnatUtils.CachedImageSession(
+            TestInterface(), 'proj1', 'subj1', 'sess1', xml_str=xml_str)
+        self.assertEqual(csess.assessors(), [])
+        self.assertIsNone(
+            csess.assessor('proj1-x-subj1-x-sess1-x-proc1-x-guid1'))
+
+        csess.add_assessor('guid1', 'proj1-x-subj1-x-sess1-x-proc1-x-guid1',
+                           'proc:genProcData',
+                           {'proc:genprocdata/proctype': 'proc1_v1',
+                            'proc:genprocdata/inputs': '{"a": "b"}'})
+        assessors = csess.assessors()
+        self.assertEqual(len(assessors), 1)
+        info = assessors[0].info()
+        self.assertEqual(info['proctype'], 'proc1_v1')
+        self.assertEqual(info['inputs'], {'a': 'b'})
+        self.assertEqual(info['procstatus'], '')
+        self.assertIs(
+            csess.assessor('proj1-x-subj1-x-sess1-x-proc1-x-guid1'),
+            assessors[0])
+
+        csess.set_assessor_status(
+            'proj1-x-subj1-x-sess1-x-proc1-x-guid1', 'JOB_RUNNING',
+            'Job Pending')
+        info = csess.assessors()[0].info()
+        self.assertEqual(info['procstatus'], 'JOB_RUNNING')
+        self.assertEqual(info['qcstatus'], 'Job Pending')
+
+    def test_compact_record(self):
+        session = {'session_label': 'sess1', 'subject_label': 'subj1'}
+        scan1 = XnatUtils.CompactRecord(
+            XnatUtils.SCAN_RECORD_SCHEMA,
+            ['1', 'usable', '', '', 'T1 MPRAGE', 'T1', ['NIFTI']], session)
+        scan2 = XnatUtils.CompactRecord(
+            XnatUtils.SCAN_RECORD_SCHEMA,
+            ['2', 'usable', '', '', 'FLAIR', 'FLAIR', ['DICOM']], session)
+
+        self.assertEqual(scan1['ID'], '1')
+        self.assertEqual(scan1['scan_label'], '1')
+        self.assertEqual(scan2['type'], 'FLAIR')
+        self.assertEqual(scan2.get('session_label'), 'sess1')
+        self.assertIsNone(scan2.get('missing'))
+        self.assertIn('subject_label', scan1)
+        self.assertEqual(len(dict(scan1)), len(scan1))
+
+        # Updates only change the record they are made on
+        scan1['resources'].append('DICOM')
+        scan1['label'] = 'one'
+        scan1['session_label'] = 'sess2'
+        self.assertEqual(scan1['resources'], ['NIFTI', 'DICOM'])
+        self.assertEqual(scan1['label'], 'one')
+        self.assertEqual(scan1['ID'], '1')
+        self.assertEqual(scan1['session_label'], 'sess2')
+        self.assertEqual(scan2['session_label'], 'sess1')
+
+    def test_iter_zip_stream(self):
+        import io
+        import zipfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, 'sub'))
+            contents = {'a.txt': b'a' * 5000,
+                        os.path.join('sub', 'b.txt'): os.urandom(500000)}
+            for relpath, data in contents.items():
+                with open(os.path.join(directory, relpath), 'wb') as f:
+                    f.write(data)
+
+            chunks = list(XnatUtils.iter_zip_stream(directory,
+                                                    chunk_size=16384))
+            self.assertGreater(len(chunks), 10)
+            self.assertLessEqual(max(len(c) for c in chunks), 4 * 16384)
+
+            with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+                self.assertEqual(sorted(zf.namelist()), ['a.txt', 'sub/b.txt'])
+                for relpath, data in contents.items():
+                    self.assertEqual(zf.read(relpath.replace(os.sep, '/')),
+                                     data)
+
+    def test_upload_files_to_obj_diff(self):
+        class TestFile:
+            def __init__(self, resource, name):
+                self.resource = resource
+                self.name = name
+
+            def put(self, src, overwrite=False, params=None):
+                self.resource.requests.append(('put', self.name))
+
+            def delete(self):
+                self.resource.requests.append(('delete', self.name))
+
+        class TestResource:
+            _uri = '/data/experiments/E1/out/resources/DATA'
+
+            def __init__(self, rows):
+                self.requests = list()
+                resource = self
+
+                class TestIntf:
+                    def _get_json(self, uri):
+                        resource.requests.append(('list', uri))
+                        return rows
+
+                self._intf = TestIntf()
+
+            def file(self, name):
+                return TestFile(self, name)
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = list()
+            for name, data in [('same.txt', 'abc'), ('changed.txt', 'abd'),
+                               ('new.txt', 'a')]:
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], 'w') as f:
+                    f.write(data)
+
+            # Same size, only the md5 differs for changed.txt
+            rows = [{'Name': 'same.txt', 'path': 'same.txt', 'Size': '3',
+                     'digest': '900150983cd24fb0d6963f7d28e17f72'},
+                    {'Name': 'changed.txt', 'path': 'changed.txt',
+                     'Size': '3',
+                     'digest': '900150983cd24fb0d6963f7d28e17f72'},
+                    {'Name': 'old.txt', 'path': 'old.txt', 'Size': '3'}]
+
+            # Existing files are not replaced without remove
+            resource = TestResource(rows)
+            status = XnatUtils.upload_files_to_obj(paths, resource)
+            self.assertEqual(status, [False, False, True])
+            self.assertEqual(resource.requests,
+                             [('list', TestResource._uri + '/files'),
+                              ('put', 'new.txt')])
+
+            resource = TestResource(rows)
+            status = XnatUtils.upload_files_to_obj(paths, resource,
+                                                   removeall=True)
+            self.assertEqual(status, [True, True, True])
+            self.assertEqual(resource.requests[1:],
+                             [('put', 'changed.txt'), ('put', 'new.txt'),
+                              ('delete', 'old.txt')])
+
+            # Without a digest on XNAT, the file is replaced
+            del rows[0]['digest']
+            resource = TestResource(rows)
+            XnatUtils.upload_files_to_obj(paths, resource, remove=True)
+            self.assertEqual(resource.requests[1:],
+                             [('put', 'same.txt'), ('put', 'changed.txt'),
+                              ('put', 'new.txt')])
+
+    def test_get_sessions_modified_since(self):
+        mr_type = 'xnat:mrsessiondata'
+        rows = {
+            'modified': [
+                {'ID': 'E1', 'subject_ID': 'S1', 'xsiType': mr_type,
+                 'last_modified': '2024-01-02 10:30:00.0'},
+                {'ID': 'E2', 'subject_ID': 'S2', 'xsiType': mr_type,
+                 'last_modified': '2024-01-02 08:00:00.0'}],
+            'types': [{'xsiType': mr_type}],
+            'sessions': [
+                {'ID': x, 'subject_ID': s, 'subject_label': s, 'label': x,
+                 mr_type + '/meta/last_modified': '2024-01-01 00:00:00.0'}
+                for x, s in [('E0', 'S1'), ('E1', 'S1'), ('E2', 'S2')]]}
+
+        class TestIntf(XnatUtils.InterfaceTemp):
+            def __init__(self):
+                self.xnat_max_concurrency = 1
+                self.demographics = {}
+                self.uris = []
+
+            def _get_json(self, uri):
+                self.uris.append(uri)
+                if 'last_modified=' in uri:
+                    return rows['modified']
+                elif uri.endswith('columns=xsiType'):
+                    return rows['types']
+                return [dict(x) for x in rows['sessions']]
+
+        since = XnatUtils.datetime(2024, 1, 2, 9, 0)
+        intf = TestIntf()
+        sessions = intf.get_sessions_minimal('P', modified_since=since)
+        self.assertEqual([x['label'] for x in sessions], ['E0', 'E1'])
+        self.assertIn('last_modified=01/01/2024-', intf.uris[0])
+
+        # Nothing modified, a single query
+        intf = TestIntf()
+        since = XnatUtils.datetime(2024, 1, 2, 11, 0)
+        self.assertEqual(intf.get_sessions('P', modified_since=since), [])
+        self.assertEqual(len(intf.uris), 1)
+
+    def test_demographics_reloaded_for_new_subjects(self):
+        mr_type = 'xnat:mrsessiondata'
+        subjects = [{'ID': 'S1', 'handedness': 'right', 'gender': 'female',
+                     'yob': '1970', 'dob': ''}]
+        sessions = [{'ID': 'E1', 'subject_ID': 'S1', 'label': 'E1'}]
+
+        class TestIntf(XnatUtils.InterfaceTemp):
+            def __init__(self):
+                self.xnat_max_concurrency = 1
+                self.demographics = {}
+                self.subject_requests = 0
+
+            def _get_json(self, uri):
+                if uri.endswith('columns=xsiType'):
+                    return [{'xsiType': mr_type}]
+                return [dict(x) for x in sessions]
+
+            def get_subjects(self, projectid=None):
+                self.subject_requests += 1
+                return [dict(x) for x in subjects]
+
+        intf = TestIntf()
+        intf.get_sessions('P')
+        self.assertEqual(intf.subject_requests, 1)
+
+        # New subject, loaded again once
+        subjects.append(dict(subjects[0], ID='S2', gender='male'))
+        sessions.append({'ID': 'E2', 'subject_ID': 'S2', 'label': 'E2'})
+        self.assertEqual([x['gender'] for x in intf.get_sessions('P')],
+                         ['female', 'male'])
+        self.assertEqual(intf.subject_requests, 2)
+
+        # Subject of another project, unknown without loading every time
+        sessions.append({'ID': 'E3', 'subject_ID': 'S3', 'label': 'E3'})
+        self.assertEqual(intf.get_sessions('P')[-1]['gender'], 'UNK')
+        intf.get_sessions('P')
+        self.assertEqual(intf.subject_requests, 3)
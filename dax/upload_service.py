@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" upload_service.py
+
+Long-lived pool of upload workers fed by a watcher on the upload directory
+"""
+
+import functools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from . import XnatUtils
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['UploadService']
+LOGGER = logging.getLogger('dax')
+
+# Messages from the workers
+STARTED = 'started'
+DONE = 'done'
+FAILED = 'failed'
+# Workers started again after dying, before giving up on the queued uploads
+MAX_WORKER_RESTARTS = 10
+
+
+def upload_worker(xnat_host, upload_func, task_queue, result_queue):
+    """
+    Upload the assessors pulled from the task queue, with a single XNAT
+     connection, until it gets None
+
+    :param xnat_host: XNAT host url
+    :param upload_func: function(pindex, assessor_label, pcount, xnat)
+     uploading one assessor
+    :param task_queue: queue of (pindex, assessor_label, pcount)
+    :param result_queue: queue for (assessor_label, state, message), the
+     message is the pid of the worker for STARTED and the error for FAILED
+    :return: None
+    """
+    LOGGER.info('connecting to xnat for upload:{}'.format(xnat_host))
+    with XnatUtils.get_interface(xnat_host) as xnat:
+        while True:
+            item = task_queue.get()
+            if item is None:
+                break
+
+            pindex, assessor_label, pcount = item
+            result_queue.put((assessor_label, STARTED, os.getpid()))
+            try:
+                upload_func(pindex, assessor_label, pcount, xnat=xnat)
+                result_queue.put((assessor_label, DONE, None))
+            except Exception as err:
+                LOGGER.error(traceback.format_exc())
+                result_queue.put((assessor_label, FAILED, str(err)))
+
+
+class UploadService(object):
+    """
+    Upload worker processes kept for the life of the service. Each worker
+     connects to XNAT once and uploads the assessors it pulls from a shared
+     queue. A watcher thread scans for assessors ready to upload every
+     scan_interval seconds and queues the new ones, so an upload starts
+     shortly after its job is done. With a prepare_func, the new assessors
+     go through a separate pool of processes first, e.g. to make their
+     snapshots, and the upload workers never wait on it.
+    """
+    def __init__(self, xnat_host, upload_func, scan_func, num_workers=1,
+                 scan_interval=10, retry_delay=600, prepare_func=None,
+                 prepare_workers=1):
+        """
+        Entry point for the UploadService class
+
+        :param xnat_host: XNAT host url
+        :param upload_func: function(pindex, assessor_label, pcount, xnat)
+         uploading one assessor, run in the workers
+        :param scan_func: function returning the labels of the assessors
+         ready to upload
+        :param num_workers: number of upload processes
+        :param scan_interval: seconds between two scans
+        :param retry_delay: seconds before queueing again an assessor still
+         found after its upload
+        :param prepare_func: picklable function(assessor_label) run before
+         queueing an assessor for upload, None to queue it directly
+        :param prepare_workers: number of processes running prepare_func
+        :return: None
+        """
+        self.xnat_host = xnat_host
+        self.upload_func = upload_func
+        self.scan_func = scan_func
+        self.num_workers = num_workers
+        self.scan_interval = scan_interval
+        self.retry_delay = retry_delay
+        self.prepare_func = prepare_func
+        self.prepare_workers = prepare_workers
+        self.prepare_pool = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.task_queue = None
+        self.result_queue = None
+        self.workers = list()
+        self.threads = list()
+        self.queued = dict()
+        self.running = dict()
+        self.finished = dict()
+        self.errors = list()
+        self.count = 0
+        self.restarts = 0
+
+    def start(self, watch=True):
+        """
+        Start the workers and the threads of the service
+
+        :param watch: scan for new assessors every scan_interval seconds,
+         False to only upload the ones queued by calling scan
+        :return: None
+        """
+        self.task_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        for _ in range(self.num_workers):
+            self.workers.append(self._start_worker())
+
+        if self.prepare_func:
+            # The pool starts its processes from the watcher thread, a fork
+            # server keeps them from being forked while other threads hold
+            # locks
+            self.prepare_pool = ProcessPoolExecutor(
+                self.prepare_workers,
+                mp_context=multiprocessing.get_context('forkserver'))
+
+        targets = [self._collect]
+        if watch:
+            targets.append(self._watch)
+
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _start_worker(self):
+        worker = multiprocessing.Process(
+            target=upload_worker,
+            args=(self.xnat_host, self.upload_func,
+                  self.task_queue, self.result_queue),
+            daemon=True)
+        worker.start()
+        return worker
+
+    def scan(self):
+        """
+        Queue the assessors ready to upload that are not queued yet
+
+        :return: number of assessors queued
+        """
+        labels = self.scan_func()
+        now = time.time()
+        new_labels = list()
+        with self.lock:
+            for label in labels:
+                if label in self.queued or label in self.running:
+                    continue
+
+                if now - self.finished.get(label, 0) < self.retry_delay:
+                    continue
+
+                self.queued[label] = now
+                new_labels.append(label)
+
+        if new_labels:
+            LOGGER.info('queued for upload:{}'.format(len(new_labels)))
+
+        for label in new_labels:
+            if self.prepare_pool:
+                future = self.prepare_pool.submit(self.prepare_func, label)
+                future.add_done_callback(
+                    functools.partial(self._prepared, label))
+            else:
+                self._put(label)
+
+        return len(new_labels)
+
+    def _prepared(self, label, future):
+        if future.exception():
+            # The upload makes what is missing itself
+            LOGGER.warn('failed to prepare upload:{}:{}'.format(
+                label, future.exception()))
+        self._put(label)
+
+    def _put(self, label):
+        with self.lock:
+            self.task_queue.put((self.count, label, self.count + 1))
+            self.count += 1
+
+    def check_workers(self):
+        """
+        Replace the workers that died, their uploads are counted as failed.
+         After MAX_WORKER_RESTARTS, the queued uploads fail once no worker
+         is left, e.g. when XNAT can not be reached. Call it from the thread
+         that started the service, like wait does: a worker forked from
+         another thread can deadlock on a lock held at the time of the fork.
+
+        :return: None
+        """
+        for i, worker in enumerate(self.workers):
+            if worker.exitcode is None:
+                continue
+
+            with self.lock:
+                for label, pid in list(self.running.items()):
+                    if pid == worker.pid:
+                        self._finish(label, 'upload worker died')
+
+            if self.stop_event.is_set() or \
+               self.restarts >= MAX_WORKER_RESTARTS:
+                continue
+
+            LOGGER.warn('upload worker {} exited:{}, restarting'.format(
+                worker.pid, worker.exitcode))
+            self.restarts += 1
+            self.workers[i] = self._start_worker()
+
+        if not any(w.is_alive() for w in self.workers):
+            with self.lock:
+                for label in list(self.queued.keys()):
+                    self._finish(label, 'no upload worker left')
+
+    def _watch(self):
+        while not self.stop_event.is_set():
+            try:
+                self.scan()
+            except Exception:
+                LOGGER.error(traceback.format_exc())
+
+            self.stop_event.wait(self.scan_interval)
+
+    def _collect(self):
+        while True:
+            try:
+                label, state, message = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                if self.stop_event.is_set() and \
+                   not any(w.is_alive() for w in self.workers):
+                    break
+                continue
+
+            with self.lock:
+                if state == STARTED:
+                    self.queued.pop(label, None)
+                    # Pid of the worker, to find the uploads of a dead one
+                    self.running[label] = message
+                else:
+                    self._finish(label, message)
+
+    def _finish(self, label, error=None):
+        """
+        Record the end of an upload, the lock is the caller's
+
+        :param label: assessor label
+        :param error: error message, None if the upload went through
+        :return: None
+        """
+        self.queued.pop(label, None)
+        self.running.pop(label, None)
+        self.finished[label] = time.time()
+        if error:
+            self.errors.append('error uploading:{}:{}'.format(label, error))
+        LOGGER.info('upload finished:{}:{}'.format(label, error or 'ok'))
+
+    def pending(self):
+        """
+        Count the uploads queued or running
+
+        :return: number of uploads
+        """
+        with self.lock:
+            return len(self.queued) + len(self.running)
+
+    def status(self):
+        """
+        Get the progress of the service
+
+        :return: dictionary of counts
+        """
+        with self.lock:
+            return {'queued': len(self.queued),
+                    'running': len(self.running),
+                    'finished': len(self.finished),
+                    'errors': len(self.errors)}
+
+    def wait(self, poll_interval=1):
+        """
+        Wait until all the uploads queued are done
+
+        :param poll_interval: seconds between two checks
+        :return: None
+        """
+        while self.pending() > 0:
+            self.check_workers()
+            time.sleep(poll_interval)
+
+    def stop(self):
+        """
+        Stop the service once the workers are done with their current upload
+
+        :return: list of the upload errors
+        """
+        self.stop_event.set()
+        if self.prepare_pool:
+            # Uploads prepared from now on are queued before the workers stop
+            self.prepare_pool.shutdown()
+
+        for _ in self.workers:
+            self.task_queue.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        for thread in self.threads:
+            thread.join()
+
+        return list(self.errors)
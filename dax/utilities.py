@@ -9,10 +9,15 @@ import re
 import smtplib
 from email.mime.text import MIMEText
 import socket
+import functools
+import logging
 
 from .errors import DaxError
 
 
+LOGGER = logging.getLogger('dax')
+
+
 def parse_list(csv_string):
     """
     Split string on commas including any leading/trailing spaces with split
@@ -115,6 +120,88 @@ def find_with_pred(items, pred):
     return None
 
 
+def filtered_product(dimensions, checks=()):
+    """
+    Lazily generate the cartesian product of a list of dimensions, in the
+    order of itertools.product. A check is run as soon as the dimensions it
+    needs are chosen, so the combinations it rejects are never generated.
+
+    :param dimensions: list of lists of entries
+    :param checks: list of (size, check) tuples, check takes the tuple of
+    entries chosen for the first size dimensions and returns False to reject
+    them
+    :return: generator of tuples of entries, one per dimension
+    """
+    checks_by_size = [[] for _ in range(len(dimensions) + 1)]
+    for size, check in checks:
+        checks_by_size[size].append(check)
+
+    def _product(chosen):
+        if not all(check(chosen) for check in checks_by_size[len(chosen)]):
+            return
+
+        if len(chosen) == len(dimensions):
+            yield chosen
+        else:
+            for entry in dimensions[len(chosen)]:
+                yield from _product(chosen + (entry,))
+
+    return _product(())
+
+
+def matrix_row(all_inputs, entries):
+    """
+    Map input names to the entries chosen for the first dimensions
+
+    :param all_inputs: list of the input names of each dimension
+    :param entries: entries chosen, one per dimension
+    :return: dictionary of input name to value
+    """
+    row = dict()
+    for names, entry in zip(all_inputs, entries):
+        row.update(zip(names, entry))
+
+    return row
+
+
+def match_checks(match_filters, all_inputs, get_value):
+    """
+    Turn the match filters into checks for filtered_product, each pair of
+    inputs compared is checked once both are chosen
+
+    :param match_filters: list of lists of input names to match
+    :param all_inputs: list of the input names of each dimension
+    :param get_value: function of an input name and a row, returning the
+    value to compare
+    :return: list of (size, check) tuples
+    """
+    sizes = dict()
+    for i, names in enumerate(all_inputs):
+        for name in names:
+            sizes[name] = i + 1
+
+    def check(first_input, cur_input, entries):
+        row = matrix_row(all_inputs, entries)
+        first_val = get_value(first_input, row)
+        cur_val = get_value(cur_input, row)
+        if cur_val is None:
+            LOGGER.warn('cannot match, empty inputs:{}'.format(cur_input))
+            return False
+
+        return cur_val == first_val
+
+    checks = []
+    for cur_filter in match_filters:
+        for cur_input in cur_filter[1:]:
+            size = max(
+                sizes.get(x.split('/')[0], len(all_inputs))
+                for x in [cur_filter[0], cur_input])
+            checks.append((size, functools.partial(
+                check, cur_filter[0], cur_input)))
+
+    return checks
+
+
 def strip_leading_and_trailing_spaces(list_arg):
     return ','.join([x.strip() for x in list_arg.split(',')])
 